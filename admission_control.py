@@ -0,0 +1,259 @@
+"""
+Admission control with priority lanes for the FastAPI model services.
+
+A catalog rebuild sends thousands of /dense-embed and /image-embed calls; left
+alone they fill the thread pool and live search queries queue behind them.
+This middleware bounds how many model requests run at once and queues the
+rest in two lanes:
+
+    interactive   live queries (default)           always admitted first
+    bulk          indexing / catalog rebuilds      served only when no interactive
+                                                   request is waiting
+
+A request is bulk when it carries "X-Priority: bulk". When a lane's queue is
+full the request is rejected immediately: 429 for bulk, 503 for interactive,
+both with a Retry-After header estimated from the queue ahead and the recent
+service time. Only the controlled paths are queued; /metrics, /ready and the
+admin endpoints bypass admission.
+
+Metrics (service_metrics /metrics):
+    admission_queue_depth{lane}         requests waiting
+    admission_in_flight                 requests running
+    admission_rejected{lane}            rejected so far
+    request_stage_duration_seconds{stage="admission_wait_<lane>"}
+                                        queue wait histogram per endpoint
+
+Configuration (environment):
+    ADMISSION_MAX_CONCURRENCY      requests running at once (default: 4)
+    ADMISSION_INTERACTIVE_QUEUE    interactive queue bound (default: 256)
+    ADMISSION_BULK_QUEUE           bulk queue bound (default: 32)
+    ADMISSION_BULK_MAX_WAIT        seconds a bulk request may wait before 429 (default: 30)
+
+Usage:
+    from admission_control import install_admission_control
+
+    app = FastAPI()
+    install_admission_control(app, paths=("/dense-embed", "/image-embed"))  # before install_metrics
+    install_metrics(app, service="embeddings")
+"""
+
+import asyncio
+import json
+import math
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, Optional
+
+from fastapi import FastAPI
+
+from service_metrics import get_registry, route_label
+
+LANES = ("interactive", "bulk")
+PRIORITY_HEADER = b"x-priority"
+
+ADMISSION_MAX_CONCURRENCY = int(os.environ.get("ADMISSION_MAX_CONCURRENCY", "4"))
+ADMISSION_INTERACTIVE_QUEUE = int(os.environ.get("ADMISSION_INTERACTIVE_QUEUE", "256"))
+ADMISSION_BULK_QUEUE = int(os.environ.get("ADMISSION_BULK_QUEUE", "32"))
+ADMISSION_BULK_MAX_WAIT = float(os.environ.get("ADMISSION_BULK_MAX_WAIT", "30"))
+
+
+class Rejected(Exception):
+    """Raised by AdmissionController.acquire when a request is not admitted."""
+
+    def __init__(self, lane: str, retry_after: int):
+        super().__init__(f"{lane} queue full")
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Concurrency slots plus one bounded FIFO queue per lane.
+
+    Runs entirely on the event loop (no locks): acquire() either takes a free
+    slot, or parks a future in its lane; release() hands the slot to the
+    oldest interactive waiter, else the oldest bulk waiter.
+    """
+
+    def __init__(self, max_concurrency: int = ADMISSION_MAX_CONCURRENCY,
+                 queue_limits: Optional[Dict[str, int]] = None,
+                 bulk_max_wait: Optional[float] = ADMISSION_BULK_MAX_WAIT):
+        """
+        Args:
+            max_concurrency: Requests allowed to run at once
+            queue_limits: Lane -> maximum waiting requests
+            bulk_max_wait: Seconds a bulk request may wait before it is rejected
+        """
+        self.max_concurrency = max_concurrency
+        self.queue_limits = queue_limits or {"interactive": ADMISSION_INTERACTIVE_QUEUE,
+                                             "bulk": ADMISSION_BULK_QUEUE}
+        self.bulk_max_wait = bulk_max_wait
+        self.in_flight = 0
+        self.queues: Dict[str, Deque[asyncio.Future]] = {lane: deque() for lane in LANES}
+        self.rejected = {lane: 0 for lane in LANES}
+        self.admitted = {lane: 0 for lane in LANES}
+        # Exponentially weighted mean service time, for Retry-After estimates
+        self.service_seconds = 0.05
+
+    def retry_after(self, lane: str) -> int:
+        """Seconds until a request of this lane would likely be admitted."""
+        ahead = len(self.queues["interactive"]) + self.in_flight
+        if lane == "bulk":
+            ahead += len(self.queues["bulk"])
+        return max(1, math.ceil(ahead * self.service_seconds / max(self.max_concurrency, 1)))
+
+    async def acquire(self, lane: str) -> float:
+        """
+        Wait for a slot.
+
+        Returns:
+            Seconds spent queued
+
+        Raises:
+            Rejected: lane queue full, or bulk wait exceeded bulk_max_wait
+        """
+        start = time.perf_counter()
+        waiting = sum(len(q) for q in self.queues.values())
+        if self.in_flight < self.max_concurrency and waiting == 0:
+            self.in_flight += 1
+            self.admitted[lane] += 1
+            return 0.0
+
+        queue = self.queues[lane]
+        if len(queue) >= self.queue_limits[lane]:
+            self.rejected[lane] += 1
+            raise Rejected(lane, self.retry_after(lane))
+
+        future = asyncio.get_running_loop().create_future()
+        queue.append(future)
+        self.publish()
+        try:
+            timeout = self.bulk_max_wait if lane == "bulk" else None
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Slot was handed over just as we gave up: pass it on
+                self.release(0.0)
+            else:
+                future.cancel()
+                queue.remove(future)
+            self.publish()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.rejected[lane] += 1
+            raise Rejected(lane, self.retry_after(lane))
+        self.admitted[lane] += 1
+        return time.perf_counter() - start
+
+    def release(self, service_seconds: float):
+        """Free a slot (handing it straight to the next waiter) and update the service-time estimate."""
+        if service_seconds > 0:
+            self.service_seconds = 0.9 * self.service_seconds + 0.1 * service_seconds
+        for lane in LANES:
+            queue = self.queues[lane]
+            while queue:
+                future = queue.popleft()
+                if not future.done():
+                    future.set_result(None)  # slot transfers, in_flight unchanged
+                    self.publish()
+                    return
+        self.in_flight -= 1
+        self.publish()
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": {lane: len(q) for lane, q in self.queues.items()},
+            "admitted": dict(self.admitted),
+            "rejected": dict(self.rejected),
+            "service_seconds": self.service_seconds,
+        }
+
+    def publish(self):
+        """Export queue depth, in-flight and rejections as gauges."""
+        registry = get_registry()
+        if registry is None:
+            return
+        for lane in LANES:
+            registry.set_gauge("admission_queue_depth", len(self.queues[lane]),
+                               "Requests waiting for admission.", lane=lane)
+            registry.set_gauge("admission_rejected", self.rejected[lane],
+                               "Requests rejected by admission control (429/503).", lane=lane)
+        registry.set_gauge("admission_in_flight", self.in_flight, "Requests admitted and running.")
+
+
+def request_lane(scope) -> str:
+    """Lane of an ASGI request from its X-Priority header (interactive unless "bulk")."""
+    for name, value in scope.get("headers", ()):
+        if name == PRIORITY_HEADER:
+            return "bulk" if value.strip().lower() == b"bulk" else "interactive"
+    return "interactive"
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware applying an AdmissionController to selected paths."""
+
+    def __init__(self, app, controller: AdmissionController, paths: Iterable[str]):
+        self.app = app
+        self.controller = controller
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path") not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        lane = request_lane(scope)
+        try:
+            waited = await self.controller.acquire(lane)
+        except Rejected as e:
+            await self._reject(send, e)
+            return
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(time.perf_counter() - start)
+            # Recorded after the request so routing has set the route label
+            registry = get_registry()
+            if registry is not None:
+                registry.observe_stage(route_label(scope), f"admission_wait_{lane}", waited)
+
+    async def _reject(self, send, e: Rejected):
+        status = 429 if e.lane == "bulk" else 503
+        body = json.dumps({"detail": f"{e.lane} queue full, retry in {e.retry_after}s"}).encode()
+        await send({"type": "http.response.start", "status": status, "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(e.retry_after).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": body})
+
+
+def install_admission_control(app: FastAPI, paths: Iterable[str],
+                              controller: Optional[AdmissionController] = None) -> AdmissionController:
+    """
+    Queue requests to `paths` through priority lanes.
+
+    Install before install_metrics, so the metrics middleware wraps this one
+    and rejected requests still show up in http_requests_total.
+
+    Args:
+        app: FastAPI application
+        paths: Request paths under admission control (model endpoints)
+        controller: Controller to use (default: one configured from the environment)
+
+    Returns:
+        The AdmissionController
+    """
+    controller = controller or AdmissionController()
+    app.add_middleware(AdmissionMiddleware, controller=controller, paths=tuple(paths))
+
+    @app.get("/admin/admission", include_in_schema=False)
+    def admission_status():
+        return controller.stats()
+
+    return controller
@@ -35,9 +35,10 @@ public class DatabaseBuildingService {
 
         log.info("Inserting data");
         for (Product product : data) {
-            ArrayList<Float> dense = denseEmbeddingService.getEmbedding(product.getText());
-            ArrayList<Float> sparse = sparseEmbeddingService.getEmbedding(product.getText());
-            ArrayList<Float> image = imageEmbeddingService.getEmbedding(product.getProductId());
+            // bulk traffic: the embedding servers serve live queries first
+            ArrayList<Float> dense = denseEmbeddingService.getEmbedding(product.getText(), true);
+            ArrayList<Float> sparse = sparseEmbeddingService.getEmbedding(product.getText(), true);
+            ArrayList<Float> image = imageEmbeddingService.getEmbedding(product.getProductId(), true);
             product.updateEmbeddings(dense, sparse, image);
 
             log.info(product.toString());
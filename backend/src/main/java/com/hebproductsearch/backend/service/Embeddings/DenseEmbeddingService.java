@@ -20,15 +20,13 @@ public class DenseEmbeddingService {
     private final RestTemplate restTemplate = new RestTemplate();
 
     public ArrayList<Float> getEmbedding(String info){
-        // JSON request body
-        Map<String, String> requestBody = Map.of("query", info);
+        return getEmbedding(info, false);
+    }
 
+    // bulk = indexing traffic: queued behind live queries, retried on 429
+    public ArrayList<Float> getEmbedding(String info, boolean bulk){
         // Make the POST request and parse response as Map
-        Map<String, Object> response = restTemplate.postForObject(
-            embeddingUrl,
-            requestBody,
-            Map.class
-        );
+        Map<String, Object> response = EmbeddingRequests.post(restTemplate, embeddingUrl, info, bulk);
 
         // Extract the embedding array from JSON
         List<Double> returned = (List<Double>) response.get("dense_embedding");
@@ -0,0 +1,64 @@
+package com.hebproductsearch.backend.service.Embeddings;
+
+import java.util.Map;
+
+import org.springframework.http.HttpEntity;
+import org.springframework.http.HttpHeaders;
+import org.springframework.http.MediaType;
+import org.springframework.web.client.HttpClientErrorException;
+import org.springframework.web.client.RestTemplate;
+
+import lombok.extern.slf4j.Slf4j;
+
+// Shared POST to the embedding services. Bulk (indexing) calls carry
+// "X-Priority: bulk" so the server queues them behind live queries, and back
+// off for the Retry-After the server sends with a 429.
+@Slf4j
+final class EmbeddingRequests {
+    static final String PRIORITY_HEADER = "X-Priority";
+    private static final int MAX_BULK_ATTEMPTS = 20;
+    private static final long DEFAULT_RETRY_SECONDS = 1;
+
+    private EmbeddingRequests() {}
+
+    static Map<String, Object> post(RestTemplate restTemplate, String url, String info, boolean bulk) {
+        // JSON request body
+        Map<String, String> requestBody = Map.of("query", info);
+        if (!bulk) {
+            return restTemplate.postForObject(url, requestBody, Map.class);
+        }
+
+        HttpHeaders headers = new HttpHeaders();
+        headers.setContentType(MediaType.APPLICATION_JSON);
+        headers.set(PRIORITY_HEADER, "bulk");
+        HttpEntity<Map<String, String>> entity = new HttpEntity<>(requestBody, headers);
+
+        for (int attempt = 1; ; attempt++) {
+            try {
+                return restTemplate.postForObject(url, entity, Map.class);
+            } catch (HttpClientErrorException.TooManyRequests e) {
+                if (attempt >= MAX_BULK_ATTEMPTS) {
+                    throw e;
+                }
+                long seconds = retryAfterSeconds(e);
+                log.info("Embedding server busy ({}), retrying bulk request in {}s", url, seconds);
+                try {
+                    Thread.sleep(seconds * 1000);
+                } catch (InterruptedException interrupted) {
+                    Thread.currentThread().interrupt();
+                    throw e;
+                }
+            }
+        }
+    }
+
+    private static long retryAfterSeconds(HttpClientErrorException e) {
+        HttpHeaders headers = e.getResponseHeaders();
+        String value = headers == null ? null : headers.getFirst(HttpHeaders.RETRY_AFTER);
+        try {
+            return value == null ? DEFAULT_RETRY_SECONDS : Math.max(1, Long.parseLong(value.trim()));
+        } catch (NumberFormatException ignored) {
+            return DEFAULT_RETRY_SECONDS;
+        }
+    }
+}
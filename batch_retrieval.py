@@ -0,0 +1,165 @@
+"""
+Offline batch retrieval: write submission.json without going through the HTTP stack.
+
+Encodes every query in one length-bucketed pass with GrocerySearchModel, scores
+all queries against the stored catalog embeddings with chunked matrix
+multiplies (vector_search.top_k) and writes the top 30 products per query in
+the {query_id, product_id, rank} format of generate_responses.py.
+
+The catalog embeddings come from an EmbeddingStore; if the store does not
+exist yet it is built once with encode_products_stream.
+
+Usage:
+    python batch_retrieval.py
+    python batch_retrieval.py --queries queries_synth_test.json queries_synth_train.json
+    python batch_retrieval.py --store output/embeddings/dense --top-k 30 --output submission.json
+    python batch_retrieval.py --evaluate        # also print nDCG@10 / R@30 against the labels
+    python batch_retrieval.py --prefilter-threshold 0.7 --evaluate   # category-prefiltered (category_index.py)
+"""
+
+import argparse
+import json
+import os
+import time
+from category_index import CategoryIndex, CategoryPredictor, PrefilteredIndex
+from catalog import LABELS_PATH, PRODUCTS_PATH, QUERIES_PATH, iter_products
+from embedding_store import EmbeddingStore
+from model_interface_v2 import GrocerySearchModel
+from ranking_metrics import Labels, evaluate_submission, load_records
+from token_cache import DEFAULT_CACHE_DIR
+from vector_search import DEFAULT_PRODUCT_CHUNK, DEFAULT_QUERY_CHUNK, VectorIndex
+
+DEFAULT_STORE = "output/embeddings/dense"
+
+
+def build_store(model: GrocerySearchModel, products_path: str, store_path: str):
+    """Encode the catalog into an EmbeddingStore (streaming, bounded memory)."""
+    print(f"Encoding catalog {products_path} into {store_path}...")
+    start = time.perf_counter()
+    count = 0
+    for ids, _ in model.encode_products_stream(iter_products(products_path), output_path=store_path):
+        count += len(ids)
+    print(f"✅ Encoded {count:,} products in {time.perf_counter() - start:.1f}s")
+
+
+def load_queries(paths):
+    """Return (query_ids, query_texts) from one or more query files, first occurrence wins."""
+    query_ids, texts, seen = [], [], set()
+    for path in paths:
+        for record in load_records(path):
+            if record["query_id"] in seen:
+                continue
+            seen.add(record["query_id"])
+            query_ids.append(record["query_id"])
+            texts.append(record["query"])
+    return query_ids, texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline batch retrieval to submission.json')
+    parser.add_argument('--model', default='output/heb-semantic-search',
+                        help='Model path (default: output/heb-semantic-search)')
+    parser.add_argument('--projection', default=None,
+                        help='PCA projection fitted for --model (see projection.py)')
+    parser.add_argument('--queries', nargs='+', default=[QUERIES_PATH],
+                        help=f'Query files, JSON array or JSONL (default: {QUERIES_PATH})')
+    parser.add_argument('--products', default=PRODUCTS_PATH,
+                        help=f'Products file, used only to build a missing store (default: {PRODUCTS_PATH})')
+    parser.add_argument('--store', default=DEFAULT_STORE,
+                        help=f'Catalog EmbeddingStore directory (default: {DEFAULT_STORE})')
+    parser.add_argument('--rebuild-store', action='store_true',
+                        help='Re-encode the catalog even if the store exists')
+    parser.add_argument('--top-k', type=int, default=30,
+                        help='Products per query (default: 30)')
+    parser.add_argument('--query-chunk', type=int, default=DEFAULT_QUERY_CHUNK,
+                        help=f'Queries per matrix multiply (default: {DEFAULT_QUERY_CHUNK})')
+    parser.add_argument('--product-chunk', type=int, default=DEFAULT_PRODUCT_CHUNK,
+                        help=f'Products per matrix multiply (default: {DEFAULT_PRODUCT_CHUNK})')
+    parser.add_argument('--prefilter-threshold', type=float, default=None,
+                        help='Search only the predicted categories of queries at this confidence, '
+                             'full scan below it (default: always full scan)')
+    parser.add_argument('--token-cache', default=DEFAULT_CACHE_DIR,
+                        help=f'Pre-tokenized corpus cache directory, "" to disable (default: {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--output', '-o', default='submission.json',
+                        help='Submission file (default: submission.json)')
+    parser.add_argument('--evaluate', action='store_true',
+                        help='Score the submission against --labels with ranking_metrics')
+    parser.add_argument('--labels', default=LABELS_PATH,
+                        help=f'Labels for --evaluate (default: {LABELS_PATH})')
+    args = parser.parse_args()
+
+    total_start = time.perf_counter()
+
+    # 1. Model and catalog embeddings
+    print(f"Loading model: {args.model}")
+    model = GrocerySearchModel(args.model, token_cache_dir=args.token_cache or None,
+                               projection_path=args.projection)
+
+    store_ready = False
+    if os.path.exists(os.path.join(args.store, EmbeddingStore.META_FILE)) and not args.rebuild_store:
+        meta = EmbeddingStore(args.store).meta
+        store_ready = meta.get("complete", True)
+        if meta.get("model_path") not in (None, args.model):
+            raise SystemExit(f"❌ Store {args.store} was built with {meta['model_path']}, "
+                             f"not {args.model}; pass another --store or --rebuild-store")
+        if meta.get("projection_path") != args.projection:
+            raise SystemExit(f"❌ Store {args.store} was built with projection {meta.get('projection_path')}, "
+                             f"not {args.projection}; pass another --store or --rebuild-store")
+    if not store_ready:
+        build_store(model, args.products, args.store)
+
+    index = VectorIndex.from_store(args.store)
+    print(f"✅ Loaded {len(index):,} product embeddings from {args.store}")
+    predictor = None
+    if args.prefilter_threshold is not None:
+        index = PrefilteredIndex(index, CategoryIndex.from_products(index.ids, args.products))
+        predictor = CategoryPredictor(index, threshold=args.prefilter_threshold)
+        print(f"✅ Category prefilter: {len(index.categories.leaves):,} categories, "
+              f"threshold {args.prefilter_threshold}")
+
+    # 2. Encode all queries in one pass
+    query_ids, texts = load_queries(args.queries)
+    print(f"Encoding {len(texts):,} queries...")
+    start = time.perf_counter()
+    query_embeddings = model.encode_texts_bucketed(texts, normalize=True)
+    encode_seconds = time.perf_counter() - start
+
+    # 3. Chunked top-k
+    start = time.perf_counter()
+    if predictor is not None:
+        categories = predictor.predict(query_embeddings)
+        rows, _ = index.search(query_embeddings, k=args.top_k, categories=categories,
+                               query_chunk=args.query_chunk, product_chunk=args.product_chunk)
+        fallbacks = sum(c is None for c in categories)
+        print(f"📊 Prefilter: {index.last_rows_scored / (len(texts) * len(index)):.0%} of the catalog scored, "
+              f"{fallbacks:,}/{len(texts):,} queries fell back to a full scan")
+    else:
+        rows, _ = index.search(query_embeddings, k=args.top_k,
+                               query_chunk=args.query_chunk, product_chunk=args.product_chunk)
+    search_seconds = time.perf_counter() - start
+
+    # 4. Submission in the generate_responses.py format
+    resp = [
+        {"query_id": qid, "product_id": index.ids[r], "rank": j + 1}
+        for qid, row in zip(query_ids, rows.tolist())
+        for j, r in enumerate(row)
+    ]
+    with open(args.output, "w") as f:
+        json.dump(resp, f, indent=2)
+
+    print(f"\n📊 Encode: {encode_seconds:.2f}s ({len(texts) / max(encode_seconds, 1e-9):,.0f} queries/sec)")
+    print(f"📊 Search: {search_seconds:.2f}s ({len(texts) / max(search_seconds, 1e-9):,.0f} queries/sec)")
+    print(f"✅ Saved {len(resp):,} results for {len(query_ids):,} queries to {args.output} "
+          f"({time.perf_counter() - total_start:.1f}s total)")
+
+    if args.evaluate:
+        labels = Labels.load(args.labels)
+        ndcg_k = min(10, args.top_k)
+        result = evaluate_submission(labels, args.output, ks=(ndcg_k, args.top_k))
+        summary = result.summary()
+        print(f"\n📈 nDCG@{ndcg_k}: {summary[f'ndcg@{ndcg_k}']:.4f}   R@{args.top_k}: {summary[f'recall@{args.top_k}']:.4f}   "
+              f"MRR: {summary['mrr']:.4f}   ({summary['queries_submitted']:,}/{summary['queries']:,} labelled queries)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark length-bucketed product encoding against the fixed-batch path.
+
+Reports padding efficiency (real tokens / padded tokens) and throughput for
+both GrocerySearchModel.encode_products modes, and checks that they produce
+the same embeddings.
+
+Usage:
+    python benchmark_encoding.py
+    python benchmark_encoding.py --limit 5000 --batch-size 32 --max-tokens 4096
+"""
+
+import argparse
+import time
+from itertools import islice
+import numpy as np
+from model_interface_v2 import GrocerySearchModel
+from catalog import iter_products
+
+
+def fixed_batch_plan(texts, batch_size):
+    """Batching used by SentenceTransformer.encode: sort by characters, fixed count."""
+    order = np.argsort([-len(t) for t in texts], kind="stable")
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark length-bucketed product encoding')
+    parser.add_argument('--model', '-m', default='output/heb-semantic-search',
+                        help='Model path (default: output/heb-semantic-search)')
+    parser.add_argument('--products', default='data/products.json',
+                        help='Products file (default: data/products.json)')
+    parser.add_argument('--limit', type=int, default=2000,
+                        help='Number of products to encode (default: 2000, 0 = all)')
+    parser.add_argument('--batch-size', type=int, default=32,
+                        help='Batch size for the fixed-batch path (default: 32)')
+    parser.add_argument('--max-tokens', type=int, default=4096,
+                        help='Padded-token budget per bucketed batch (default: 4096)')
+    args = parser.parse_args()
+
+    model = GrocerySearchModel(model_path=args.model)
+    products = list(islice(iter_products(args.products), args.limit or None))
+    texts = [model.format_product(p) for p in products]
+    lengths = np.array([len(t) for t in model.tokenize_texts(texts)])
+
+    print("=" * 80)
+    print(f"ENCODING BENCHMARK: {len(products):,} products, model {args.model}")
+    print("=" * 80)
+    print(f"Token lengths: min {lengths.min()}, median {int(np.median(lengths))}, max {lengths.max()}")
+
+    # Fixed-count batches (current path)
+    fixed_stats = model.padding_stats(lengths, fixed_batch_plan(texts, args.batch_size))
+    start = time.perf_counter()
+    fixed_emb = model.encode_products(products, batch_size=args.batch_size, show_progress=False)
+    fixed_seconds = time.perf_counter() - start
+
+    # Length-bucketed, token-budget batches
+    bucketed_emb = model.encode_products(products, show_progress=False, length_bucketing=True,
+                                         max_tokens_per_batch=args.max_tokens)
+    bucketed_stats = model.last_encode_stats
+
+    print(f"\n{'Mode':<22} {'Batches':<10} {'Padding eff.':<14} {'Products/sec':<14}")
+    print('-' * 62)
+    print(f"{'fixed batch':<22} {fixed_stats['num_batches']:<10} "
+          f"{fixed_stats['padding_efficiency']:<14.1%} {len(products) / fixed_seconds:<14.1f}")
+    print(f"{'length-bucketed':<22} {bucketed_stats['num_batches']:<10} "
+          f"{bucketed_stats['padding_efficiency']:<14.1%} {bucketed_stats['texts_per_second']:<14.1f}")
+
+    speedup = bucketed_stats['texts_per_second'] / (len(products) / fixed_seconds)
+    max_diff = float(np.abs(fixed_emb - bucketed_emb).max())
+    print(f"\nSpeedup: {speedup:.2f}x")
+    print(f"Max abs difference between modes: {max_diff:.2e}")
+    if max_diff > 1e-3:
+        print("⚠️  Embeddings differ more than expected between modes")
+    else:
+        print("✅ Both modes produce the same embeddings")
+
+
+if __name__ == "__main__":
+    main()
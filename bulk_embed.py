@@ -0,0 +1,301 @@
+"""
+Streaming NDJSON bulk embedding: server endpoint and client helper.
+
+Indexing jobs push hundreds of thousands of texts through the encoders; one
+HTTP request per item wastes round trips, and one huge JSON body holds the
+whole catalog in memory on both sides. POST /bulk-embed instead takes a
+stream of newline-delimited records and answers with a stream:
+
+    request   {"id": "1728261", "text": "Title: ... Brand: ..."}\\n ...
+    response  {"id": "1728261", "vector": [0.012, ...]}\\n ...        (same order)
+              {"id": "...", "error": "..."}\\n                          (per-record failure)
+
+The endpoint is a raw ASGI app: it reads request body chunks only when it
+needs the next batch and awaits each response chunk before reading on, so the
+server holds at most one batch plus one partial line, and a slow reader (or
+writer) pushes back through TCP instead of growing buffers. Each batch is
+encoded in the thread pool and, when an AdmissionController is given, takes
+one bulk-lane slot, so live queries still go first between batches.
+
+Usage (server, see get_embeddings.py):
+    app.add_route("/bulk-embed", BulkEmbedApp({"dense": dense_batch, ...}), methods=["POST"])
+
+Usage (client):
+    python bulk_embed.py --url http://127.0.0.1:8001/bulk-embed --channel dense
+    python bulk_embed.py --channel image --store output/embeddings/image-service
+
+    from bulk_embed import stream_embeddings
+    for product_id, vector in stream_embeddings(url, records, channel="dense"):
+        ...
+"""
+
+import argparse
+import asyncio
+import http.client
+import json
+import threading
+import time
+import numpy as np
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from urllib.parse import parse_qs, urlencode, urlsplit
+from catalog import PRODUCTS_PATH, backend_product_text, iter_chunks, iter_products
+
+DEFAULT_BATCH_SIZE = 64
+MAX_LINE_BYTES = 1 << 20
+
+# Encoder: batch of texts -> one vector or error message per text, in order
+BatchEncoder = Callable[[List[str]], List[Union[np.ndarray, str]]]
+
+
+class BulkEmbedApp:
+    """Raw ASGI app: NDJSON {id, text} in, NDJSON {id, vector} out, batch by batch."""
+
+    def __init__(self, encoders: Dict[str, BatchEncoder], batch_size: int = DEFAULT_BATCH_SIZE,
+                 controller=None, max_line_bytes: int = MAX_LINE_BYTES):
+        """
+        Args:
+            encoders: Channel name (?channel=...) -> batch encoder; the first is the default
+            batch_size: Records encoded per batch
+            controller: Optional admission_control.AdmissionController; each batch takes a bulk slot
+            max_line_bytes: Longest accepted input line
+        """
+        self.encoders = encoders
+        self.default_channel = next(iter(encoders))
+        self.batch_size = batch_size
+        self.controller = controller
+        self.max_line_bytes = max_line_bytes
+
+    async def __call__(self, scope, receive, send):
+        query = parse_qs(scope.get("query_string", b"").decode())
+        channel = query.get("channel", [self.default_channel])[0]
+        if channel not in self.encoders:
+            await self._error(send, 400, f"unknown channel {channel!r}, expected one of {sorted(self.encoders)}")
+            return
+
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/x-ndjson")]})
+        encoder = self.encoders[channel]
+        buffer = b""
+        batch: List[Tuple[object, Optional[str], Optional[str]]] = []  # (id, text, error)
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            buffer += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            *lines, buffer = buffer.split(b"\n")
+            if not more_body and buffer:
+                lines.append(buffer)
+                buffer = b""
+            for line in lines:
+                if line.strip():
+                    batch.append(self._parse(line))
+                if len(batch) >= self.batch_size:
+                    if not await self._flush(send, encoder, batch):
+                        return
+                    batch = []
+
+            # Checked after the complete lines of this chunk, so their records are answered first
+            if len(buffer) > self.max_line_bytes:
+                batch.append((None, None, f"line longer than {self.max_line_bytes} bytes, stream stopped"))
+                break
+
+        if batch:
+            await self._flush(send, encoder, batch)
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    @staticmethod
+    def _parse(line: bytes) -> Tuple[object, Optional[str], Optional[str]]:
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            return None, None, f"invalid JSON: {e}"
+        if not isinstance(record, dict):
+            return None, None, "record must be a JSON object"
+        text = record.get("text")
+        if not isinstance(text, str):
+            return record.get("id"), None, "record needs a string \"text\""
+        return record.get("id"), text, None
+
+    async def _flush(self, send, encoder: BatchEncoder, batch) -> bool:
+        """Encode one batch and send its records; False if the client went away."""
+        from starlette.concurrency import run_in_threadpool
+
+        texts = [text for _, text, error in batch if error is None]
+        results: List[Union[np.ndarray, str]] = []
+        if texts:
+            if self.controller is not None:
+                await self._acquire_bulk_slot()
+            start = time.perf_counter()
+            try:
+                results = await run_in_threadpool(encoder, texts)
+            except Exception as e:
+                results = [f"{type(e).__name__}: {e}"] * len(texts)
+            finally:
+                if self.controller is not None:
+                    self.controller.release(time.perf_counter() - start)
+
+        out = []
+        it = iter(results)
+        for record_id, _, error in batch:
+            value = error if error is not None else next(it)
+            if isinstance(value, str):
+                out.append(json.dumps({"id": record_id, "error": value}))
+            else:
+                out.append(json.dumps({"id": record_id, "vector": np.asarray(value).tolist()}))
+        try:
+            await send({"type": "http.response.body", "body": ("\n".join(out) + "\n").encode(), "more_body": True})
+        except OSError:
+            return False
+        return True
+
+    async def _acquire_bulk_slot(self):
+        """Wait for a bulk-lane slot; the stream is already accepted, so a full queue means wait, not fail."""
+        from admission_control import Rejected
+        while True:
+            try:
+                await self.controller.acquire("bulk")
+                return
+            except Rejected as e:
+                await asyncio.sleep(e.retry_after)
+
+    @staticmethod
+    async def _error(send, status: int, detail: str):
+        body = json.dumps({"detail": detail}).encode()
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": body})
+
+
+def stream_embeddings(
+    url: str,
+    records: Iterable[Dict],
+    channel: str = "dense",
+    bulk: bool = True,
+    chunk_records: int = 256,
+    timeout: float = 300.0
+) -> Iterator[Tuple[str, Union[np.ndarray, str]]]:
+    """
+    Send {id, text} records to /bulk-embed and yield results as they stream back.
+
+    The request body is written by a background thread while this generator
+    reads the response, so neither side has to buffer the whole stream.
+
+    Args:
+        url: Endpoint URL (http://host:port/bulk-embed)
+        records: Iterable of {"id": ..., "text": ...}
+        channel: Encoder channel (dense / sparse / image)
+        bulk: Send "X-Priority: bulk" (indexing traffic)
+        chunk_records: Records per HTTP chunk written
+        timeout: Socket timeout, seconds
+
+    Yields:
+        (id, float32 vector) or (id, error message), in input order
+    """
+    parts = urlsplit(url)
+    conn_cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    conn = conn_cls(parts.hostname, parts.port, timeout=timeout)
+    conn.putrequest("POST", f"{parts.path or '/'}?{urlencode({'channel': channel})}")
+    conn.putheader("Content-Type", "application/x-ndjson")
+    conn.putheader("Transfer-Encoding", "chunked")
+    if bulk:
+        conn.putheader("X-Priority", "bulk")
+    conn.endheaders()
+
+    writer_error: List[BaseException] = []
+
+    def write_body():
+        try:
+            for chunk in iter_chunks(records, chunk_records):
+                data = "".join(json.dumps({"id": r["id"], "text": r["text"]}) + "\n" for r in chunk).encode()
+                conn.send(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            conn.send(b"0\r\n\r\n")
+        except BaseException as e:  # surfaced by the reader
+            writer_error.append(e)
+
+    writer = threading.Thread(target=write_body, name="bulk-embed-writer", daemon=True)
+    writer.start()
+    try:
+        response = conn.getresponse()
+        if response.status != 200:
+            raise RuntimeError(f"{url} returned {response.status}: {response.read().decode(errors='replace')}")
+        for line in response:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "vector" in record:
+                yield record["id"], np.asarray(record["vector"], dtype=np.float32)
+            else:
+                yield record["id"], record["error"]
+        writer.join()
+        if writer_error:
+            raise writer_error[0]
+    finally:
+        conn.close()
+
+
+def catalog_records(products_path: str = PRODUCTS_PATH, channel: str = "dense") -> Iterator[Dict]:
+    """
+    {id, text} records for a channel, streamed from the catalog reader.
+
+    Dense and sparse encode the backend's Product.getText() string; the image
+    channel takes the product id (the server fetches the image).
+    """
+    for product in iter_products(products_path):
+        product_id = str(product["product_id"])
+        text = product_id if channel == "image" else backend_product_text(product)
+        yield {"id": product_id, "text": text}
+
+
+def main():
+    from embedding_store import EmbeddingStore
+
+    parser = argparse.ArgumentParser(description='Stream the catalog through the /bulk-embed endpoint')
+    parser.add_argument('--url', default='http://127.0.0.1:8001/bulk-embed',
+                        help='Bulk endpoint (default: http://127.0.0.1:8001/bulk-embed)')
+    parser.add_argument('--channel', default='dense', choices=['dense', 'sparse', 'image'],
+                        help='Encoder channel (default: dense)')
+    parser.add_argument('--products', default=PRODUCTS_PATH,
+                        help=f'Products file, JSON array or JSONL (default: {PRODUCTS_PATH})')
+    parser.add_argument('--store', default=None,
+                        help='Write vectors to this EmbeddingStore (default: output/embeddings/<channel>-service)')
+    parser.add_argument('--interactive', action='store_true',
+                        help='Send as interactive instead of bulk traffic')
+    args = parser.parse_args()
+
+    store_path = args.store or f"output/embeddings/{args.channel}-service"
+    store = None
+    count = failed = 0
+    start = time.perf_counter()
+    pending_ids, pending_rows = [], []
+    for product_id, result in stream_embeddings(args.url, catalog_records(args.products, args.channel),
+                                                channel=args.channel, bulk=not args.interactive):
+        if isinstance(result, str):
+            failed += 1
+            print(f"⚠️  {product_id}: {result}")
+            continue
+        if store is None:
+            store = EmbeddingStore.create(store_path, dim=len(result), meta={
+                "model_path": f"{args.url}?channel={args.channel}", "normalized": False, "complete": False
+            })
+        pending_ids.append(product_id)
+        pending_rows.append(result)
+        count += 1
+        if len(pending_ids) >= 1024:
+            store.append(pending_ids, np.stack(pending_rows))
+            pending_ids, pending_rows = [], []
+    if store is not None:
+        if pending_ids:
+            store.append(pending_ids, np.stack(pending_rows))
+        store.update_meta(complete=failed == 0)
+
+    seconds = max(time.perf_counter() - start, 1e-9)
+    print(f"\n📊 {count:,} vectors in {seconds:.1f}s ({count / seconds:,.0f} records/sec), {failed:,} failed")
+    if store is not None:
+        print(f"✅ Saved {store.count:,} x {store.dim} to {store_path}")
+
+
+if __name__ == "__main__":
+    main()
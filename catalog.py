@@ -0,0 +1,489 @@
+"""
+Shared access to the product catalog, queries and labels.
+
+- format_product(): the one product -> searchable text formatting used for
+  training, evaluation, search and GrocerySearchModel
+- iter_products(): streams products from a JSON array or JSONL file, so large
+  catalogs never have to be parsed into memory in one piece
+- Catalog: products, queries and labels loaded once, with formatted texts and
+  id -> index maps, saved to a compact binary cache (columnar arrays over an
+  interned string table). Later loads read the cache in milliseconds and it is
+  rebuilt automatically when any source file changes.
+
+Usage:
+    from catalog import Catalog, format_product, iter_products, iter_chunks
+
+    catalog = Catalog.load()
+    catalog.product_texts[catalog.product_index["1728261"]]
+    for ex in catalog.labelled_examples():
+        ...
+
+    for chunk in iter_chunks(iter_products("data/products.jsonl"), 1024):
+        ...
+"""
+
+import json
+import os
+import numpy as np
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+PRODUCTS_PATH = "data/products.json"
+QUERIES_PATH = "data/queries_synth_train.json"
+LABELS_PATH = "data/labels_synth_train.json"
+
+# Bump when the cache layout changes so old caches are rebuilt
+CACHE_VERSION = 1
+
+# Product fields kept in the catalog cache
+PRODUCT_FIELDS = ("product_id", "title", "description", "brand",
+                  "category_path", "ingredients", "safety_warning")
+
+# String-table sentinels for a missing key and an explicit JSON null
+_MISSING = -1
+_NULL = -2
+
+# Characters read from disk at a time by the incremental JSON array parser
+READ_SIZE = 1 << 20
+
+_WHITESPACE = " \t\r\n"
+_NUMBER_CHARS = "0123456789.eE+-"
+
+
+def format_product(product: Dict) -> str:
+    """
+    Format a product dictionary into searchable text.
+
+    Args:
+        product: Dictionary containing product fields
+                (title, description, brand, category_path, ingredients, safety_warning)
+
+    Returns:
+        Formatted product text string
+    """
+    text_parts = [
+        product.get("title", ""),
+        product.get("description", ""),
+        f"Brand: {product.get('brand', '')}.",
+        f"Category: {product.get('category_path', '')}.",
+        f"Ingredients: {product.get('ingredients', '')}.",
+        f"Warning: {product.get('safety_warning', '')}.",
+    ]
+    return " ".join([t for t in text_parts if t])
+
+
+def backend_product_text(product: Dict) -> str:
+    """
+    Format a product the way the search backend indexes it (Product.getText in
+    the Java service), for offline tools that reproduce its embeddings.
+
+    Args:
+        product: Dictionary containing product fields
+
+    Returns:
+        Product text as sent to the dense and sparse embedding endpoints
+    """
+    parts = [
+        ("Title: ", product.get("title")),
+        ("Description: ", product.get("description")),
+        ("Brand: ", product.get("brand")),
+        ("Category: ", product.get("category_path")),
+        ("Safety Warning: ", product.get("safety_warning")),
+        ("Ingredients: ", product.get("ingredients")),
+    ]
+    return "".join(f"{label}{value}. " for label, value in parts
+                   if value is not None and str(value).strip()).strip()
+
+
+def iter_json_array(f, read_size: int = READ_SIZE) -> Iterator:
+    """
+    Yield the elements of a top-level JSON array from a text file object.
+
+    Only one read buffer (plus the element being decoded) is held in memory.
+
+    Args:
+        f: Text file object positioned at the start of the array
+        read_size: Characters to read per refill
+
+    Yields:
+        Decoded array elements
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    started = False
+    size = read_size
+
+    def refill():
+        nonlocal buf, pos, eof
+        chunk = f.read(size)
+        if not chunk:
+            eof = True
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    while True:
+        # Skip separators, refilling the buffer as needed
+        while True:
+            while pos < len(buf) and (buf[pos] in _WHITESPACE or (started and buf[pos] == ",")):
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            refill()
+
+        if pos >= len(buf):
+            raise ValueError("Unexpected end of file inside JSON array")
+
+        if not started:
+            if buf[pos] != "[":
+                raise ValueError(f"Expected a JSON array, found {buf[pos]!r}")
+            started = True
+            pos += 1
+            continue
+
+        if buf[pos] == "]":
+            return
+
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # Element spans the buffer boundary: read more (growing for huge elements)
+            size = max(size, 2 * (len(buf) - pos))
+            refill()
+            continue
+
+        if not eof and (end == len(buf) or buf[end] in _NUMBER_CHARS):
+            # A number cut at the buffer end may have decoded partially; re-read it
+            refill()
+            continue
+
+        yield obj
+        pos = end
+        size = read_size
+        if pos > read_size:
+            buf = buf[pos:]
+            pos = 0
+
+
+def iter_jsonl(f) -> Iterator:
+    """Yield one decoded object per non-empty line of a JSONL file object."""
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_products(path: str = PRODUCTS_PATH) -> Iterator[Dict]:
+    """
+    Stream products from a JSON array or JSONL file.
+
+    The format is taken from the extension (.jsonl / .ndjson) or, failing
+    that, from the first non-whitespace character ("[" = array, "{" = JSONL).
+
+    Args:
+        path: Path to the products file
+
+    Yields:
+        Product dictionaries in file order
+    """
+    with open(path, 'r') as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            yield from iter_jsonl(f)
+            return
+
+        first = ""
+        while True:
+            ch = f.read(1)
+            if not ch or ch not in _WHITESPACE:
+                first = ch
+                break
+        f.seek(0)
+
+        if first == "[":
+            yield from iter_json_array(f)
+        else:
+            yield from iter_jsonl(f)
+
+
+def iter_chunks(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Group an iterable into lists of at most `size` items."""
+    it = iter(items)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class _StringTable:
+    """Interns strings while building the cache."""
+
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+        self.strings: List[str] = []
+
+    def add(self, value) -> int:
+        if value is None:
+            return _NULL
+        value = str(value)
+        i = self.index.get(value)
+        if i is None:
+            i = self.index[value] = len(self.strings)
+            self.strings.append(value)
+        return i
+
+    def to_arrays(self):
+        encoded = [s.encode("utf-8") for s in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return blob, offsets
+
+
+def _source_fingerprint(paths: List[Optional[str]]) -> np.ndarray:
+    """(size, mtime_ns) per source file; -1 for paths that are unset or missing."""
+    out = []
+    for path in paths:
+        if path and os.path.exists(path):
+            st = os.stat(path)
+            out.append((st.st_size, st.st_mtime_ns))
+        else:
+            out.append((-1, -1))
+    return np.array(out, dtype=np.int64)
+
+
+def _load_json(path: str):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+class Catalog:
+    """
+    Products, queries and labels loaded once, with formatted texts and id maps.
+
+    All data lives in columnar numpy arrays indexing one interned UTF-8 string
+    table; Python strings and dicts are only materialised on first access.
+
+    Attributes (lazy):
+        product_ids, product_texts, product_index   products in file order
+        query_ids, query_texts, query_index         queries in file order
+        label_query, label_product, label_relevance label rows in file order
+                                                    (row indices, -1 if unknown id)
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self._arrays = arrays
+        self._blob = arrays["string_blob"]
+        self._offsets = arrays["string_offsets"]
+        self._cache: Dict[str, object] = {}
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+    @classmethod
+    def load(
+        cls,
+        products_path: str = PRODUCTS_PATH,
+        queries_path: Optional[str] = QUERIES_PATH,
+        labels_path: Optional[str] = LABELS_PATH,
+        cache_path: Optional[str] = None,
+        rebuild: bool = False
+    ) -> "Catalog":
+        """
+        Load the catalog from its binary cache, (re)building it if needed.
+
+        Args:
+            products_path: Products file (JSON array or JSONL)
+            queries_path: Queries file, or None
+            labels_path: Labels file, or None
+            cache_path: Cache file (default: .catalog_cache.npz next to products_path)
+            rebuild: Ignore any existing cache
+
+        Returns:
+            Catalog
+        """
+        if cache_path is None:
+            cache_path = str(Path(products_path).with_name(".catalog_cache.npz"))
+        sources = [products_path, queries_path, labels_path]
+        fingerprint = _source_fingerprint(sources)
+
+        if not rebuild and os.path.exists(cache_path):
+            with np.load(cache_path, allow_pickle=False) as data:
+                arrays = {k: data[k] for k in data.files}
+            if (int(arrays.get("version", -1)) == CACHE_VERSION
+                    and np.array_equal(arrays.get("sources"), fingerprint)
+                    and str(arrays["source_paths"]) == "\n".join(p or "" for p in sources)):
+                return cls(arrays)
+
+        arrays = cls._build(products_path, queries_path, labels_path)
+        arrays["version"] = np.array(CACHE_VERSION)
+        arrays["sources"] = fingerprint
+        arrays["source_paths"] = np.array("\n".join(p or "" for p in sources))
+
+        tmp_path = cache_path + ".tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, cache_path)
+        return cls(arrays)
+
+    @staticmethod
+    def _build(products_path: str, queries_path: Optional[str],
+               labels_path: Optional[str]) -> Dict[str, np.ndarray]:
+        """Parse the source files into columnar arrays."""
+        strings = _StringTable()
+        columns = {field: [] for field in PRODUCT_FIELDS}
+        texts = []
+        product_index: Dict[str, int] = {}
+        for i, product in enumerate(iter_products(products_path)):
+            for field in PRODUCT_FIELDS:
+                columns[field].append(strings.add(product[field]) if field in product else _MISSING)
+            texts.append(strings.add(format_product(product)))
+            product_index[str(product.get("product_id"))] = i
+
+        query_ids, query_texts = [], []
+        query_index: Dict[str, int] = {}
+        if queries_path and os.path.exists(queries_path):
+            for i, q in enumerate(_load_json(queries_path)):
+                query_ids.append(strings.add(q["query_id"]))
+                query_texts.append(strings.add(q["query"]))
+                query_index[str(q["query_id"])] = i
+
+        label_query, label_product, label_relevance = [], [], []
+        if labels_path and os.path.exists(labels_path):
+            for label in _load_json(labels_path):
+                label_query.append(query_index.get(str(label["query_id"]), -1))
+                label_product.append(product_index.get(str(label["product_id"]), -1))
+                label_relevance.append(label["relevance"])
+
+        blob, offsets = strings.to_arrays()
+        arrays = {f"product_{field}": np.array(col, dtype=np.int32) for field, col in columns.items()}
+        arrays.update({
+            "string_blob": blob,
+            "string_offsets": offsets,
+            "product_text": np.array(texts, dtype=np.int32),
+            "query_id": np.array(query_ids, dtype=np.int32),
+            "query_text": np.array(query_texts, dtype=np.int32),
+            "label_query": np.array(label_query, dtype=np.int32),
+            "label_product": np.array(label_product, dtype=np.int32),
+            "label_relevance": np.array(label_relevance, dtype=np.int8),
+        })
+        return arrays
+
+    # ------------------------------------------------------------------
+    # String access
+    # ------------------------------------------------------------------
+    def _string(self, i: int) -> Optional[str]:
+        if i == _NULL:
+            return None
+        return self._blob[self._offsets[i]:self._offsets[i + 1]].tobytes().decode("utf-8")
+
+    def _strings(self, column: str) -> List[Optional[str]]:
+        if column not in self._cache:
+            self._cache[column] = [self._string(i) for i in self._arrays[column].tolist()]
+        return self._cache[column]
+
+    @staticmethod
+    def _index_of(ids: List[str]) -> Dict[str, int]:
+        return {pid: i for i, pid in enumerate(ids)}
+
+    # ------------------------------------------------------------------
+    # Products
+    # ------------------------------------------------------------------
+    @property
+    def num_products(self) -> int:
+        return len(self._arrays["product_text"])
+
+    @property
+    def source_fingerprint(self) -> List[List[int]]:
+        """(size, mtime_ns) of the products, queries and labels files the catalog was built from."""
+        return self._arrays["sources"].tolist()
+
+    @property
+    def product_ids(self) -> List[str]:
+        return self._strings("product_product_id")
+
+    @property
+    def product_texts(self) -> List[str]:
+        """format_product() text of every product, in file order."""
+        return self._strings("product_text")
+
+    @property
+    def product_index(self) -> Dict[str, int]:
+        if "product_index" not in self._cache:
+            self._cache["product_index"] = self._index_of(self.product_ids)
+        return self._cache["product_index"]
+
+    def product(self, i: int) -> Dict:
+        """Rebuild the product dict (catalog fields only) for row i."""
+        out = {}
+        for field in PRODUCT_FIELDS:
+            idx = int(self._arrays[f"product_{field}"][i])
+            if idx != _MISSING:
+                out[field] = self._string(idx)
+        return out
+
+    @property
+    def products(self) -> List[Dict]:
+        """All products as dicts (catalog fields only), in file order."""
+        if "products" not in self._cache:
+            self._cache["products"] = [self.product(i) for i in range(self.num_products)]
+        return self._cache["products"]
+
+    # ------------------------------------------------------------------
+    # Queries and labels
+    # ------------------------------------------------------------------
+    @property
+    def query_ids(self) -> List[str]:
+        return self._strings("query_id")
+
+    @property
+    def query_texts(self) -> List[str]:
+        return self._strings("query_text")
+
+    @property
+    def query_index(self) -> Dict[str, int]:
+        if "query_index" not in self._cache:
+            self._cache["query_index"] = self._index_of(self.query_ids)
+        return self._cache["query_index"]
+
+    @property
+    def label_query(self) -> np.ndarray:
+        return self._arrays["label_query"]
+
+    @property
+    def label_product(self) -> np.ndarray:
+        return self._arrays["label_product"]
+
+    @property
+    def label_relevance(self) -> np.ndarray:
+        return self._arrays["label_relevance"]
+
+    def labelled_examples(self) -> List[Dict]:
+        """
+        Label rows whose query and product are both known, in file order.
+
+        Returns:
+            List of dicts with query, product (formatted text), relevance,
+            query_id, product_id, query_idx and product_idx
+        """
+        keep = np.flatnonzero((self.label_query >= 0) & (self.label_product >= 0))
+        query_ids, query_texts = self.query_ids, self.query_texts
+        product_ids, product_texts = self.product_ids, self.product_texts
+        examples = []
+        for row in keep.tolist():
+            qi = int(self.label_query[row])
+            pi = int(self.label_product[row])
+            examples.append({
+                'query': query_texts[qi],
+                'product': product_texts[pi],
+                'relevance': int(self.label_relevance[row]),
+                'query_id': query_ids[qi],
+                'product_id': product_ids[pi],
+                'query_idx': qi,
+                'product_idx': pi
+            })
+        return examples
@@ -0,0 +1,362 @@
+"""
+Category-partitioned, prefiltered vector search.
+
+Most grocery queries target one department ("shredded cheddar" -> Food >
+Dairy > Cheese), yet every search scores the whole catalog. This module
+restricts scoring to the categories a query is predicted to target:
+
+- CategoryIndex: prefix tree over category_path ("Food > Dairy > Cheese" has
+  the prefixes "Food", "Food > Dairy", "Food > Dairy > Cheese"). Rows are put
+  in category order once, so every prefix is one contiguous row range
+- PrefilteredIndex: the VectorIndex matrix stored in that order; a search
+  restricted to some prefixes multiplies only their slices (no gather, no
+  copy), a search without categories scans everything
+- CategoryPredictor: cheap query -> category guess from the query embedding
+  alone (cosine to each leaf category's centroid, softmax). It picks the
+  deepest tree level where at most max_partitions prefixes cover `threshold`
+  of the probability; if no level does, the query falls back to a full scan
+
+The same CategoryIndex serves every channel store (dense, sparse, image):
+build one PrefilteredIndex per store.
+
+Usage:
+    python category_index.py --store output/embeddings/dense
+    python category_index.py --store output/embeddings/dense --thresholds 0.5 0.7 0.9 --max-partitions 2
+
+    index = PrefilteredIndex.from_store("output/embeddings/dense")
+    predictor = CategoryPredictor(index, threshold=0.7)
+    rows, scores = index.search(query_embeddings, k=30, categories=predictor.predict(query_embeddings))
+"""
+
+import argparse
+import time
+import numpy as np
+from typing import Dict, List, Optional, Sequence, Tuple
+from catalog import LABELS_PATH, PRODUCTS_PATH, QUERIES_PATH, iter_products
+from embedding_store import EmbeddingStore
+from pair_scoring import normalize_rows
+from vector_search import DEFAULT_PRODUCT_CHUNK, DEFAULT_QUERY_CHUNK, VectorIndex, top_k
+
+SEPARATOR = " > "
+
+
+def category_parts(path: Optional[str]) -> Tuple[str, ...]:
+    """Components of a category_path ("Food > Dairy > Cheese" -> ("Food", "Dairy", "Cheese"))."""
+    return tuple(part.strip() for part in (path or "").split(">") if part.strip())
+
+
+class CategoryIndex:
+    """
+    Category prefix tree over product rows.
+
+    Attributes:
+        order: Row ids in category order; position i holds row order[i]
+        ranges: Prefix ("Food", "Food > Dairy", ...) -> (start, end) positions in `order`
+        leaves: Full category paths, in order
+        leaf_ranges: Full path -> positions of the rows with exactly that path
+        depth: Deepest category level
+    """
+
+    def __init__(self, paths: Sequence[Optional[str]]):
+        """
+        Args:
+            paths: category_path of each row ("" / None: uncategorized, only reached by full scans)
+        """
+        leaf_of: Dict[Tuple[str, ...], int] = {}
+        row_leaf = np.empty(len(paths), dtype=np.int64)
+        for row, path in enumerate(paths):
+            parts = category_parts(path)
+            row_leaf[row] = leaf_of.setdefault(parts, len(leaf_of))
+
+        # Sorting leaves as tuples keeps every prefix's leaves adjacent
+        sorted_leaves = sorted(leaf_of)
+        rank = np.empty(len(sorted_leaves), dtype=np.int64)
+        for position, parts in enumerate(sorted_leaves):
+            rank[leaf_of[parts]] = position
+        row_rank = rank[row_leaf]
+        self.order = np.argsort(row_rank, kind="stable")
+        counts = np.bincount(row_rank, minlength=len(sorted_leaves))
+        ends = np.cumsum(counts)
+
+        self.ranges: Dict[str, Tuple[int, int]] = {}
+        self.leaves: List[str] = []
+        self.leaf_ranges: Dict[str, Tuple[int, int]] = {}
+        for parts, start, end in zip(sorted_leaves, ends - counts, ends):
+            if not parts:
+                continue
+            self.leaves.append(SEPARATOR.join(parts))
+            self.leaf_ranges[self.leaves[-1]] = (int(start), int(end))
+            for d in range(1, len(parts) + 1):
+                prefix = SEPARATOR.join(parts[:d])
+                first, _ = self.ranges.get(prefix, (int(start), 0))
+                self.ranges[prefix] = (first, int(end))
+        self.depth = max((len(parts) for parts in sorted_leaves), default=0)
+
+    @classmethod
+    def from_products(cls, ids: Sequence[str], products_path: str = PRODUCTS_PATH) -> "CategoryIndex":
+        """Index the rows of a store (by product id) with their catalog category_path."""
+        category = {str(p["product_id"]): p.get("category_path") for p in iter_products(products_path)}
+        return cls([category.get(product_id) for product_id in ids])
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def prefixes(self, depth: int) -> List[str]:
+        """Prefixes at one tree level (1 = departments), in order."""
+        return [p for p in self.ranges if p.count(SEPARATOR) == depth - 1]
+
+    def row_ranges(self, prefixes: Sequence[str]) -> List[Tuple[int, int]]:
+        """
+        Sorted, merged position ranges covering some prefixes.
+
+        Raises:
+            KeyError: unknown prefix
+        """
+        spans = sorted(self.ranges[p] for p in prefixes)
+        merged: List[Tuple[int, int]] = []
+        for start, end in spans:
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        return merged
+
+    def rows(self, prefix: str) -> np.ndarray:
+        """Row ids under one prefix."""
+        start, end = self.ranges[prefix]
+        return self.order[start:end]
+
+
+class PrefilteredIndex:
+    """Normalized product matrix in category order, searched by cosine over whole or partial ranges."""
+
+    def __init__(self, index: VectorIndex, categories: CategoryIndex):
+        """
+        Args:
+            index: VectorIndex to reorder (its matrix is copied; drop it afterwards)
+            categories: CategoryIndex over the same rows
+        """
+        if len(categories) != len(index):
+            raise ValueError(f"CategoryIndex has {len(categories)} rows, index has {len(index)}")
+        self.categories = categories
+        self.vectors = index.vectors[categories.order]
+        self.ids = index.ids
+        # Rows scored by the last search (sum over its queries)
+        self.last_rows_scored = 0
+
+    @classmethod
+    def from_store(cls, path: str, products_path: str = PRODUCTS_PATH) -> "PrefilteredIndex":
+        index = VectorIndex.from_store(path)
+        return cls(index, CategoryIndex.from_products(index.ids, products_path))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(self, queries: np.ndarray, k: int = 30,
+               categories: Optional[Sequence[Optional[Sequence[str]]]] = None,
+               query_chunk: int = DEFAULT_QUERY_CHUNK,
+               product_chunk: int = DEFAULT_PRODUCT_CHUNK) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Cosine top-k, each query restricted to its categories.
+
+        Queries with the same categories are scored together. A query with no
+        categories (None), or whose categories hold fewer than k products, is
+        scored against the full catalog.
+
+        Args:
+            queries: (n, dim) query embeddings
+            k: Results per query
+            categories: Per query, category prefixes to search or None (default: all None)
+
+        Returns:
+            (rows, scores), each (n, k), best first; rows index the original store
+        """
+        queries = normalize_rows(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        k = min(k, len(self))
+        groups: Dict[Optional[Tuple[Tuple[int, int], ...]], List[int]] = {}
+        for i in range(len(queries)):
+            prefixes = categories[i] if categories is not None else None
+            spans = tuple(self.categories.row_ranges(prefixes)) if prefixes else None
+            if spans is not None and sum(end - start for start, end in spans) < k:
+                spans = None
+            groups.setdefault(spans, []).append(i)
+
+        all_rows = np.empty((len(queries), k), dtype=np.int64)
+        all_scores = np.empty((len(queries), k), dtype=np.float32)
+        self.last_rows_scored = 0
+        for spans, members in groups.items():
+            q = queries[members]
+            if spans is None:
+                spans = ((0, len(self)),)
+            rows, scores = [], []
+            for start, end in spans:
+                r, s = top_k(q, self.vectors[start:end], k, query_chunk, product_chunk)
+                rows.append(r + start)
+                scores.append(s)
+                self.last_rows_scored += (end - start) * len(members)
+            rows, scores = np.concatenate(rows, axis=1), np.concatenate(scores, axis=1)
+            if len(spans) > 1:
+                best = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+                rows, scores = np.take_along_axis(rows, best, axis=1), np.take_along_axis(scores, best, axis=1)
+            all_rows[members] = self.categories.order[rows]
+            all_scores[members] = scores
+        return all_rows, all_scores
+
+    def search_ids(self, queries: np.ndarray, k: int = 30,
+                   categories: Optional[Sequence[Optional[Sequence[str]]]] = None) -> List[List[str]]:
+        rows, _ = self.search(queries, k, categories)
+        return [[self.ids[r] for r in row] for row in rows.tolist()]
+
+
+class CategoryPredictor:
+    """Nearest-centroid query -> category prefixes, with full-scan fallback on low confidence."""
+
+    def __init__(self, index: PrefilteredIndex, threshold: float = 0.7, temperature: float = 0.05,
+                 max_partitions: int = 2, min_depth: int = 1):
+        """
+        Args:
+            index: PrefilteredIndex whose leaf categories are predicted
+            threshold: Probability the chosen prefixes must cover, else full scan
+            temperature: Softmax temperature over centroid cosines
+            max_partitions: Most prefixes searched per query
+            min_depth: Shallowest tree level used (1 = departments)
+        """
+        categories = index.categories
+        self.threshold = threshold
+        self.temperature = temperature
+        self.max_partitions = max_partitions
+        self.min_depth = min_depth
+        self.leaves = categories.leaves
+        self.centroids = normalize_rows(np.stack([
+            index.vectors[slice(*categories.leaf_ranges[leaf])].mean(axis=0) for leaf in self.leaves
+        ]).astype(np.float32)) if self.leaves else np.empty((0, index.vectors.shape[1]), dtype=np.float32)
+
+        # Per level: prefix names and a (leaves x prefixes) 0/1 matrix summing leaf probabilities
+        self.levels: List[Tuple[int, List[str], np.ndarray]] = []
+        for depth in range(categories.depth, min_depth - 1, -1):
+            prefixes = categories.prefixes(depth)
+            column = {p: j for j, p in enumerate(prefixes)}
+            membership = np.zeros((len(self.leaves), len(prefixes)), dtype=np.float32)
+            for i, leaf in enumerate(self.leaves):
+                parts = leaf.split(SEPARATOR)
+                if len(parts) >= depth:
+                    membership[i, column[SEPARATOR.join(parts[:depth])]] = 1.0
+            self.levels.append((depth, prefixes, membership))
+
+    def probabilities(self, queries: np.ndarray) -> np.ndarray:
+        """(n, leaves) softmax over cosine to each leaf centroid."""
+        logits = normalize_rows(np.atleast_2d(np.asarray(queries, dtype=np.float32))) @ self.centroids.T
+        logits = (logits - logits.max(axis=1, keepdims=True)) / self.temperature
+        probs = np.exp(logits)
+        return probs / probs.sum(axis=1, keepdims=True)
+
+    def predict(self, queries: np.ndarray) -> List[Optional[List[str]]]:
+        """
+        Category prefixes to search per query, deepest confident level first.
+
+        Returns:
+            Per query, a list of prefixes, or None to scan the full catalog
+        """
+        n = len(np.atleast_2d(queries))
+        if not self.leaves:
+            return [None] * n
+        probs = self.probabilities(queries)
+        out: List[Optional[List[str]]] = [None] * n
+        undecided = np.arange(n)
+        for _, prefixes, membership in self.levels:
+            if not len(undecided):
+                break
+            level = probs[undecided] @ membership
+            order = np.argsort(-level, axis=1)[:, :self.max_partitions]
+            covered = np.cumsum(np.take_along_axis(level, order, axis=1), axis=1)
+            needed = np.argmax(covered >= self.threshold, axis=1) + 1
+            confident = covered[:, -1] >= self.threshold
+            for i in np.flatnonzero(confident):
+                out[undecided[i]] = [prefixes[j] for j in order[i, :needed[i]]]
+            undecided = undecided[~confident]
+        return out
+
+
+def main():
+    from quantized_search import recall_at_k
+    from ranking_metrics import Labels, Submission, compute_metrics, load_records
+
+    parser = argparse.ArgumentParser(description='Latency and recall of category-prefiltered search')
+    parser.add_argument('--store', default='output/embeddings/dense',
+                        help='Channel EmbeddingStore (default: output/embeddings/dense)')
+    parser.add_argument('--products', default=PRODUCTS_PATH,
+                        help=f'Catalog with category_path (default: {PRODUCTS_PATH})')
+    parser.add_argument('--query-model', default=None,
+                        help='Query encoder (default: the store\'s model_path)')
+    parser.add_argument('--queries', default=QUERIES_PATH, help=f'Labelled queries (default: {QUERIES_PATH})')
+    parser.add_argument('--labels', default=LABELS_PATH, help=f'Query labels (default: {LABELS_PATH})')
+    parser.add_argument('--k', type=int, default=30, help='Results per query (default: 30)')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.5, 0.7, 0.9],
+                        help='Predictor confidence thresholds to compare (default: 0.5 0.7 0.9)')
+    parser.add_argument('--temperature', type=float, default=0.05, help='Predictor softmax temperature (default: 0.05)')
+    parser.add_argument('--max-partitions', type=int, default=2,
+                        help='Most category prefixes searched per query (default: 2)')
+    args = parser.parse_args()
+
+    store = EmbeddingStore(args.store)
+    query_model = args.query_model or store.meta.get("model_path")
+    if not query_model:
+        raise SystemExit(f"❌ {args.store} has no model_path; pass --query-model")
+
+    start = time.perf_counter()
+    index = PrefilteredIndex.from_store(args.store, args.products)
+    categories = index.categories
+    print(f"✅ {len(index):,} products in {len(categories.leaves):,} categories "
+          f"({len(categories.ranges):,} prefixes, depth {categories.depth}) in {time.perf_counter() - start:.1f}s")
+
+    from sentence_transformers import SentenceTransformer
+    records = load_records(args.queries)
+    query_ids = [r["query_id"] for r in records]
+    queries = SentenceTransformer(query_model).encode([r["query"] for r in records], convert_to_numpy=True,
+                                                       show_progress_bar=False)
+    labels = Labels.from_records(r for r in load_records(args.labels) if r["query_id"] in set(query_ids))
+    print(f"✅ {len(records):,} queries encoded with {query_model}")
+
+    def run(predictor: Optional[CategoryPredictor]) -> Dict:
+        rows = np.empty((len(queries), min(args.k, len(index))), dtype=np.int64)
+        scored = fallbacks = 0
+        times = []
+        for i in range(len(queries)):
+            t0 = time.perf_counter()
+            cats = predictor.predict(queries[i:i + 1]) if predictor is not None else None
+            rows[i] = index.search(queries[i:i + 1], k=args.k, categories=cats)[0][0]
+            times.append(time.perf_counter() - t0)
+            scored += index.last_rows_scored
+            fallbacks += predictor is not None and cats[0] is None
+        records_out = [{"query_id": qid, "product_id": index.ids[r], "rank": j + 1}
+                       for qid, row in zip(query_ids, rows.tolist()) for j, r in enumerate(row)]
+        summary = compute_metrics(labels, Submission.from_records(labels, records_out, depth=args.k),
+                                  ks=(10, args.k)).summary()
+        return {"rows": rows, "ms": 1000 * float(np.mean(times)), "p95_ms": 1000 * float(np.percentile(times, 95)),
+                "scored": scored / (len(queries) * len(index)), "fallback": fallbacks / len(queries),
+                "ndcg": summary["ndcg@10"], "recall": summary[f"recall@{args.k}"]}
+
+    full = run(None)
+    print(f"\n{'=' * 80}")
+    print(f"📊 PREFILTERED vs FULL SCAN ({len(queries):,} queries, top {args.k})")
+    print('=' * 80)
+    header = (f"{'Mode':<16}{'ms/query':>10}{'p95 ms':>9}{'Scored':>9}{'Fallback':>10}"
+              f"{'nDCG@10':>9}{'R@' + str(args.k):>7}{'Top10 vs full':>15}")
+    print(header)
+    print('-' * len(header))
+    print(f"{'full scan':<16}{full['ms']:>10.2f}{full['p95_ms']:>9.2f}{full['scored']:>9.0%}{'-':>10}"
+          f"{full['ndcg']:>9.4f}{full['recall']:>7.4f}{1.0:>15.3f}")
+    for threshold in args.thresholds:
+        predictor = CategoryPredictor(index, threshold=threshold, temperature=args.temperature,
+                                      max_partitions=args.max_partitions)
+        r = run(predictor)
+        print(f"{'prefilter ' + format(threshold, '.2f'):<16}{r['ms']:>10.2f}{r['p95_ms']:>9.2f}{r['scored']:>9.0%}"
+              f"{r['fallback']:>10.0%}{r['ndcg']:>9.4f}{r['recall']:>7.4f}"
+              f"{recall_at_k(r['rows'], full['rows'], 10):>15.3f}")
+
+    print("\nScored = share of catalog rows multiplied per query; fallback = queries below the "
+          "threshold, served by a full scan.")
+
+
+if __name__ == "__main__":
+    main()
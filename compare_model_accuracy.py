@@ -6,50 +6,40 @@ This script evaluates both models on test data and shows improvement metrics.
 Usage:
     python compare_accuracy.py
     python compare_accuracy.py --baseline output/baseline-model --finetuned output/heb-semantic-search
+
+    # Evaluation matrix: any number of models, embeddings cached on disk per model
+    python compare_model_accuracy.py --models output/baseline-model output/heb-semantic-search all-MiniLM-L6-v2 \
+        --json output/model_matrix.json
 """
 
-import json
 import numpy as np
 import argparse
+import json
+import time
 from model_interface_v2 import GrocerySearchModel
-from sentence_transformers import util
+from pair_scoring import PairIndex
+from embedding_cache import DEFAULT_EMBEDDING_CACHE_DIR, EmbeddingCache
 from sklearn.model_selection import train_test_split
 from scipy.stats import spearmanr, pearsonr
-
-
-def load_json(path):
-    """Load JSON file."""
-    with open(path, 'r') as f:
-        return json.load(f)
+from catalog import Catalog
+from token_cache import DEFAULT_CACHE_DIR
 
 
 def load_test_data():
     """Load and prepare test data."""
     print("Loading test data...")
 
-    products = {p['product_id']: p for p in load_json("data/products.json")}
-    queries = {q['query_id']: q['query'] for q in load_json("data/queries_synth_train.json")}
-    labels = load_json("data/labels_synth_train.json")
+    catalog = Catalog.load()
 
-    # Create test examples
+    # Create test examples (products as dicts: evaluate_model encodes them with encode_products)
     all_examples = []
-    for label in labels:
-        query_id = label['query_id']
-        product_id = label['product_id']
-        relevance = label['relevance']
-
-        if query_id not in queries or product_id not in products:
-            continue
-
-        query_text = queries[query_id]
-        product = products[product_id]
-
+    for ex in catalog.labelled_examples():
         all_examples.append({
-            'query': query_text,
-            'product': product,
-            'relevance': relevance,
-            'query_id': query_id,
-            'product_id': product_id
+            'query': ex['query'],
+            'product': catalog.product(ex['product_idx']),
+            'relevance': ex['relevance'],
+            'query_id': ex['query_id'],
+            'product_id': ex['product_id']
         })
 
     # Use same split as training (10% test)
@@ -59,31 +49,36 @@ def load_test_data():
     return test_examples
 
 
-def evaluate_model(model, test_examples, model_name):
-    """Evaluate a model on test data."""
+def evaluate_model(model, test_examples, model_name, embedding_cache=None):
+    """Evaluate a model on test data (optionally through an on-disk EmbeddingCache)."""
     print(f"\n{'=' * 80}")
     print(f"EVALUATING: {model_name}")
     print('=' * 80)
 
-    queries = [ex['query'] for ex in test_examples]
-    products = [ex['product'] for ex in test_examples]
-    true_relevances = [ex['relevance'] for ex in test_examples]
-
-    # Encode queries and products
-    print("Encoding queries...")
-    query_embeddings = model.encode_query(queries, batch_size=32)
-
-    print("Encoding products...")
-    product_embeddings = model.encode_products(products, batch_size=32, show_progress=True)
-
-    # Calculate cosine similarities
-    print("Calculating similarities...")
-    similarities = []
-    for i in range(len(test_examples)):
-        sim = util.cos_sim(query_embeddings[i], product_embeddings[i]).item()
-        similarities.append(sim)
-
-    predicted_scores = np.array(similarities)
+    true_relevances = np.array([ex['relevance'] for ex in test_examples])
+
+    # Encode each unique query and product once, then score only the labelled pairs
+    pairs = PairIndex(
+        [ex['query'] for ex in test_examples],
+        [ex['product'] for ex in test_examples],
+        right_key=lambda product: product['product_id']
+    )
+    print(f"Encoding {len(pairs.left_items):,} unique queries and {len(pairs.right_items):,} unique products...")
+    if embedding_cache is None:
+        predicted_scores = pairs.score(
+            model.encode_texts_bucketed,
+            lambda products: model.encode_products(products, show_progress=True, length_bucketing=True)
+        )
+    else:
+        # Same encoders as above, keyed by the exact text the model sees
+        predicted_scores = pairs.score(
+            lambda queries: embedding_cache.encode("queries", queries, model.encode_texts_bucketed),
+            lambda products: embedding_cache.encode(
+                "products",
+                [model.format_product(p) for p in products],
+                lambda texts: model.encode_texts_bucketed(texts, show_progress=True)
+            )
+        )
 
     # Calculate correlation metrics
     spearman_corr, _ = spearmanr(true_relevances, predicted_scores)
@@ -96,13 +91,12 @@ def evaluate_model(model, test_examples, model_name):
 
     avg_scores_by_relevance = {}
     for rel in [0, 1, 2, 3]:
-        indices = [i for i, ex in enumerate(test_examples) if ex['relevance'] == rel]
-        if indices:
-            scores = predicted_scores[indices]
+        scores = predicted_scores[true_relevances == rel]
+        if len(scores):
             avg_score = np.mean(scores)
             std_score = np.std(scores)
             avg_scores_by_relevance[rel] = avg_score
-            print(f"{rel:<12} {avg_score:<12.4f} {std_score:<12.4f} {len(indices):<10,}")
+            print(f"{rel:<12} {avg_score:<12.4f} {std_score:<12.4f} {len(scores):<10,}")
 
     # Calculate separation between relevance levels
     if 0 in avg_scores_by_relevance and 3 in avg_scores_by_relevance:
@@ -239,6 +233,81 @@ def show_example_comparisons(baseline_results, finetuned_results, test_examples,
             print(f"   Regression: {item['improvement']:.4f}")
 
 
+MATRIX_COLUMNS = [
+    ('spearman', 'Spearman'),
+    ('pearson', 'Pearson'),
+    ('separation', 'Separation'),
+    ('avg_rel_0', 'Avg rel 0'),
+    ('avg_rel_3', 'Avg rel 3'),
+    ('eval_seconds', 'Eval s'),
+    ('cache_hit_rate', 'Cache hit'),
+]
+
+
+def evaluate_matrix(model_paths, test_examples, cache_dir, token_cache_dir=None):
+    """
+    Evaluate any number of models on the same test data.
+
+    Each model's query and product embeddings are cached on disk under its
+    fingerprint, so re-runs and newly added models only encode what is missing.
+
+    Args:
+        model_paths: Model names or paths
+        test_examples: Examples from load_test_data()
+        cache_dir: EmbeddingCache root ("" to disable caching)
+        token_cache_dir: Optional pre-tokenized corpus cache directory
+
+    Returns:
+        List of per-model metric dicts
+    """
+    rows = []
+    for path in model_paths:
+        model = GrocerySearchModel(model_path=path, token_cache_dir=token_cache_dir)
+        cache = EmbeddingCache.for_model(model.model, cache_dir) if cache_dir else None
+
+        start = time.perf_counter()
+        results = evaluate_model(model, test_examples, path, embedding_cache=cache)
+        elapsed = time.perf_counter() - start
+
+        lookups = cache.hits + cache.misses if cache else 0
+        rows.append({
+            'model': path,
+            'fingerprint': cache.fingerprint if cache else None,
+            'spearman': float(results['spearman']),
+            'pearson': float(results['pearson']),
+            'separation': float(results['separation']),
+            **{f'avg_rel_{rel}': float(score) for rel, score in results['avg_by_relevance'].items()},
+            'eval_seconds': elapsed,
+            'cache_hit_rate': cache.hits / lookups if lookups else 0.0,
+        })
+        del model
+    return rows
+
+
+def print_matrix(rows):
+    """Print the evaluation matrix as a table, best Spearman first."""
+    print(f"\n{'=' * 80}")
+    print("📊 MODEL EVALUATION MATRIX")
+    print('=' * 80)
+
+    name_width = max(len('Model'), *(len(row['model']) for row in rows)) + 2
+    print(f"{'Model':<{name_width}}" + "".join(f"{label:>12}" for _, label in MATRIX_COLUMNS))
+    print('-' * (name_width + 12 * len(MATRIX_COLUMNS)))
+    for row in sorted(rows, key=lambda r: r['spearman'], reverse=True):
+        cells = []
+        for key, _ in MATRIX_COLUMNS:
+            value = row.get(key)
+            if value is None:
+                cells.append(f"{'-':>12}")
+            elif key == 'cache_hit_rate':
+                cells.append(f"{value:>12.0%}")
+            elif key == 'eval_seconds':
+                cells.append(f"{value:>12.1f}")
+            else:
+                cells.append(f"{value:>12.4f}")
+        print(f"{row['model']:<{name_width}}" + "".join(cells))
+
+
 def main():
     """Main comparison function."""
     # Parse arguments
@@ -251,8 +320,30 @@ def main():
                         help='Fine-tuned model path (default: output/heb-semantic-search)')
     parser.add_argument('--examples', type=int, default=5,
                         help='Number of example comparisons to show (default: 5)')
+    parser.add_argument('--token-cache', default=DEFAULT_CACHE_DIR,
+                        help=f'Pre-tokenized corpus cache directory, "" to disable (default: {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--models', nargs='+',
+                        help='Evaluate any number of models as a matrix instead of baseline vs fine-tuned')
+    parser.add_argument('--embedding-cache', default=DEFAULT_EMBEDDING_CACHE_DIR,
+                        help=f'Per-model embedding cache for --models, "" to disable (default: {DEFAULT_EMBEDDING_CACHE_DIR})')
+    parser.add_argument('--json',
+                        help='Write the --models metrics matrix to this JSON file')
     args = parser.parse_args()
 
+    if args.models:
+        print("\n" + "=" * 80)
+        print("MODEL EVALUATION MATRIX")
+        print("=" * 80)
+        test_examples = load_test_data()
+        rows = evaluate_matrix(args.models, test_examples, args.embedding_cache,
+                               token_cache_dir=args.token_cache or None)
+        print_matrix(rows)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({'num_examples': len(test_examples), 'models': rows}, f, indent=2)
+            print(f"\n✅ Metrics written to {args.json}")
+        return
+
     print("\n" + "=" * 80)
     print("MODEL ACCURACY COMPARISON")
     print("=" * 80)
@@ -267,7 +358,7 @@ def main():
     print(f"\n{'=' * 80}")
     print("LOADING BASELINE MODEL")
     print('=' * 80)
-    baseline_model = GrocerySearchModel(model_path=args.baseline)
+    baseline_model = GrocerySearchModel(model_path=args.baseline, token_cache_dir=args.token_cache or None)
     print(f"✅ Baseline model loaded")
 
     baseline_results = evaluate_model(baseline_model, test_examples, "Baseline (Untrained)")
@@ -276,7 +367,7 @@ def main():
     print(f"\n{'=' * 80}")
     print("LOADING FINE-TUNED MODEL")
     print('=' * 80)
-    finetuned_model = GrocerySearchModel(model_path=args.finetuned)
+    finetuned_model = GrocerySearchModel(model_path=args.finetuned, token_cache_dir=args.token_cache or None)
     print(f"✅ Fine-tuned model loaded")
 
     finetuned_results = evaluate_model(finetuned_model, test_examples, "Fine-tuned")
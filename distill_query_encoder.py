@@ -0,0 +1,352 @@
+"""
+Distill the fine-tuned model into a smaller, faster query encoder.
+
+Queries are a few words long, but GrocerySearchModel.encode_query still runs
+the full 6-layer MiniLM on each one. This trains a student to reproduce the
+teacher's query embeddings (MSE on the raw sentence embeddings), so it maps
+queries into the existing product embedding space: catalog vectors, stores and
+projections stay as they are, only the query side is swapped.
+
+Students:
+- fewer layers (default): a copy of the teacher keeping --layers evenly spaced
+  transformer layers (6 -> 3 keeps layers 0, 2, 5), initialized from the
+  teacher's weights
+- narrower: --student-model starts from another (smaller) checkpoint, with a
+  linear layer to the teacher's dimension when the widths differ
+
+Training texts are the queries of the query files (minus a held-out share of
+the labelled queries) plus product titles as extra short texts; targets are
+teacher embeddings, so no labels are needed. Training reuses the
+length-bucketed loop of training_pipeline.py.
+
+The report compares teacher and student on the held-out labelled queries:
+single-query and batched latency, nDCG@10 / R@30 against the labels, and the
+overlap of the student's top 10 with the teacher's top 10, searched against
+the teacher's catalog store.
+
+Usage:
+    python distill_query_encoder.py --layers 3
+    python distill_query_encoder.py --layers 2 --epochs 20 --output output/heb-query-L2
+    python distill_query_encoder.py --student-model paraphrase-MiniLM-L3-v2 --output output/heb-query-L3
+
+    model = GrocerySearchModel(query_model_path="output/heb-query-L3")
+    model.encode_query("organic soup")          # student, same space as encode_products
+"""
+
+import argparse
+import copy
+import json
+import os
+import statistics
+import time
+import numpy as np
+import torch
+from typing import Dict, List, Optional, Sequence
+from sentence_transformers import SentenceTransformer, losses, models
+from sentence_transformers.evaluation import MSEEvaluator
+from torch.utils.data import DataLoader
+from catalog import LABELS_PATH, PRODUCTS_PATH, QUERIES_PATH, iter_products
+from embedding_store import EmbeddingStore
+from model_interface_v2 import GrocerySearchModel
+from quantized_search import recall_at_k
+from ranking_metrics import Labels, Submission, compute_metrics, load_records
+from token_cache import model_tokenize
+from training_pipeline import LengthBucketBatchSampler, train
+from vector_search import VectorIndex
+
+DEFAULT_TEACHER = "output/heb-semantic-search"
+DEFAULT_STORE = "output/embeddings/dense"
+DISTILLATION_FILE = "distillation.json"
+
+
+def _layer_list(model: SentenceTransformer) -> torch.nn.ModuleList:
+    """Transformer layer stack of a SentenceTransformer (BERT-style or DistilBERT-style)."""
+    auto_model = model[0].auto_model
+    for path in (("encoder", "layer"), ("transformer", "layer")):
+        module = auto_model
+        for name in path:
+            module = getattr(module, name, None)
+        if isinstance(module, torch.nn.ModuleList):
+            return module
+    raise ValueError(f"Cannot find the transformer layers of {type(auto_model).__name__}")
+
+
+def drop_layers(teacher: SentenceTransformer, num_layers: int) -> SentenceTransformer:
+    """
+    Copy the teacher keeping `num_layers` evenly spaced transformer layers.
+
+    Args:
+        teacher: Teacher SentenceTransformer (left unchanged)
+        num_layers: Layers to keep; the first and last layers are always kept
+
+    Returns:
+        Student SentenceTransformer with the teacher's embeddings, pooling and width
+    """
+    student = copy.deepcopy(teacher)
+    layers = _layer_list(student)
+    if not 0 < num_layers <= len(layers):
+        raise ValueError(f"--layers must be between 1 and {len(layers)}, got {num_layers}")
+    keep = sorted(set(np.linspace(0, len(layers) - 1, num_layers).round().astype(int).tolist()))
+    kept = torch.nn.ModuleList([layers[i] for i in keep])
+    auto_model = student[0].auto_model
+    if hasattr(auto_model, "encoder"):
+        auto_model.encoder.layer = kept
+    else:
+        auto_model.transformer.layer = kept
+    config = auto_model.config
+    for attr in ("num_hidden_layers", "n_layers"):
+        if hasattr(config, attr):
+            setattr(config, attr, len(kept))
+    return student
+
+
+def build_student(teacher: SentenceTransformer, num_layers: Optional[int] = None,
+                  student_model: Optional[str] = None) -> SentenceTransformer:
+    """
+    Student query encoder producing vectors of the teacher's dimension.
+
+    Args:
+        teacher: Teacher SentenceTransformer
+        num_layers: Keep this many teacher layers (ignored with student_model)
+        student_model: Start from this checkpoint instead of the teacher
+
+    Returns:
+        Untrained student
+    """
+    if not student_model:
+        return drop_layers(teacher, num_layers or max(1, len(_layer_list(teacher)) // 2))
+    student = SentenceTransformer(student_model, device=teacher.device)
+    student_dim = student.get_sentence_embedding_dimension()
+    teacher_dim = teacher.get_sentence_embedding_dimension()
+    if student_dim != teacher_dim:
+        student.append(models.Dense(student_dim, teacher_dim, activation_function=torch.nn.Identity()))
+    return student
+
+
+def count_parameters(model: SentenceTransformer) -> int:
+    return sum(p.numel() for p in model.parameters())
+
+
+class DistillData:
+    """Tokenized training texts with their teacher embeddings."""
+
+    def __init__(self, token_ids: List[np.ndarray], targets: np.ndarray, pad_id: int = 0):
+        self.token_ids = token_ids
+        self.lengths = np.array([len(t) for t in token_ids], dtype=np.int64)
+        self.targets = targets
+        self.pad_id = pad_id
+
+    @classmethod
+    def from_texts(cls, student: SentenceTransformer, teacher: SentenceTransformer,
+                   texts: List[str], batch_size: int = 256) -> "DistillData":
+        """Tokenize with the student and encode the targets with the teacher once."""
+        targets = teacher.encode(texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+        token_ids = [np.asarray(t, dtype=np.int32) for t in model_tokenize(student, texts)]
+        return cls(token_ids, targets.astype(np.float32), student.tokenizer.pad_token_id or 0)
+
+    def __len__(self) -> int:
+        return len(self.token_ids)
+
+
+class _DistillCollator:
+    """Pads a batch of text indices; labels are the teacher embeddings."""
+
+    def __init__(self, data: DistillData):
+        self.data = data
+
+    def __call__(self, indices: List[int]):
+        d = self.data
+        features = GrocerySearchModel.pad_token_ids([d.token_ids[i] for i in indices], d.pad_id)
+        return [features], torch.from_numpy(d.targets[np.asarray(indices)])
+
+
+def make_distill_loader(data: DistillData, batch_size: int = 64, num_workers: int = 0,
+                        seed: int = 42) -> DataLoader:
+    """Length-bucketed DataLoader yielding ([features], teacher embeddings)."""
+    return DataLoader(
+        range(len(data)),
+        batch_sampler=LengthBucketBatchSampler(data.lengths, batch_size, seed=seed),
+        collate_fn=_DistillCollator(data),
+        num_workers=num_workers,
+        persistent_workers=num_workers > 0
+    )
+
+
+def distillation_texts(query_paths: Sequence[str], exclude: set, products_path: Optional[str],
+                       max_titles: int) -> List[str]:
+    """Distinct query texts (minus `exclude`) followed by up to max_titles product titles."""
+    seen, texts = set(exclude), []
+
+    def add(text: Optional[str]):
+        text = (text or "").strip()
+        if text and text not in seen:
+            seen.add(text)
+            texts.append(text)
+
+    for path in query_paths:
+        for record in load_records(path):
+            add(record["query"])
+    if products_path and max_titles:
+        titles = 0
+        for product in iter_products(products_path):
+            if titles >= max_titles:
+                break
+            before = len(texts)
+            add(product.get("title"))
+            titles += len(texts) - before
+    return texts
+
+
+def query_latency(model: SentenceTransformer, texts: List[str], batch_size: int = 64) -> Dict[str, float]:
+    """
+    Query encoding latency: one query per forward pass, and batched throughput.
+
+    Returns:
+        {"median_ms", "p95_ms"} per single query and "batch_qps" at batch_size
+    """
+    model.eval()
+    times = []
+    with torch.inference_mode():
+        for text in texts[:3]:
+            model.encode(text, show_progress_bar=False)
+        for text in texts:
+            start = time.perf_counter()
+            model.encode(text, show_progress_bar=False)
+            times.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        model.encode(texts, batch_size=batch_size, show_progress_bar=False)
+        batch_seconds = time.perf_counter() - start
+    times.sort()
+    return {"median_ms": statistics.median(times), "p95_ms": times[min(len(times) - 1, int(0.95 * len(times)))],
+            "batch_qps": len(texts) / max(batch_seconds, 1e-9)}
+
+
+def retrieval_metrics(index: VectorIndex, vectors: np.ndarray, query_ids: List[str], labels: Labels,
+                      teacher_rows: Optional[np.ndarray] = None, k: int = 30,
+                      overlap_k: int = 10) -> Dict[str, float]:
+    """nDCG@10 / R@k / MRR against the labels, plus top-overlap_k overlap with the teacher."""
+    rows, _ = index.search(vectors, k=k)
+    records = [{"query_id": qid, "product_id": index.ids[r], "rank": j + 1}
+               for qid, row in zip(query_ids, rows.tolist()) for j, r in enumerate(row)]
+    summary = compute_metrics(labels, Submission.from_records(labels, records, depth=k), ks=(10, k)).summary()
+    summary[f"teacher_overlap@{overlap_k}"] = (recall_at_k(rows, teacher_rows, overlap_k)
+                                               if teacher_rows is not None else 1.0)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distill a smaller query encoder into the existing product space')
+    parser.add_argument('--teacher', default=DEFAULT_TEACHER, help=f'Teacher model (default: {DEFAULT_TEACHER})')
+    parser.add_argument('--layers', type=int, default=None,
+                        help='Teacher layers the student keeps (default: half of them)')
+    parser.add_argument('--student-model', default=None,
+                        help='Start from this (smaller) checkpoint instead of a layer-dropped teacher')
+    parser.add_argument('--output', default=None,
+                        help='Student output directory (default: <teacher>-query-L<layers> or -student)')
+    parser.add_argument('--queries', nargs='+', default=[QUERIES_PATH, "data/queries_synth_test.json"],
+                        help='Query files used as training texts (default: train and test queries)')
+    parser.add_argument('--products', default=PRODUCTS_PATH,
+                        help=f'Products file for extra title texts and a missing store (default: {PRODUCTS_PATH})')
+    parser.add_argument('--titles', type=int, default=50000,
+                        help='Product titles added as training texts (default: 50000)')
+    parser.add_argument('--labels', default=LABELS_PATH, help=f'Query labels (default: {LABELS_PATH})')
+    parser.add_argument('--holdout', type=float, default=0.2,
+                        help='Share of labelled queries held out of training for the report (default: 0.2)')
+    parser.add_argument('--store', default=DEFAULT_STORE,
+                        help=f'Teacher catalog EmbeddingStore, built if missing (default: {DEFAULT_STORE})')
+    parser.add_argument('--epochs', type=int, default=10, help='Training epochs (default: 10)')
+    parser.add_argument('--batch-size', type=int, default=64, help='Texts per batch (default: 64)')
+    parser.add_argument('--lr', type=float, default=1e-4, help='Learning rate (default: 1e-4)')
+    parser.add_argument('--seed', type=int, default=42, help='Hold-out split seed (default: 42)')
+    args = parser.parse_args()
+
+    store_path = args.store
+    if os.path.exists(os.path.join(store_path, EmbeddingStore.META_FILE)):
+        meta = EmbeddingStore(store_path).meta
+        if meta.get("model_path") not in (None, args.teacher):
+            raise SystemExit(f"❌ Store {store_path} was built with {meta['model_path']}, "
+                             f"not {args.teacher}; pass another --store")
+        if meta.get("projection_path") is not None:
+            raise SystemExit(f"❌ Store {store_path} was built with projection {meta['projection_path']}; "
+                             f"pass a store of unprojected {args.teacher} embeddings")
+
+    print(f"Loading teacher: {args.teacher}")
+    teacher = SentenceTransformer(args.teacher)
+    student = build_student(teacher, args.layers, args.student_model)
+    name = "student" if args.student_model else f"query-L{len(_layer_list(student))}"
+    output = args.output or f"{args.teacher.rstrip('/')}-{name}"
+    print(f"✅ Student: {args.student_model or 'layer-dropped teacher'}, {len(_layer_list(student))} layers, "
+          f"{count_parameters(student) / 1e6:.1f}M parameters (teacher {len(_layer_list(teacher))} layers, "
+          f"{count_parameters(teacher) / 1e6:.1f}M)")
+
+    # 1. Hold out labelled queries, distill on everything else
+    query_text = {r["query_id"]: r["query"] for path in args.queries for r in load_records(path)}
+    label_records = [r for r in load_records(args.labels) if r["query_id"] in query_text]
+    labelled = sorted({r["query_id"] for r in label_records})
+    rng = np.random.default_rng(args.seed)
+    held_out = sorted(rng.choice(labelled, max(1, round(len(labelled) * args.holdout)), replace=False).tolist())
+    held_out_texts = [query_text[qid] for qid in held_out]
+    texts = distillation_texts(args.queries, set(held_out_texts), args.products, args.titles)
+    print(f"✅ {len(texts):,} training texts, {len(held_out):,} held-out labelled queries")
+
+    data = DistillData.from_texts(student, teacher, texts)
+    loader = make_distill_loader(data, batch_size=args.batch_size, seed=args.seed)
+    evaluator = MSEEvaluator(held_out_texts, held_out_texts, teacher_model=teacher,
+                             name="held_out", write_csv=False)
+
+    # 2. Distill
+    print(f"\nDistilling for {args.epochs} epochs ({len(loader)} batches each)...")
+    start = time.perf_counter()
+    result = train(student, loader, losses.MSELoss(student), epochs=args.epochs, lr=args.lr,
+                   warmup_steps=min(100, len(loader)), evaluator=evaluator, evaluation_steps=0,
+                   output_path=output)
+    train_seconds = time.perf_counter() - start
+    student = SentenceTransformer(output)
+
+    # 3. Teacher vs student on the held-out queries
+    if not os.path.exists(os.path.join(store_path, EmbeddingStore.META_FILE)):
+        from batch_retrieval import build_store
+        build_store(GrocerySearchModel(args.teacher), args.products, store_path)
+    index = VectorIndex.from_store(store_path)
+    labels = Labels.from_records(r for r in label_records if r["query_id"] in set(held_out))
+
+    teacher_vectors = teacher.encode(held_out_texts, convert_to_numpy=True, show_progress_bar=False)
+    student_vectors = student.encode(held_out_texts, convert_to_numpy=True, show_progress_bar=False)
+    teacher_rows, _ = index.search(teacher_vectors, k=10)
+    cosine = float(np.mean(np.sum(teacher_vectors * student_vectors, axis=1)
+                           / (np.linalg.norm(teacher_vectors, axis=1) * np.linalg.norm(student_vectors, axis=1)
+                              + 1e-12)))
+
+    report = {}
+    for role, model, vectors in (("teacher", teacher, teacher_vectors), ("student", student, student_vectors)):
+        report[role] = {**query_latency(model, held_out_texts, args.batch_size),
+                        **retrieval_metrics(index, vectors, held_out, labels,
+                                            None if role == "teacher" else teacher_rows),
+                        "layers": len(_layer_list(model)), "parameters": count_parameters(model)}
+
+    print(f"\n{'=' * 80}")
+    print(f"📊 DISTILLED QUERY ENCODER ({len(held_out):,} held-out labelled queries, {len(index):,} products)")
+    print('=' * 80)
+    header = (f"{'Model':<9}{'Layers':>7}{'Params':>9}{'ms/query':>10}{'p95 ms':>8}{'batch q/s':>11}"
+              f"{'nDCG@10':>9}{'R@30':>7}{'Top10 vs T':>12}")
+    print(header)
+    print('-' * len(header))
+    for role, r in report.items():
+        print(f"{role:<9}{r['layers']:>7}{r['parameters'] / 1e6:>8.1f}M{r['median_ms']:>10.2f}{r['p95_ms']:>8.2f}"
+              f"{r['batch_qps']:>11,.0f}{r['ndcg@10']:>9.4f}{r['recall@30']:>7.4f}{r['teacher_overlap@10']:>12.3f}")
+    t, s = report["teacher"], report["student"]
+    print(f"\n⚡ Speedup: {t['median_ms'] / max(s['median_ms'], 1e-9):.2f}x per query, "
+          f"{s['batch_qps'] / max(t['batch_qps'], 1e-9):.2f}x batched")
+    print(f"📉 Recall loss: R@30 {s['recall@30'] - t['recall@30']:+.4f}, nDCG@10 {s['ndcg@10'] - t['ndcg@10']:+.4f}; "
+          f"mean cosine to teacher {cosine:.4f}")
+
+    with open(os.path.join(output, DISTILLATION_FILE), 'w') as f:
+        json.dump({"teacher": args.teacher, "student_model": args.student_model, "store": store_path,
+                   "texts": len(texts), "held_out_queries": len(held_out), "epochs": args.epochs,
+                   "train_seconds": round(train_seconds, 1), "best_score": result["best_score"],
+                   "mean_cosine": cosine, "report": report}, f, indent=2)
+    print(f"\n✅ Student saved to {output}; use GrocerySearchModel(query_model_path=\"{output}\")")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+On-disk cache of model embeddings for evaluation runs.
+
+Embeddings are stored per model fingerprint, one EmbeddingStore per kind of
+text (queries, products), with rows keyed by a 64-bit hash of the encoded text:
+
+    <cache_dir>/<fingerprint>/queries/    EmbeddingStore (ids = text hashes)
+    <cache_dir>/<fingerprint>/products/
+
+The fingerprint covers the model weights, architecture and tokenizer, so a
+retrained model never reads stale vectors, while re-running an evaluation or
+adding another model only encodes texts that are not cached yet.
+
+Usage:
+    from embedding_cache import EmbeddingCache
+
+    cache = EmbeddingCache.for_model(grocery_model.model, "output/eval-embeddings")
+    query_embeddings = cache.encode("queries", queries, grocery_model.encode_texts_bucketed)
+"""
+
+import hashlib
+import numpy as np
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence
+from embedding_store import EmbeddingStore
+from token_cache import text_hashes, tokenizer_fingerprint
+
+DEFAULT_EMBEDDING_CACHE_DIR = "output/eval-embeddings"
+
+
+def model_fingerprint(model) -> str:
+    """
+    Fingerprint a SentenceTransformer by its weights, modules and tokenizer.
+
+    Args:
+        model: SentenceTransformer instance
+
+    Returns:
+        Hex digest that changes whenever the model's embeddings could change
+    """
+    h = hashlib.sha256()
+    h.update(repr(model).encode("utf-8"))
+    h.update(tokenizer_fingerprint(model).encode("utf-8"))
+    for name, tensor in model.state_dict().items():
+        h.update(name.encode("utf-8"))
+        h.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return h.hexdigest()[:16]
+
+
+class EmbeddingCache:
+    """Text-hash -> embedding cache for one model, backed by EmbeddingStores."""
+
+    def __init__(self, cache_dir: str, fingerprint: str):
+        """
+        Args:
+            cache_dir: Root cache directory
+            fingerprint: Model fingerprint (see model_fingerprint)
+        """
+        self.path = Path(cache_dir) / fingerprint
+        self.fingerprint = fingerprint
+        # Rows served from disk / newly encoded, across all encode() calls
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def for_model(cls, model, cache_dir: str = DEFAULT_EMBEDDING_CACHE_DIR) -> "EmbeddingCache":
+        """Open the cache for a SentenceTransformer."""
+        return cls(cache_dir, model_fingerprint(model))
+
+    def _open(self, name: str) -> Optional[EmbeddingStore]:
+        path = self.path / name
+        if not (path / EmbeddingStore.META_FILE).exists():
+            return None
+        store = EmbeddingStore(str(path), mode="r+")
+        # Drop ids past the last complete row (interrupted append)
+        if len(store.ids) != store.count:
+            store.set_ids(store.ids[:store.count])
+        return store
+
+    def encode(
+        self,
+        name: str,
+        texts: Sequence[str],
+        encode_fn: Callable[[List[str]], np.ndarray]
+    ) -> np.ndarray:
+        """
+        Return embeddings for texts, encoding and caching only the misses.
+
+        Args:
+            name: Store name, e.g. "queries" or "products"
+            texts: Texts to embed (the exact strings the model encodes)
+            encode_fn: Encoder for cache misses (list of texts -> (n, dim) array)
+
+        Returns:
+            float32 array of shape (len(texts), dim)
+        """
+        keys = [format(h, "016x") for h in text_hashes(texts).tolist()]
+        store = self._open(name)
+        index = store.id_to_index if store is not None else {}
+
+        missing = [i for i, k in enumerate(keys) if k not in index]
+        if missing:
+            new_keys, new_texts, seen = [], [], set()
+            for i in missing:
+                if keys[i] not in seen:
+                    seen.add(keys[i])
+                    new_keys.append(keys[i])
+                    new_texts.append(texts[i])
+            new_rows = np.asarray(encode_fn(new_texts), dtype=np.float32)
+            if store is None:
+                store = EmbeddingStore.create(str(self.path / name), dim=new_rows.shape[1],
+                                              meta={"fingerprint": self.fingerprint})
+            store.append(new_keys, new_rows)
+            index = store.id_to_index
+
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        if store is None:
+            return np.empty((0, 0), dtype=np.float32)
+        rows = np.fromiter((index[k] for k in keys), dtype=np.int64, count=len(keys))
+        return np.asarray(store.vectors[rows])
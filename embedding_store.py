@@ -0,0 +1,200 @@
+"""
+Memory-mapped on-disk store for product embeddings.
+
+A store is a directory holding:
+    vectors.f32   raw float32 matrix, row-major, shape (count, dim)
+    ids.txt       product id of each row, one per line
+    meta.json     dim, count, dtype and free-form metadata (model path, ...)
+
+Rows can be written at fixed offsets (preallocated, e.g. by parallel workers)
+or appended (streaming), and are read back through np.memmap without loading
+the whole matrix into memory.
+
+Usage:
+    from embedding_store import EmbeddingStore
+
+    # Write
+    store = EmbeddingStore.create("output/embeddings/dense", dim=384, ids=product_ids)
+    store.write_rows(0, embeddings)
+    store.close()
+
+    # Read
+    store = EmbeddingStore("output/embeddings/dense")
+    vectors = store.vectors                 # np.memmap (count, dim)
+    vec = store.get(["1728261"])            # rows by product id
+"""
+
+import json
+import os
+import numpy as np
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+
+class EmbeddingStore:
+    """Directory of float32 vectors plus a product-id index, read via np.memmap."""
+
+    VECTORS_FILE = "vectors.f32"
+    IDS_FILE = "ids.txt"
+    META_FILE = "meta.json"
+
+    def __init__(self, path: str, mode: str = "r"):
+        """
+        Open an existing store.
+
+        Args:
+            path: Store directory
+            mode: "r" for read-only, "r+" to write rows in place or append
+        """
+        self.path = Path(path)
+        self.mode = mode
+        meta_path = self.path / self.META_FILE
+        if not meta_path.exists():
+            raise FileNotFoundError(f"No embedding store at {self.path} (missing {self.META_FILE})")
+
+        with open(meta_path, 'r') as f:
+            self.meta = json.load(f)
+        self.dim = int(self.meta["dim"])
+        self.count = int(self.meta["count"])
+        self.dtype = np.dtype(self.meta.get("dtype", "float32"))
+        self._vectors: Optional[np.memmap] = None
+        self._ids: Optional[List[str]] = None
+        self._id_to_index: Optional[Dict[str, int]] = None
+
+    @classmethod
+    def create(
+        cls,
+        path: str,
+        dim: int,
+        ids: Optional[List[str]] = None,
+        count: Optional[int] = None,
+        meta: Optional[Dict] = None,
+        dtype: str = "float32"
+    ) -> "EmbeddingStore":
+        """
+        Create (or overwrite) a store.
+
+        Args:
+            path: Store directory
+            dim: Embedding dimension
+            ids: Product ids; if given, space for len(ids) rows is preallocated
+            count: Rows to preallocate when ids are not known yet (default: 0, append mode)
+            meta: Extra metadata saved in meta.json (model path, normalization, ...)
+            dtype: Vector dtype on disk
+
+        Returns:
+            Store opened in "r+" mode
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        if ids is not None:
+            count = len(ids)
+        count = count or 0
+
+        row_bytes = dim * np.dtype(dtype).itemsize
+        with open(path / cls.VECTORS_FILE, 'wb') as f:
+            f.truncate(count * row_bytes)
+        with open(path / cls.IDS_FILE, 'w') as f:
+            if ids is not None:
+                f.writelines(f"{pid}\n" for pid in ids)
+
+        full_meta = dict(meta or {})
+        full_meta.update({"dim": dim, "count": count, "dtype": np.dtype(dtype).name})
+        with open(path / cls.META_FILE, 'w') as f:
+            json.dump(full_meta, f, indent=2)
+
+        return cls(str(path), mode="r+")
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """Memory-mapped (count, dim) matrix."""
+        if self._vectors is None or self._vectors.shape[0] != self.count:
+            if self.count == 0:
+                return np.empty((0, self.dim), dtype=self.dtype)
+            self._vectors = np.memmap(
+                self.path / self.VECTORS_FILE, dtype=self.dtype,
+                mode=self.mode, shape=(self.count, self.dim)
+            )
+        return self._vectors
+
+    @property
+    def ids(self) -> List[str]:
+        """Product id of each row."""
+        if self._ids is None:
+            with open(self.path / self.IDS_FILE, 'r') as f:
+                self._ids = [line.rstrip("\n") for line in f]
+        return self._ids
+
+    @property
+    def id_to_index(self) -> Dict[str, int]:
+        """Map from product id to row index."""
+        if self._id_to_index is None:
+            self._id_to_index = {pid: i for i, pid in enumerate(self.ids)}
+        return self._id_to_index
+
+    def get(self, product_ids: Iterable[str]) -> np.ndarray:
+        """Return the rows for the given product ids (KeyError if unknown)."""
+        index = self.id_to_index
+        rows = [index[pid] for pid in product_ids]
+        return np.asarray(self.vectors[rows])
+
+    def write_rows(self, start: int, rows: np.ndarray):
+        """Write rows in place at offset `start` (store must be preallocated)."""
+        rows = np.asarray(rows, dtype=self.dtype)
+        if start + len(rows) > self.count:
+            raise ValueError(f"Rows {start}:{start + len(rows)} out of range for store of {self.count}")
+        self.vectors[start:start + len(rows)] = rows
+
+    def append(self, ids: List[str], rows: np.ndarray):
+        """Append rows and their product ids at the end of the store."""
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        if rows.shape != (len(ids), self.dim):
+            raise ValueError(f"Expected rows of shape ({len(ids)}, {self.dim}), got {rows.shape}")
+
+        self._vectors = None
+        with open(self.path / self.VECTORS_FILE, 'r+b') as f:
+            f.seek(self.count * self.dim * self.dtype.itemsize)
+            f.write(rows.tobytes())
+        with open(self.path / self.IDS_FILE, 'a') as f:
+            f.writelines(f"{pid}\n" for pid in ids)
+        if self._ids is not None:
+            self._ids.extend(ids)
+        if self._id_to_index is not None:
+            for i, pid in enumerate(ids, start=self.count):
+                self._id_to_index[pid] = i
+        self.count += len(ids)
+        self._write_meta()
+
+    def set_ids(self, ids: List[str]):
+        """Replace the product-id index (must match the number of rows)."""
+        if len(ids) != self.count:
+            raise ValueError(f"Got {len(ids)} ids for {self.count} rows")
+        with open(self.path / self.IDS_FILE, 'w') as f:
+            f.writelines(f"{pid}\n" for pid in ids)
+        self._ids = list(ids)
+        self._id_to_index = None
+
+    def update_meta(self, **values):
+        """Add or overwrite entries in meta.json."""
+        self.meta.update(values)
+        self._write_meta()
+
+    def _write_meta(self):
+        self.meta.update({"dim": self.dim, "count": self.count, "dtype": self.dtype.name})
+        tmp = self.path / (self.META_FILE + ".tmp")
+        with open(tmp, 'w') as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(tmp, self.path / self.META_FILE)
+
+    def flush(self):
+        """Flush pending memory-mapped writes to disk."""
+        if self._vectors is not None and self.mode != "r":
+            self._vectors.flush()
+
+    def close(self):
+        """Flush and release the memory map."""
+        self.flush()
+        self._vectors = None
+
+    def __len__(self) -> int:
+        return self.count
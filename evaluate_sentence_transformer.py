@@ -6,12 +6,14 @@ Usage:
     python compare_baseline.py
     python compare_baseline.py --baseline all-MiniLM-L6-v2 --finetuned output/heb-semantic-search
 """
-import json
 import numpy as np
 import argparse
-from sentence_transformers import SentenceTransformer, util
 from sklearn.model_selection import train_test_split
 from scipy.stats import spearmanr, pearsonr
+from catalog import Catalog
+from model_interface_v2 import GrocerySearchModel
+from pair_scoring import PairIndex
+from token_cache import DEFAULT_CACHE_DIR
 
 # ============================================================================
 # ARGUMENT PARSING
@@ -23,54 +25,28 @@ parser.add_argument('--baseline',
 parser.add_argument('--finetuned',
                     default='output/heb-semantic-search',
                     help='Fine-tuned model path (default: output/heb-semantic-search)')
+parser.add_argument('--token-cache',
+                    default=DEFAULT_CACHE_DIR,
+                    help=f'Pre-tokenized corpus cache directory, "" to disable (default: {DEFAULT_CACHE_DIR})')
 args = parser.parse_args()
 
 # ============================================================================
 # 1. LOAD DATA
 # ============================================================================
-def load_json(path):
-    with open(path, 'r') as f:
-        return json.load(f)
-
-def format_product(product):
-    """Combine product fields into searchable text."""
-    text_parts = [
-        product.get("title", ""),
-        product.get("description", ""),
-        f"Brand: {product.get('brand', '')}.",
-        f"Category: {product.get('category_path', '')}.",
-        f"Ingredients: {product.get('ingredients', '')}.",
-        f"Warning: {product.get('safety_warning', '')}.",
-    ]
-    return " ".join([t for t in text_parts if t])
-
 print("Loading data...")
-products = {p['product_id']: p for p in load_json("data/products.json")}
-queries = {q['query_id']: q['query'] for q in load_json("data/queries_synth_train.json")}
-labels = load_json("data/labels_synth_train.json")
+catalog = Catalog.load()
 
 # Create test examples (same split as training for fair comparison)
-from sentence_transformers import InputExample
-all_examples = []
-
-for label in labels:
-    query_id = label['query_id']
-    product_id = label['product_id']
-    relevance = label['relevance']
-    
-    if query_id not in queries or product_id not in products:
-        continue
-    
-    query_text = queries[query_id]
-    product_text = format_product(products[product_id])
-    
-    all_examples.append({
-        'query': query_text,
-        'product': product_text,
-        'relevance': relevance,
-        'query_id': query_id,
-        'product_id': product_id
-    })
+all_examples = [
+    {
+        'query': ex['query'],
+        'product': ex['product'],
+        'relevance': ex['relevance'],
+        'query_id': ex['query_id'],
+        'product_id': ex['product_id']
+    }
+    for ex in catalog.labelled_examples()
+]
 
 # Use same split as training
 _, test_examples = train_test_split(all_examples, test_size=0.1, random_state=42)
@@ -84,20 +60,13 @@ def evaluate_model(model, examples, model_name):
     print(f"\nEvaluating: {model_name}")
     print("=" * 80)
     
-    queries = [ex['query'] for ex in examples]
-    products = [ex['product'] for ex in examples]
-    true_relevances = [ex['relevance'] for ex in examples]
-    
-    # Encode
-    print("Encoding queries...")
-    query_embeddings = model.encode(queries, show_progress_bar=True, convert_to_tensor=True)
-    print("Encoding products...")
-    product_embeddings = model.encode(products, show_progress_bar=True, convert_to_tensor=True)
+    true_relevances = np.array([ex['relevance'] for ex in examples])
     
-    # Calculate cosine similarities
-    print("Calculating similarities...")
-    similarities = util.cos_sim(query_embeddings, product_embeddings)
-    predicted_scores = [similarities[i][i].item() for i in range(len(examples))]
+    # Encode each unique query/product once, then score only the labelled pairs
+    pairs = PairIndex([ex['query'] for ex in examples], [ex['product'] for ex in examples])
+    print(f"Encoding {len(pairs.left_items):,} unique queries and {len(pairs.right_items):,} unique products...")
+    encode = lambda texts: model.encode_texts_bucketed(texts, show_progress=True)
+    predicted_scores = pairs.score(encode, encode)
     
     # Calculate correlations
     spearman_corr, _ = spearmanr(true_relevances, predicted_scores)
@@ -106,12 +75,11 @@ def evaluate_model(model, examples, model_name):
     # Calculate metrics by relevance level
     print("\nMetrics by relevance level:")
     for rel in [0, 1, 2, 3]:
-        indices = [i for i, ex in enumerate(examples) if ex['relevance'] == rel]
-        if indices:
-            scores = [predicted_scores[i] for i in indices]
+        scores = predicted_scores[true_relevances == rel]
+        if len(scores):
             avg_score = np.mean(scores)
             std_score = np.std(scores)
-            print(f"  Relevance {rel}: avg similarity = {avg_score:.4f} (±{std_score:.4f}) ({len(indices):,} examples)")
+            print(f"  Relevance {rel}: avg similarity = {avg_score:.4f} (±{std_score:.4f}) ({len(scores):,} examples)")
     
     print(f"\nOverall Metrics:")
     print(f"  Spearman correlation: {spearman_corr:.4f}")
@@ -130,7 +98,7 @@ print("\n" + "=" * 80)
 print(f"BASELINE MODEL: {args.baseline}")
 print("=" * 80)
 try:
-    baseline_model = SentenceTransformer(args.baseline)
+    baseline_model = GrocerySearchModel(args.baseline, token_cache_dir=args.token_cache or None)
     baseline_results = evaluate_model(baseline_model, test_examples, args.baseline)
 except Exception as e:
     print(f"❌ Error loading baseline model: {e}")
@@ -140,7 +108,7 @@ print("\n" + "=" * 80)
 print(f"FINE-TUNED MODEL: {args.finetuned}")
 print("=" * 80)
 try:
-    finetuned_model = SentenceTransformer(args.finetuned)
+    finetuned_model = GrocerySearchModel(args.finetuned, token_cache_dir=args.token_cache or None)
     finetuned_results = evaluate_model(finetuned_model, test_examples, args.finetuned)
     
     # ========================================================================
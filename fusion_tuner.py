@@ -0,0 +1,366 @@
+"""
+Tune the reciprocal-rank-fusion settings of HybridSearchService offline.
+
+The backend fuses three ranked lists per query (dense, sparse, image) with
+
+    score(p) = a / (k + rank_dense(p)) + b / (k + rank_sparse(p)) + c / (k + rank_image(p))
+
+over the top `depth` results of each channel (LIMIT 60 in PostgresRepository)
+and cuts the fused list at 64 before reranking (a=0.6, b=0.2, c=0.2, k=60).
+
+This tuner computes every channel's ranked list for every labelled training
+query once (inner product, like pgvector's <#>), caches them, and then scores
+each configuration with array operations over all queries at once:
+
+- Candidates of each query (union of the channel lists) and their per-channel
+  ranks are precomputed as dense (queries x candidates) arrays
+- A configuration is one weighted sum, one argsort and a label lookup
+- Metrics come from ranking_metrics on the fused order: nDCG@10, R@30, and
+  R@cut (how many relevant products reach the reranker)
+
+Channels mirror get_embeddings.py: dense = all-MiniLM-L6-v2 on the backend
+product text, sparse = char n-gram hashing, image = CLIP image embeddings from
+an EmbeddingStore (optional; skipped if not given) vs CLIP text queries.
+
+Usage:
+    python fusion_tuner.py                                  # simplex grid, step 0.1
+    python fusion_tuner.py --random 5000                    # random search
+    python fusion_tuner.py --image-store output/embeddings/image --json output/fusion.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import time
+import numpy as np
+from typing import Dict, List, Optional, Sequence
+from catalog import Catalog, backend_product_text
+from embedding_store import EmbeddingStore
+from ranking_metrics import Labels, Submission, compute_metrics
+from sparse_embedding import ngram_hash_embeddings
+from vector_search import top_k
+
+CHANNELS = ("dense", "sparse", "image")
+# Current HybridSearchService / PostgresRepository settings
+BACKEND_CONFIG = {"a": 0.6, "b": 0.2, "c": 0.2, "k": 60, "depth": 60, "cut": 64}
+DEFAULT_CACHE = "output/fusion-cache/rankings.npz"
+
+
+# ============================================================================
+# CHANNEL RANKINGS (computed once, cached)
+# ============================================================================
+def compute_rankings(
+    catalog: Catalog,
+    query_texts: List[str],
+    depth: int,
+    dense_model: str = "all-MiniLM-L6-v2",
+    image_store: Optional[str] = None,
+    image_model: str = "clip-ViT-B-32"
+) -> Dict[str, np.ndarray]:
+    """
+    Rank catalog rows for each query in every channel.
+
+    Returns:
+        Channel name -> (num_queries, depth) int32 catalog rows, best first
+        (-1 where the channel has fewer products)
+    """
+    from sentence_transformers import SentenceTransformer
+
+    products = catalog.products
+    texts = [backend_product_text(p) for p in products]
+    rankings = {}
+
+    print(f"Dense channel ({dense_model})...")
+    model = SentenceTransformer(dense_model)
+    product_vectors = model.encode(texts, convert_to_numpy=True, show_progress_bar=True)
+    query_vectors = model.encode(query_texts, convert_to_numpy=True)
+    rankings["dense"] = top_k(query_vectors, product_vectors, depth)[0]
+
+    print("Sparse channel (char n-gram hashing)...")
+    rankings["sparse"] = top_k(ngram_hash_embeddings(query_texts),
+                               ngram_hash_embeddings(texts), depth)[0]
+
+    if image_store:
+        print(f"Image channel ({image_model}, {image_store})...")
+        store = EmbeddingStore(image_store)
+        rows = [catalog.product_index.get(pid, -1) for pid in store.ids]
+        known = np.flatnonzero(np.asarray(rows) >= 0)
+        store_rows = np.asarray(rows)[known]
+        image_vectors = np.asarray(store.vectors)[known]
+        query_vectors = SentenceTransformer(image_model).encode(query_texts, convert_to_numpy=True)
+        ranked = top_k(query_vectors, image_vectors, depth)[0]
+        rankings["image"] = store_rows[ranked]
+
+    out = {}
+    for name, ranked in rankings.items():
+        padded = np.full((len(query_texts), depth), -1, dtype=np.int32)
+        padded[:, :ranked.shape[1]] = ranked
+        out[name] = padded
+    return out
+
+
+def _store_files_fingerprint(store_path: str) -> List[List[int]]:
+    """(size, mtime_ns) of a store's vectors and ids files; -1 for a missing file."""
+    out = []
+    for name in (EmbeddingStore.VECTORS_FILE, EmbeddingStore.IDS_FILE):
+        path = os.path.join(store_path, name)
+        st = os.stat(path) if os.path.exists(path) else None
+        out.append([st.st_size, st.st_mtime_ns] if st else [-1, -1])
+    return out
+
+
+def load_or_compute_rankings(cache_path: str, query_ids: List[str], query_texts: List[str],
+                             catalog: Catalog, depth: int, rebuild: bool = False,
+                             **kwargs) -> Dict[str, np.ndarray]:
+    """Load cached channel rankings if they match the queries, settings, catalog and image store."""
+    image_store = kwargs.get("image_store")
+    signature = json.dumps({"depth": depth, "num_products": catalog.num_products,
+                            "catalog_sources": catalog.source_fingerprint,
+                            "image_store_files": _store_files_fingerprint(image_store) if image_store else None,
+                            **{k: v for k, v in kwargs.items()}}, sort_keys=True)
+    if os.path.exists(cache_path) and not rebuild:
+        cached = np.load(cache_path, allow_pickle=False)
+        if (str(cached["signature"]) == signature
+                and cached["query_ids"].tolist() == query_ids):
+            print(f"✅ Loaded cached rankings from {cache_path}")
+            return {name: cached[name] for name in CHANNELS if name in cached}
+
+    start = time.perf_counter()
+    rankings = compute_rankings(catalog, query_texts, depth, **kwargs)
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    np.savez(cache_path, signature=np.array(signature), query_ids=np.array(query_ids), **rankings)
+    print(f"✅ Computed rankings in {time.perf_counter() - start:.1f}s, cached to {cache_path}")
+    return rankings
+
+
+# ============================================================================
+# VECTORIZED FUSION
+# ============================================================================
+class FusionEvaluator:
+    """
+    Scores RRF configurations against graded labels for all queries at once.
+
+    Attributes:
+        candidates: (Q, C) catalog row of each query's candidates (-1 = padding)
+        ranks: (channels, Q, C) 1-based rank of each candidate per channel (inf = absent)
+        gains: (Q, C) label relevance of each candidate
+    """
+
+    def __init__(self, rankings: Dict[str, np.ndarray], product_ids: List[str], labels: Labels):
+        """
+        Args:
+            rankings: Channel -> (Q, depth) catalog rows, rows aligned with labels.query_ids
+            product_ids: Catalog product id of each row
+            labels: Graded labels
+        """
+        self.labels = labels
+        self.channels = [c for c in CHANNELS if c in rankings]
+        lists = [rankings[c].astype(np.int64) for c in self.channels]
+        num_queries, self.max_depth = lists[0].shape
+
+        # Union of the channel lists per query: sort each row, keep first occurrences
+        stacked = np.sort(np.concatenate(lists, axis=1), axis=1)
+        first = np.ones_like(stacked, dtype=bool)
+        first[:, 1:] = stacked[:, 1:] != stacked[:, :-1]
+        first &= stacked >= 0
+        width = int(first.sum(axis=1).max()) if num_queries else 0
+        q_idx, col = np.nonzero(first)
+        slot = np.cumsum(first, axis=1)[q_idx, col] - 1
+        self.candidates = np.full((num_queries, width), -1, dtype=np.int64)
+        self.candidates[q_idx, slot] = stacked[q_idx, col]
+
+        # Rank of every candidate in every channel (sorted row search via flat keys)
+        num_products = len(product_ids) + 1
+        row_offset = np.arange(num_queries)[:, None] * num_products
+        cand_keys = np.where(self.candidates >= 0, self.candidates + row_offset, -1)
+        flat_keys = cand_keys.ravel()
+        key_order = np.argsort(flat_keys, kind="stable")
+        sorted_keys = flat_keys[key_order]
+        self.ranks = np.full((len(self.channels), num_queries, width), np.inf)
+        for c, ranked in enumerate(lists):
+            valid = ranked >= 0
+            keys = (ranked + row_offset)[valid]
+            rank = np.broadcast_to(np.arange(1, self.max_depth + 1), ranked.shape)[valid]
+            pos = key_order[np.searchsorted(sorted_keys, keys)]
+            self.ranks.reshape(len(self.channels), -1)[c, pos] = rank
+
+        # Label relevance of every candidate
+        label_cols = np.array([labels.product_index.get(pid, -1) for pid in product_ids] + [-1])
+        cols = label_cols[self.candidates]
+        keys = np.arange(num_queries)[:, None] * labels.num_products + cols
+        self.gains = np.zeros(self.candidates.shape, dtype=np.int64)
+        found = cols >= 0
+        if len(labels.keys) and found.any():
+            pos = np.minimum(np.searchsorted(labels.keys, keys[found]), len(labels.keys) - 1)
+            hit = labels.keys[pos] == keys[found]
+            self.gains[np.nonzero(found)[0][hit], np.nonzero(found)[1][hit]] = labels.relevance[pos[hit]]
+        self.submitted = np.ones(num_queries, dtype=bool)
+        self._contrib_key = None
+
+    def _contributions(self, k: float, depth: int):
+        """Per-channel 1 / (k + rank) within depth, reused while (k, depth) is unchanged."""
+        if self._contrib_key != (k, depth):
+            in_depth = self.ranks <= depth
+            self._contrib = np.where(in_depth, 1.0 / (k + self.ranks), 0.0).astype(np.float32)
+            # 0 for candidates within depth in some channel, -inf otherwise
+            self._penalty = np.where(in_depth.any(axis=0), 0.0, -np.inf).astype(np.float32)
+            self._contrib_key = (k, depth)
+        return self._contrib, self._penalty
+
+    def evaluate(self, weights: Sequence[float], k: float, depth: int, cut: int,
+                 ks: Sequence[int] = (10, 30)) -> Dict[str, float]:
+        """
+        Fuse with one configuration and return its metrics.
+
+        Args:
+            weights: One weight per channel (self.channels order)
+            k: RRF constant
+            depth: Results used from each channel (<= cached depth)
+            cut: Length of the fused list
+            ks: Metric cutoffs; recall@cut is always added
+
+        Returns:
+            Dict of mean metrics (ndcg@k, recall@k, recall@cut, mrr)
+        """
+        contrib, penalty = self._contributions(k, min(depth, self.max_depth))
+        scores = np.tensordot(np.asarray(weights, dtype=np.float32), contrib, axes=1)
+        scores += penalty
+
+        # Select the top `cut` and sort only those; ties come out in arbitrary
+        # order, as with the backend's HashMap
+        width = min(cut, scores.shape[1])
+        if width < scores.shape[1]:
+            top = np.argpartition(-scores, width - 1, axis=1)[:, :width]
+        else:
+            top = np.broadcast_to(np.arange(width), scores.shape)
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.take_along_axis(top, np.argsort(-top_scores, axis=1), axis=1)
+        relevance = np.take_along_axis(self.gains, order, axis=1)
+        relevance[np.take_along_axis(scores, order, axis=1) == -np.inf] = 0
+
+        ks = sorted(set(ks) | {cut})
+        matrix = np.zeros((len(relevance), max(ks)), dtype=np.int64)
+        matrix[:, :width] = relevance
+        result = compute_metrics(self.labels, Submission("fusion", matrix, self.submitted, 0), ks)
+        summary = result.summary()
+        return {name: summary[name] for name in result.per_query}
+
+
+# ============================================================================
+# SEARCH SPACES
+# ============================================================================
+def simplex_grid(num_channels: int, step: float) -> List[tuple]:
+    """All weight vectors on a grid of `step` that sum to 1."""
+    units = int(round(1 / step))
+    return [tuple(u / units for u in combo)
+            for combo in itertools.product(range(units + 1), repeat=num_channels)
+            if sum(combo) == units]
+
+
+def grid_configs(num_channels: int, step: float, k_values, depths, cuts) -> List[Dict]:
+    # Weights vary fastest so consecutive configs share the (k, depth) contributions
+    return [{"weights": w, "k": k, "depth": d, "cut": c}
+            for k in k_values for d in depths for c in cuts
+            for w in simplex_grid(num_channels, step)]
+
+
+def random_configs(num_channels: int, n: int, max_k: int, depths, cuts, seed: int = 42) -> List[Dict]:
+    rng = np.random.default_rng(seed)
+    weights = rng.dirichlet(np.ones(num_channels), size=n)
+    configs = [{"weights": tuple(np.round(w, 3).tolist()), "k": int(rng.integers(1, max_k + 1)),
+                "depth": int(rng.choice(depths)), "cut": int(rng.choice(cuts))}
+               for w in weights]
+    return sorted(configs, key=lambda c: (c["k"], c["depth"]))
+
+
+def format_config(config: Dict, channels: Sequence[str]) -> str:
+    weights = " ".join(f"{name[0]}={w:.2f}" for name, w in zip(channels, config["weights"]))
+    return f"{weights} k={config['k']:<4} depth={config['depth']:<4} cut={config['cut']}"
+
+
+def format_row(label: str, result: Dict) -> str:
+    recall_cut = result[f"recall@{result['cut']}"]
+    return f"{label:<58}{result['ndcg@10']:>9.4f}{result['recall@30']:>9.4f}{recall_cut:>9.4f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tune RRF fusion weights over cached channel rankings')
+    parser.add_argument('--dense-model', default='all-MiniLM-L6-v2',
+                        help='Dense channel model (default: all-MiniLM-L6-v2, as in get_embeddings.py)')
+    parser.add_argument('--image-store',
+                        help='EmbeddingStore of CLIP product image embeddings (image channel skipped if omitted)')
+    parser.add_argument('--image-model', default='clip-ViT-B-32',
+                        help='CLIP model for query text in the image channel (default: clip-ViT-B-32)')
+    parser.add_argument('--max-depth', type=int, default=200,
+                        help='Results cached per channel; largest depth that can be tuned (default: 200)')
+    parser.add_argument('--cache', default=DEFAULT_CACHE,
+                        help=f'Channel ranking cache (default: {DEFAULT_CACHE})')
+    parser.add_argument('--rebuild', action='store_true', help='Recompute the channel rankings')
+    parser.add_argument('--weight-step', type=float, default=0.1,
+                        help='Grid step for the weight simplex (default: 0.1)')
+    parser.add_argument('--k-values', type=int, nargs='+', default=[1, 10, 20, 40, 60, 100],
+                        help='RRF k values for the grid (default: 1 10 20 40 60 100)')
+    parser.add_argument('--depths', type=int, nargs='+', default=[30, 60, 100, 200],
+                        help='Per-channel depths to try (default: 30 60 100 200)')
+    parser.add_argument('--cuts', type=int, nargs='+', default=[30, 64],
+                        help='Fused list lengths to try (default: 30 64)')
+    parser.add_argument('--random', type=int, default=0,
+                        help='Random search with this many configurations instead of the grid')
+    parser.add_argument('--top', type=int, default=10, help='Configurations to show (default: 10)')
+    parser.add_argument('--json', help='Write all results to this JSON file')
+    args = parser.parse_args()
+
+    # 1. Data
+    catalog = Catalog.load()
+    labels = Labels.from_records(catalog.labelled_examples())
+    query_texts = [catalog.query_texts[catalog.query_index[qid]] for qid in labels.query_ids]
+    print(f"✅ {labels.num_queries:,} labelled queries, {catalog.num_products:,} products")
+
+    # 2. Channel rankings
+    rankings = load_or_compute_rankings(
+        args.cache, labels.query_ids, query_texts, catalog, args.max_depth, rebuild=args.rebuild,
+        dense_model=args.dense_model, image_store=args.image_store, image_model=args.image_model
+    )
+    evaluator = FusionEvaluator(rankings, catalog.product_ids, labels)
+    channels = evaluator.channels
+    print(f"✅ Channels: {', '.join(channels)}; up to {evaluator.candidates.shape[1]} candidates per query")
+
+    # 3. Configurations
+    depths = [d for d in args.depths if d <= evaluator.max_depth] or [evaluator.max_depth]
+    if args.random:
+        configs = random_configs(len(channels), args.random, max(args.k_values), depths, args.cuts)
+    else:
+        configs = grid_configs(len(channels), args.weight_step, args.k_values, depths, args.cuts)
+    backend = {"weights": tuple(BACKEND_CONFIG[w] for w in "abc")[:len(channels)],
+               "k": BACKEND_CONFIG["k"], "depth": BACKEND_CONFIG["depth"], "cut": BACKEND_CONFIG["cut"]}
+    configs.append(backend)
+
+    # 4. Evaluate
+    start = time.perf_counter()
+    results = [{**config, **evaluator.evaluate(config["weights"], config["k"], config["depth"], config["cut"])}
+               for config in configs]
+    elapsed = time.perf_counter() - start
+    print(f"✅ Evaluated {len(configs):,} configurations in {elapsed:.2f}s "
+          f"({len(configs) / max(elapsed, 1e-9):,.0f}/sec)")
+
+    baseline = results[-1]
+    for metric in ("ndcg@10", "recall@30"):
+        print(f"\n{'=' * 80}")
+        print(f"📊 TOP {args.top} BY {metric.upper()}")
+        print('=' * 80)
+        print(f"{'Configuration':<58}{'nDCG@10':>9}{'R@30':>9}{'R@cut':>9}")
+        print('-' * 85)
+        for r in sorted(results, key=lambda r: r[metric], reverse=True)[:args.top]:
+            print(format_row(format_config(r, channels), r))
+        print(format_row("backend: " + format_config(baseline, channels), baseline))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"channels": channels, "backend": baseline,
+                       "results": [{**r, "weights": list(r["weights"])} for r in results]}, f, indent=2)
+        print(f"\n✅ Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
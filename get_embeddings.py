@@ -6,88 +6,195 @@ Usage:
     python get_embeddings_simple.py "soup" --model output/heb-semantic-search
 """
 import argparse
+import os
+import time
 import numpy as np
 from sentence_transformers import SentenceTransformer
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-import hashlib
 from model_interface_v2 import GrocerySearchModel
 from PIL import Image
 import requests
 from io import BytesIO
 import logging
+import torch
+from sentence_transformers.util import batch_to_device
+from service_metrics import install_metrics, stage, log_sampled
+from admission_control import install_admission_control
+from request_profiling import install_profiling, profiled
+from sparse_embedding import ngram_hash_embedding, ngram_hash_embeddings
+from bulk_embed import BulkEmbedApp
+from concurrent.futures import ThreadPoolExecutor
+from server_startup import WARMUP_TEXTS, configure_torch_threads, install_readiness
+from projection import Projection
+from embedding_cache import model_fingerprint
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("image_embeddings")
 
 app = FastAPI()
+# priority lanes: live queries first, "X-Priority: bulk" (catalog rebuilds) queued behind / 429 on overflow;
+# installed before metrics so rejected requests are still counted
+admission = install_admission_control(app, paths=("/dense-embed", "/sparse-embed", "/image-embed"))
+install_metrics(app, service="embeddings")
+install_profiling(app)
+
+# explicit torch thread counts (TORCH_INTRA_OP_THREADS / TORCH_INTER_OP_THREADS), before any model work
+TORCH_THREADS = configure_torch_threads()
 
 # load model once at startup
+startup_start = time.perf_counter()
 MODEL_NAME = "all-MiniLM-L6-v2"
 model = SentenceTransformer(MODEL_NAME)
+dense_load_seconds = time.perf_counter() - startup_start
 
 IMAGE_MODEL_NAME = "clip-ViT-B-32"
 image_model = SentenceTransformer(IMAGE_MODEL_NAME)
+image_load_seconds = time.perf_counter() - startup_start - dense_load_seconds
+logger.info("Loaded %s in %.2fs and %s in %.2fs", MODEL_NAME, dense_load_seconds,
+            IMAGE_MODEL_NAME, image_load_seconds)
+
+# Optional PCA projections (projection.py), one .npz per channel. Projected
+# vectors are L2-normalized and shorter, so the pgvector columns must be
+# created with the projection's output dimension.
+def load_projection(path, st_model=None):
+    if not path:
+        return None
+    projection = Projection.load(path)
+    if st_model is not None:
+        projection.check(model_fingerprint(st_model))
+    logger.info("Loaded projection %s: %d -> %d dims", path, projection.input_dim, projection.output_dim)
+    return projection
+
+dense_projection = load_projection(os.environ.get("DENSE_PROJECTION", ""), model)
+sparse_projection = load_projection(os.environ.get("SPARSE_PROJECTION", ""))
+image_projection = load_projection(os.environ.get("IMAGE_PROJECTION", ""), image_model)
 
 class EncodingRequest(BaseModel):
     query: str
 
+def encode_one(st_model, value):
+    """Encode a single text or image, timing tokenize and forward separately."""
+    with stage("tokenize"):
+        features = batch_to_device(st_model.tokenize([value]), st_model.device)
+    with stage("forward"), torch.inference_mode():
+        emb = st_model.forward(features)["sentence_embedding"][0]
+    return emb.float().cpu().numpy()
+
+def encode_batch(st_model, values):
+    """Encode a batch of texts or images in one forward pass."""
+    with stage("tokenize"):
+        features = batch_to_device(st_model.tokenize(values), st_model.device)
+    with stage("forward"), torch.inference_mode():
+        emb = st_model.forward(features)["sentence_embedding"]
+    return emb.float().cpu().numpy()
+
+def load_image_input(val):
+    """Product id -> fetched and decoded image; anything else is passed to CLIP as is."""
+    if(len(val) < 15 and val.isdigit()):
+        image_url = "https://images.heb.com/is/image/HEBGrocery/0" + val
+        with stage("fetch"):
+            response = requests.get(image_url, timeout=30)
+            response.raise_for_status()
+        with stage("decode"):
+            return Image.open(BytesIO(response.content)).convert("RGB")
+    return val
+
 @app.post("/dense-embed")
+@profiled
 def denseEncode(req: EncodingRequest):
-    emb = model.encode(req.query)
-    return {"dense_embedding": emb.tolist()}
+    emb = encode_one(model, req.query)
+    if dense_projection is not None:
+        with stage("project"):
+            emb = dense_projection.transform(emb, normalize=True)
+    with stage("serialize"):
+        out = emb.tolist()
+    return {"dense_embedding": out}
 
 @app.post("/sparse-embed")
+@profiled
 def sparseEncode(req: EncodingRequest):
-    # simple deterministic n-gram hashing encoder (char n-grams)
-    size = 1000
-    vec = np.zeros(size, dtype=float)
-    text = req.query.lower()
-
-    # character n-grams (3..5)
-    min_n = 3
-    max_n = 5
-    for n in range(min_n, max_n + 1):
-        if len(text) < n:
-            continue
-        for i in range(len(text) - n + 1):
-            ngram = text[i:i + n]
-            idx = int(hashlib.md5(ngram.encode()).hexdigest(), 16) % size
-            vec[idx] += 1.0
-
-    # optional normalization (L2)
-    norm = np.linalg.norm(vec)
-    if norm > 0:
-        vec = (vec / norm).astype(float)
-
-    return {"sparse_embedding": vec.tolist()}
+    # simple deterministic n-gram hashing encoder (char n-grams), see sparse_embedding.py
+    with stage("ngram_hash"):
+        vec = ngram_hash_embedding(req.query)
+    if sparse_projection is not None:
+        with stage("project"):
+            vec = sparse_projection.transform(vec, normalize=True)
+
+    with stage("serialize"):
+        out = vec.tolist()
+    return {"sparse_embedding": out}
 
 @app.post("/image-embed")
+@profiled
 def imageEncode(req: EncodingRequest):
     try:
         # Fetch image data
         val = req.query.strip()
-        logger.info(f"Received input: {val}")
-
-        if(len(val) < 15 and val.isdigit()):
-            image_url = "https://images.heb.com/is/image/HEBGrocery/0" + val
-            logger.info(f"image url: {image_url}")
-            response = requests.get(image_url, timeout=30)
-            response.raise_for_status()
-            img = Image.open(BytesIO(response.content)).convert("RGB")
-        else:
-            img = val
+        log_sampled(logger, "Received input: %s", val)
+        img = load_image_input(val)
 
     except Exception as e:
-        logger.info(f"Error: {e}")
+        logger.warning(f"Failed to retrieve or decode image for {req.query!r}: {e}")
         raise HTTPException(status_code=400, detail=f"Failed to retrieve or decode image: {e}")
 
-    logger.info(f"img value: {img}")
     # Compute embedding
-    emb = image_model.encode(img)
-    logger.info(f"ebmedding: {emb}")
-
-    return {"image_embedding": emb.tolist()}
+    emb = encode_one(image_model, img)
+    if image_projection is not None:
+        with stage("project"):
+            emb = image_projection.transform(emb, normalize=True)
+    log_sampled(logger, "embedding for %s: dim=%d norm=%.4f", val, emb.shape[0], float(np.linalg.norm(emb)))
+
+    with stage("serialize"):
+        out = emb.tolist()
+    return {"image_embedding": out}
+
+# streaming NDJSON bulk endpoint (see bulk_embed.py): {id, text} lines in, {id, vector} lines out,
+# one bulk admission slot per batch so live queries are served between batches
+def dense_batch(texts):
+    vecs = encode_batch(model, texts)
+    if dense_projection is not None:
+        vecs = dense_projection.transform(vecs, normalize=True)
+    return list(vecs)
+
+def sparse_batch(texts):
+    vecs = ngram_hash_embeddings(texts)
+    if sparse_projection is not None:
+        vecs = sparse_projection.transform(vecs, normalize=True)
+    return list(vecs)
+
+def image_batch(values):
+    results, images, slots = [], [], []
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(load_image_input, v.strip()) for v in values]
+        for i, future in enumerate(futures):
+            try:
+                images.append(future.result())
+                slots.append(i)
+                results.append(None)
+            except Exception as e:
+                results.append(f"Failed to retrieve or decode image: {e}")
+    if images:
+        vecs = encode_batch(image_model, images)
+        if image_projection is not None:
+            vecs = image_projection.transform(vecs, normalize=True)
+        for i, vec in zip(slots, vecs):
+            results[i] = vec
+    return results
+
+app.add_route("/bulk-embed", BulkEmbedApp({"dense": dense_batch, "sparse": sparse_batch, "image": image_batch},
+                                          controller=admission), methods=["POST"])
+
+# warmup passes over representative query lengths and image sizes; /ready is 503 until done
+WARMUP_IMAGES = {"224": Image.new("RGB", (224, 224), (128, 96, 64)),
+                 "640x480": Image.new("RGB", (640, 480), (64, 128, 96))}
+warmup_steps = {f"dense/{label}": (lambda text=text: encode_one(model, text))
+                for label, text in WARMUP_TEXTS.items()}
+warmup_steps.update({f"sparse/{label}": (lambda text=text: ngram_hash_embedding(text))
+                     for label, text in WARMUP_TEXTS.items()})
+warmup_steps.update({f"image/{label}": (lambda img=img: encode_one(image_model, img))
+                     for label, img in WARMUP_IMAGES.items()})
+readiness = install_readiness(app, warmup_steps)
 
 '''
 Test Requests:
@@ -100,4 +207,24 @@ curl -s -X POST "http://127.0.0.1:8001/dense-embed" \
 curl -s -X POST "http://127.0.0.1:8001/sparse-embed" \
   -H "Content-Type: application/json" \
   -d '{"query":"hearty organic soups"}' | jq .
+
+# Profile one request (server started with PROFILING_ENABLED=1):
+curl -s -X POST "http://127.0.0.1:8001/dense-embed" \
+  -H "Content-Type: application/json" -H "X-Profile: cprofile" \
+  -d '{"query":"hearty organic soups"}' -D - -o /dev/null | grep -i x-profile-output
+
+# Bulk / indexing traffic (queued behind live queries, 429 + Retry-After when the bulk queue is full):
+curl -s -X POST "http://127.0.0.1:8001/dense-embed" \
+  -H "Content-Type: application/json" -H "X-Priority: bulk" \
+  -d '{"query":"hearty organic soups"}' | jq .
+
+# Bulk NDJSON stream (one {"id","text"} per line in, {"id","vector"} per line out, same order):
+printf '{"id":"a","text":"hearty organic soups"}\n{"id":"b","text":"milk"}\n' | \
+  curl -s -X POST "http://127.0.0.1:8001/bulk-embed?channel=dense" -H "X-Priority: bulk" --data-binary @-
+
+# Readiness (503 until warmup has finished):
+curl -s "http://127.0.0.1:8001/ready" | jq .
+
+# Metrics (Prometheus text format):
+curl -s "http://127.0.0.1:8001/metrics"
 '''
@@ -0,0 +1,269 @@
+"""
+Offline batch image embeddings for the catalog (the "image" channel).
+
+Instead of downloading, decoding and encoding one image per /image-embed call
+during createDB, this job walks a local directory of product images, decodes
+and resizes them in a thread or process pool, and feeds batches to
+clip-ViT-B-32. Vectors are appended to an EmbeddingStore whose ids.txt is the
+product-id index (output/embeddings/image by default, the store fusion_tuner.py
+reads).
+
+Images are named by product id (<product_id>.jpg, or the CDN's "0<product_id>"
+form); files whose id is not in the catalog are skipped. Images are resized
+(shortest side) and center-cropped to the CLIP input size in the pool, which
+is what the CLIP processor does anyway, so vectors match /image-embed while
+the main process only batches and runs the model.
+
+The job is resumable: rows are appended one batch at a time and products
+already in the store are skipped, so an interrupted run picks up where it
+stopped. Unreadable images are listed in <store>/failed.txt and retried on the
+next run.
+
+Usage:
+    python image_embeddings.py --images data/images
+    python image_embeddings.py --images data/images --workers 8 --batch-size 64 --pool thread
+    python image_embeddings.py --images data/images --restart     # discard the existing store
+"""
+
+import argparse
+import os
+import time
+import numpy as np
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterator, List, Optional, Set, Tuple
+from PIL import Image
+from catalog import PRODUCTS_PATH, iter_chunks, iter_products
+from embedding_store import EmbeddingStore
+
+IMAGE_MODEL_NAME = "clip-ViT-B-32"
+DEFAULT_IMAGE_STORE = "output/embeddings/image"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".tif", ".tiff")
+CLIP_IMAGE_SIZE = 224
+FAILED_FILE = "failed.txt"
+
+
+def iter_image_files(image_dir: str, known_ids: Optional[Set[str]] = None) -> Iterator[Tuple[str, str]]:
+    """
+    Walk an image directory in a stable order.
+
+    Args:
+        image_dir: Root directory (searched recursively)
+        known_ids: Catalog product ids; files matching none of them are skipped
+
+    Yields:
+        (product_id, path) per image file, first file wins for duplicate ids
+    """
+    seen = set()
+    for root, dirs, files in os.walk(image_dir):
+        dirs.sort()
+        for name in sorted(files):
+            stem, ext = os.path.splitext(name)
+            if ext.lower() not in IMAGE_EXTENSIONS:
+                continue
+            product_id = stem
+            if known_ids is not None and product_id not in known_ids:
+                product_id = stem.lstrip("0")  # CDN names are "0" + product id
+                if product_id not in known_ids:
+                    continue
+            if product_id in seen:
+                continue
+            seen.add(product_id)
+            yield product_id, os.path.join(root, name)
+
+
+def load_image(path: str, size: int = CLIP_IMAGE_SIZE) -> Tuple[Optional[np.ndarray], Optional[str]]:
+    """
+    Decode, resize (shortest side) and center-crop one image.
+
+    Runs in the pool; JPEGs are decoded at reduced scale with draft mode when
+    they are much larger than the target.
+
+    Returns:
+        (uint8 array of shape (size, size, 3), None) or (None, error message)
+    """
+    try:
+        with Image.open(path) as img:
+            img.draft("RGB", (size, size))
+            img = img.convert("RGB")
+            w, h = img.size
+            scale = size / min(w, h)
+            img = img.resize((max(size, round(w * scale)), max(size, round(h * scale))), Image.BICUBIC)
+            w, h = img.size
+            left, top = (w - size) // 2, (h - size) // 2
+            return np.asarray(img.crop((left, top, left + size, top + size))), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def _load_batch(paths: List[str], size: int) -> List[Tuple[Optional[np.ndarray], Optional[str]]]:
+    return [load_image(path, size) for path in paths]
+
+
+def open_image_store(path: str, model_name: str, dim: int, restart: bool = False) -> EmbeddingStore:
+    """
+    Open the store for appending, creating it if needed.
+
+    A store from an interrupted run is reused: ids written past the last
+    complete row are dropped, so the next append continues cleanly.
+    """
+    if not restart and os.path.exists(os.path.join(path, EmbeddingStore.META_FILE)):
+        store = EmbeddingStore(path, mode="r+")
+        if store.meta.get("model_path") != model_name or store.dim != dim:
+            raise SystemExit(f"❌ Store {path} holds {store.meta.get('model_path')} vectors ({store.dim} dims), "
+                             f"not {model_name} ({dim} dims); use --restart or another --store")
+        if len(store.ids) != store.count:
+            store.set_ids(store.ids[:store.count])
+        return store
+    return EmbeddingStore.create(path, dim=dim, meta={
+        "model_path": model_name, "normalized": False, "kind": "image", "complete": False
+    })
+
+
+def embed_images(
+    model,
+    items: List[Tuple[str, str]],
+    store: EmbeddingStore,
+    executor: Executor,
+    batch_size: int = 64,
+    image_size: int = CLIP_IMAGE_SIZE,
+    prefetch: int = 4,
+    show_progress: bool = True
+) -> dict:
+    """
+    Decode images in the pool and append their embeddings batch by batch.
+
+    Up to `prefetch` batches are decoded ahead of the batch being encoded, so
+    decoding overlaps the model forward pass with bounded memory.
+
+    Args:
+        model: SentenceTransformer CLIP model
+        items: (product_id, path) pairs still to embed
+        store: EmbeddingStore opened for appending
+        executor: Thread or process pool running load_image
+        batch_size: Images per model batch
+        image_size: Resize / crop size
+        prefetch: Batches decoded ahead
+        show_progress: Show progress bar
+
+    Returns:
+        Counts and timings: embedded, failed (list of (path, error)), seconds, encode_seconds
+    """
+    progress = None
+    if show_progress:
+        from tqdm import tqdm
+        progress = tqdm(total=len(items), desc="Embedding images")
+
+    batches = iter_chunks(items, batch_size)
+    pending = deque()
+
+    def submit_next() -> bool:
+        batch = next(batches, None)
+        if batch is None:
+            return False
+        pending.append((batch, executor.submit(_load_batch, [path for _, path in batch], image_size)))
+        return True
+
+    for _ in range(prefetch):
+        if not submit_next():
+            break
+
+    start = time.perf_counter()
+    encode_seconds = 0.0
+    embedded = 0
+    failed = []
+    while pending:
+        batch, future = pending.popleft()
+        submit_next()
+        ids, images = [], []
+        for (product_id, path), (pixels, error) in zip(batch, future.result()):
+            if pixels is None:
+                failed.append((path, error))
+                continue
+            ids.append(product_id)
+            images.append(Image.fromarray(pixels))
+        if images:
+            t0 = time.perf_counter()
+            embeddings = model.encode(images, batch_size=len(images), convert_to_numpy=True,
+                                      show_progress_bar=False)
+            encode_seconds += time.perf_counter() - t0
+            store.append(ids, embeddings)
+            embedded += len(ids)
+        if progress is not None:
+            progress.update(len(batch))
+
+    if progress is not None:
+        progress.close()
+    return {"embedded": embedded, "failed": failed,
+            "seconds": time.perf_counter() - start, "encode_seconds": encode_seconds}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch CLIP embeddings for a directory of product images')
+    parser.add_argument('--images', required=True, help='Directory of <product_id>.<ext> images (recursive)')
+    parser.add_argument('--store', default=DEFAULT_IMAGE_STORE,
+                        help=f'Output EmbeddingStore directory (default: {DEFAULT_IMAGE_STORE})')
+    parser.add_argument('--model', default=IMAGE_MODEL_NAME,
+                        help=f'CLIP model (default: {IMAGE_MODEL_NAME})')
+    parser.add_argument('--products', default=PRODUCTS_PATH,
+                        help=f'Catalog used to map file names to product ids, "" to accept every file '
+                             f'(default: {PRODUCTS_PATH})')
+    parser.add_argument('--batch-size', type=int, default=64, help='Images per model batch (default: 64)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Decode / resize workers (default: CPU count)')
+    parser.add_argument('--pool', choices=['process', 'thread'], default='process',
+                        help='Decode pool type (default: process)')
+    parser.add_argument('--image-size', type=int, default=CLIP_IMAGE_SIZE,
+                        help=f'Resize / crop size (default: {CLIP_IMAGE_SIZE})')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='torch intra-op threads for the model (default: torch default)')
+    parser.add_argument('--restart', action='store_true',
+                        help='Discard the existing store instead of resuming')
+    parser.add_argument('--no-progress', action='store_true', help='Disable the progress bar')
+    args = parser.parse_args()
+
+    known_ids = None
+    if args.products:
+        known_ids = {str(p["product_id"]) for p in iter_products(args.products)}
+        print(f"✅ Loaded {len(known_ids):,} catalog product ids")
+
+    items = list(iter_image_files(args.images, known_ids))
+    print(f"✅ Found {len(items):,} product images in {args.images}")
+
+    import torch
+    from sentence_transformers import SentenceTransformer
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    print(f"Loading model: {args.model}")
+    model = SentenceTransformer(args.model)
+    dim = model.get_sentence_embedding_dimension()
+
+    store = open_image_store(args.store, args.model, dim, restart=args.restart)
+    done = set(store.ids)
+    todo = [(pid, path) for pid, path in items if pid not in done]
+    if done:
+        print(f"↻ Resuming: {len(done):,} products already in {args.store}, {len(todo):,} to go")
+    store.update_meta(complete=False, image_dir=os.path.abspath(args.images))
+
+    pool_cls = ProcessPoolExecutor if args.pool == "process" else ThreadPoolExecutor
+    with pool_cls(max_workers=args.workers) as executor:
+        result = embed_images(model, todo, store, executor, batch_size=args.batch_size,
+                              image_size=args.image_size, prefetch=max(2, args.workers),
+                              show_progress=not args.no_progress)
+
+    failed_path = os.path.join(args.store, FAILED_FILE)
+    with open(failed_path, 'w') as f:
+        f.writelines(f"{path}\t{error}\n" for path, error in result["failed"])
+    store.update_meta(complete=not result["failed"])
+
+    seconds = max(result["seconds"], 1e-9)
+    print(f"\n📊 Embedded {result['embedded']:,} images in {seconds:.1f}s "
+          f"({result['embedded'] / seconds:,.1f} images/sec; model {result['encode_seconds']:.1f}s, "
+          f"{args.workers} {args.pool} workers)")
+    if result["failed"]:
+        print(f"⚠️  {len(result['failed']):,} images could not be decoded, see {failed_path}")
+    print(f"✅ Store {args.store}: {store.count:,} x {store.dim} ({max(0, len(items) - store.count):,} images missing)")
+
+
+if __name__ == "__main__":
+    main()
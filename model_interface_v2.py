@@ -21,10 +21,20 @@ Usage:
 """
 
 import json
+import os
+import time
+import multiprocessing as mp
 import numpy as np
+import torch
+from concurrent.futures import ProcessPoolExecutor, FIRST_EXCEPTION, wait
 from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Union
+from typing import List, Dict, Union, Optional, Iterable, Iterator, Tuple, Sequence
 from pathlib import Path
+from embedding_store import EmbeddingStore
+from catalog import iter_chunks, format_product
+from token_cache import TokenCache, model_tokenize
+from embedding_cache import model_fingerprint
+from projection import Projection
 
 
 class GrocerySearchModel:
@@ -35,17 +45,50 @@ class GrocerySearchModel:
     trained on query-product pairs with relevance scores.
     """
 
-    def __init__(self, model_path: str = "output/heb-semantic-search"):
+    def __init__(
+        self,
+        model_path: str = "output/heb-semantic-search",
+        token_cache_dir: Optional[str] = None,
+        projection_path: Optional[str] = None,
+        query_model_path: Optional[str] = None
+    ):
         """
         Initialize the model.
 
         Args:
             model_path: Path to the fine-tuned model directory
                        (default: "output/heb-semantic-search")
+            token_cache_dir: Optional pre-tokenized corpus cache directory
+                             (see token_cache.py); used by the length-bucketed encoders
+            projection_path: Optional PCA projection fitted for this model
+                             (see projection.py); applied to every query and product
+                             embedding, so embedding_dim becomes its output dimension
+            query_model_path: Optional distilled query encoder trained into this
+                              model's embedding space (see distill_query_encoder.py);
+                              used by encode_query only
         """
         self.model_path = model_path
         self.model = self._load_model()
-        self.embedding_dim = self.model.get_sentence_embedding_dimension()
+        self.model_dim = self.model.get_sentence_embedding_dimension()
+        self.projection_path = projection_path
+        self.projection = None
+        if projection_path:
+            self.projection = Projection.load(projection_path)
+            self.projection.check(model_fingerprint(self.model))
+        self.embedding_dim = self.projection.output_dim if self.projection else self.model_dim
+        self.query_model_path = query_model_path
+        self.query_model = self.model
+        if query_model_path:
+            self.query_model = SentenceTransformer(query_model_path)
+            if self.query_model.get_sentence_embedding_dimension() != self.model_dim:
+                raise ValueError(f"Query model {query_model_path} has dimension "
+                                 f"{self.query_model.get_sentence_embedding_dimension()}, "
+                                 f"{model_path} has {self.model_dim}")
+        self.token_cache_dir = token_cache_dir
+        self.token_cache = (TokenCache.for_model(self.model, token_cache_dir)
+                            if token_cache_dir else None)
+        # Padding/throughput report from the last length-bucketed encode
+        self.last_encode_stats: Optional[Dict] = None
 
     def _load_model(self) -> SentenceTransformer:
         """Load the sentence transformer model."""
@@ -55,6 +98,17 @@ class GrocerySearchModel:
         except Exception as e:
             raise RuntimeError(f"Failed to load model from {self.model_path}: {e}")
 
+    def _project(self, embeddings, convert_to_numpy: bool, normalize: bool):
+        """Apply the projection (if any); the model itself must not have normalized."""
+        if self.projection is None:
+            return embeddings
+        if isinstance(embeddings, list):
+            embeddings = torch.stack(embeddings)
+        if isinstance(embeddings, torch.Tensor):
+            embeddings = embeddings.float().cpu().numpy()
+        projected = self.projection.transform(embeddings, normalize=normalize)
+        return projected if convert_to_numpy else torch.from_numpy(projected)
+
     @staticmethod
     def format_product(product: Dict) -> str:
         """
@@ -67,15 +121,7 @@ class GrocerySearchModel:
         Returns:
             Formatted product text string
         """
-        text_parts = [
-            product.get("title", ""),
-            product.get("description", ""),
-            f"Brand: {product.get('brand', '')}.",
-            f"Category: {product.get('category_path', '')}.",
-            f"Ingredients: {product.get('ingredients', '')}.",
-            f"Warning: {product.get('safety_warning', '')}.",
-        ]
-        return " ".join([t for t in text_parts if t])
+        return format_product(product)
 
     def encode_query(
         self,
@@ -97,14 +143,14 @@ class GrocerySearchModel:
             Embedding(s) as numpy array of shape (embedding_dim,) for single query
             or (num_queries, embedding_dim) for multiple queries
         """
-        embeddings = self.model.encode(
+        embeddings = self.query_model.encode(
             query,
             convert_to_numpy=convert_to_numpy,
-            normalize_embeddings=normalize,
+            normalize_embeddings=normalize and self.projection is None,
             batch_size=batch_size,
             show_progress_bar=False
         )
-        return embeddings
+        return self._project(embeddings, convert_to_numpy, normalize)
 
     def encode_products(
         self,
@@ -112,7 +158,9 @@ class GrocerySearchModel:
         convert_to_numpy: bool = True,
         normalize: bool = False,
         batch_size: int = 32,
-        show_progress: bool = True
+        show_progress: bool = True,
+        length_bucketing: bool = False,
+        max_tokens_per_batch: int = 4096
     ) -> np.ndarray:
         """
         Generate embeddings for products.
@@ -123,20 +171,32 @@ class GrocerySearchModel:
             normalize: Whether to L2-normalize embeddings
             batch_size: Batch size for encoding
             show_progress: Show progress bar
+            length_bucketing: Sort texts by token length and build batches
+                              under a token budget instead of a fixed count
+            max_tokens_per_batch: Padded-token budget per batch (length_bucketing only)
 
         Returns:
             Embeddings as numpy array of shape (num_products, embedding_dim)
         """
         product_texts = [self.format_product(p) for p in products]
 
+        if length_bucketing:
+            return self.encode_texts_bucketed(
+                product_texts,
+                convert_to_numpy=convert_to_numpy,
+                normalize=normalize,
+                max_tokens_per_batch=max_tokens_per_batch,
+                show_progress=show_progress
+            )
+
         embeddings = self.model.encode(
             product_texts,
             convert_to_numpy=convert_to_numpy,
-            normalize_embeddings=normalize,
+            normalize_embeddings=normalize and self.projection is None,
             batch_size=batch_size,
             show_progress_bar=show_progress
         )
-        return embeddings
+        return self._project(embeddings, convert_to_numpy, normalize)
 
     def encode_text(
         self,
@@ -160,12 +220,356 @@ class GrocerySearchModel:
         embeddings = self.model.encode(
             texts,
             convert_to_numpy=convert_to_numpy,
-            normalize_embeddings=normalize,
+            normalize_embeddings=normalize and self.projection is None,
             batch_size=batch_size,
             show_progress_bar=False
         )
+        return self._project(embeddings, convert_to_numpy, normalize)
+
+    def tokenize_texts(self, texts: List[str], flush_token_cache: bool = True) -> List[List[int]]:
+        """
+        Tokenize texts without padding, the same way the model does.
+
+        Uses the pre-tokenized corpus cache when token_cache_dir was given,
+        so each distinct text is only tokenized once.
+
+        Args:
+            texts: List of text strings
+            flush_token_cache: Write new cache entries to disk now; pass False when
+                               tokenizing many chunks and call flush_token_cache() once
+
+        Returns:
+            List of token id sequences (special tokens included, truncated to max_seq_length)
+        """
+        if self.token_cache is not None:
+            token_ids = self.token_cache.tokenize(texts, self._tokenize_uncached)
+            if flush_token_cache:
+                self.token_cache.flush()
+            return token_ids
+        return self._tokenize_uncached(texts)
+
+    def flush_token_cache(self):
+        """Merge texts tokenized since the last flush into the on-disk token cache."""
+        if self.token_cache is not None:
+            self.token_cache.flush()
+
+    def _tokenize_uncached(self, texts: List[str]) -> List[List[int]]:
+        """Run the model's tokenizer (no padding, no cache)."""
+        return model_tokenize(self.model, texts)
+
+    @staticmethod
+    def token_budget_batches(
+        lengths: np.ndarray,
+        max_tokens_per_batch: int = 4096,
+        max_batch_size: int = 512
+    ) -> List[np.ndarray]:
+        """
+        Group texts into batches of similar length under a padded-token budget.
+
+        Texts are sorted longest first, so the first text of each batch sets its
+        padded length and a batch is closed once batch_len * padded_len would
+        exceed the budget.
+
+        Args:
+            lengths: Token length of each text
+            max_tokens_per_batch: Maximum padded tokens (rows * padded length) per batch
+            max_batch_size: Hard cap on rows per batch
+
+        Returns:
+            List of index arrays into `lengths`, one per batch
+        """
+        order = np.argsort(-np.asarray(lengths), kind="stable")
+        batches = []
+        start = 0
+        while start < len(order):
+            padded_len = max(int(lengths[order[start]]), 1)
+            rows = max(1, min(max_batch_size, max_tokens_per_batch // padded_len))
+            batches.append(order[start:start + rows])
+            start += rows
+        return batches
+
+    @staticmethod
+    def padding_stats(lengths: np.ndarray, batches: List[np.ndarray]) -> Dict:
+        """
+        Compute real vs padded token counts for a batching plan.
+
+        Args:
+            lengths: Token length of each text
+            batches: List of index arrays (one per batch)
+
+        Returns:
+            Dict with real_tokens, padded_tokens, padding_efficiency and num_batches
+        """
+        lengths = np.asarray(lengths)
+        real = int(lengths.sum())
+        padded = int(sum(len(b) * int(lengths[b].max()) for b in batches if len(b)))
+        return {
+            "real_tokens": real,
+            "padded_tokens": padded,
+            "padding_efficiency": real / padded if padded else 1.0,
+            "num_batches": len(batches)
+        }
+
+    @staticmethod
+    def pad_token_ids(sequences: List[Sequence[int]], pad_id: int = 0) -> Dict[str, torch.Tensor]:
+        """
+        Right-pad token id sequences into model inputs.
+
+        Args:
+            sequences: Token id lists or arrays
+            pad_id: Padding token id
+
+        Returns:
+            Dict with input_ids and attention_mask tensors of shape (batch, max_len)
+        """
+        max_len = max((len(seq) for seq in sequences), default=0)
+        input_ids = np.full((len(sequences), max_len), pad_id, dtype=np.int64)
+        attention_mask = np.zeros((len(sequences), max_len), dtype=np.int64)
+        for row, seq in enumerate(sequences):
+            input_ids[row, :len(seq)] = seq
+            attention_mask[row, :len(seq)] = 1
+        return {
+            "input_ids": torch.from_numpy(input_ids),
+            "attention_mask": torch.from_numpy(attention_mask)
+        }
+
+    def _encode_token_batches(
+        self,
+        token_ids: List[List[int]],
+        batches: List[np.ndarray],
+        convert_to_numpy: bool = True,
+        normalize: bool = False,
+        show_progress: bool = False
+    ) -> Union[np.ndarray, torch.Tensor]:
+        """Run the model over pre-tokenized batches and restore input order."""
+        output = torch.empty((len(token_ids), self.model_dim), dtype=torch.float32)
+        iterator = batches
+        if show_progress:
+            from tqdm import tqdm
+            iterator = tqdm(batches, desc="Batches")
+
+        pad_id = self.model.tokenizer.pad_token_id or 0
+        with torch.inference_mode():
+            for idx in iterator:
+                features = self.pad_token_ids([token_ids[i] for i in idx], pad_id)
+                features = {k: v.to(self.model.device) for k, v in features.items()}
+                emb = self.model.forward(features)["sentence_embedding"]
+                if normalize:
+                    emb = torch.nn.functional.normalize(emb, p=2, dim=1)
+                output[torch.as_tensor(idx)] = emb.float().cpu()
+
+        return output.numpy() if convert_to_numpy else output
+
+    def encode_texts_bucketed(
+        self,
+        texts: List[str],
+        convert_to_numpy: bool = True,
+        normalize: bool = False,
+        max_tokens_per_batch: int = 4096,
+        max_batch_size: int = 512,
+        show_progress: bool = False,
+        flush_token_cache: bool = True
+    ) -> np.ndarray:
+        """
+        Encode texts in length-bucketed batches under a token budget.
+
+        Texts are tokenized once, sorted by token length and packed into
+        batches of similar length, so little compute is spent on padding.
+        Output rows are in the original input order. A padding/throughput
+        report is stored in `self.last_encode_stats`.
+
+        Args:
+            texts: List of text strings
+            convert_to_numpy: Return numpy array instead of torch tensor
+            normalize: Whether to L2-normalize embeddings
+            max_tokens_per_batch: Maximum padded tokens per batch
+            max_batch_size: Hard cap on rows per batch
+            show_progress: Show progress bar
+            flush_token_cache: Write new token cache entries to disk before returning
+
+        Returns:
+            Embeddings as numpy array of shape (num_texts, embedding_dim)
+        """
+        start = time.perf_counter()
+        token_ids = self.tokenize_texts(texts, flush_token_cache)
+        tokenize_seconds = time.perf_counter() - start
+
+        lengths = np.fromiter((len(t) for t in token_ids), dtype=np.int64, count=len(token_ids))
+        batches = self.token_budget_batches(lengths, max_tokens_per_batch, max_batch_size)
+        embeddings = self._encode_token_batches(
+            token_ids, batches, convert_to_numpy, normalize and self.projection is None, show_progress
+        )
+        embeddings = self._project(embeddings, convert_to_numpy, normalize)
+
+        elapsed = time.perf_counter() - start
+        stats = self.padding_stats(lengths, batches)
+        stats.update({
+            "num_texts": len(texts),
+            "tokenize_seconds": tokenize_seconds,
+            "total_seconds": elapsed,
+            "texts_per_second": len(texts) / elapsed if elapsed > 0 else 0.0
+        })
+        self.last_encode_stats = stats
         return embeddings
 
+    def encode_products_stream(
+        self,
+        products: Iterable[Dict],
+        chunk_size: int = 1024,
+        output_path: Optional[str] = None,
+        normalize: bool = False,
+        max_tokens_per_batch: int = 4096
+    ) -> Iterator[Tuple[List[str], np.ndarray]]:
+        """
+        Encode a stream of products in fixed-size chunks.
+
+        Only one chunk of products and embeddings is held in memory at a time,
+        so peak memory does not grow with the catalog. Chunks are encoded with
+        the length-bucketed encoder and, if output_path is given, appended to an
+        EmbeddingStore as they are produced. New token cache entries are merged
+        to disk once, when the stream ends.
+
+        Args:
+            products: Iterable of product dictionaries (e.g. catalog.iter_products())
+            chunk_size: Products per chunk
+            output_path: Optional EmbeddingStore directory to write
+            normalize: Whether to L2-normalize embeddings
+            max_tokens_per_batch: Token budget for the length-bucketed encoder
+
+        Yields:
+            (product_ids, embeddings) per chunk, embeddings of shape (chunk, embedding_dim)
+
+        Example:
+            for ids, emb in model.encode_products_stream(iter_products(path), output_path="store"):
+                pass  # the store is complete once the generator is exhausted
+        """
+        store = None
+        if output_path is not None:
+            store = EmbeddingStore.create(
+                output_path, dim=self.embedding_dim,
+                meta={"model_path": self.model_path, "projection_path": self.projection_path,
+                      "normalized": normalize, "complete": False}
+            )
+
+        offset = 0
+        try:
+            for chunk in iter_chunks(products, chunk_size):
+                ids = [str(p.get("product_id", offset + i)) for i, p in enumerate(chunk)]
+                texts = [self.format_product(p) for p in chunk]
+                embeddings = self.encode_texts_bucketed(
+                    texts, normalize=normalize, max_tokens_per_batch=max_tokens_per_batch,
+                    flush_token_cache=False
+                )
+                if store is not None:
+                    store.append(ids, embeddings)
+                offset += len(chunk)
+                yield ids, embeddings
+        finally:
+            self.flush_token_cache()
+
+        if store is not None:
+            store.update_meta(complete=True)
+
+    def encode_products_parallel(
+        self,
+        products: List[Dict],
+        output_path: str,
+        num_workers: Optional[int] = None,
+        threads_per_worker: int = 2,
+        chunk_size: int = 1024,
+        normalize: bool = False,
+        max_tokens_per_batch: int = 4096,
+        pin_cpus: bool = True,
+        show_progress: bool = True
+    ) -> EmbeddingStore:
+        """
+        Encode products across worker processes into a memory-mapped store.
+
+        Products are split into fixed-size chunks; each worker loads its own copy
+        of the model with a pinned torch thread count (and, on Linux, its own
+        CPU set) and writes its chunk's rows straight into the store at the
+        chunk's offset, so the output is in catalog order. If any chunk fails,
+        pending chunks are cancelled, workers are shut down and the error is
+        re-raised; the store is then marked incomplete. Workers only read the
+        token cache; the texts they had to tokenize are sent back and merged
+        into it once, here.
+
+        Args:
+            products: List of product dictionaries (must have "product_id")
+            output_path: EmbeddingStore directory to write
+            num_workers: Worker processes (default: cpu_count // threads_per_worker)
+            threads_per_worker: torch intra-op threads per worker
+            chunk_size: Products per task
+            normalize: Whether to L2-normalize embeddings
+            max_tokens_per_batch: Token budget for the length-bucketed encoder
+            pin_cpus: Pin each worker to its own set of CPUs (Linux only)
+            show_progress: Show progress bar over chunks
+
+        Returns:
+            The completed EmbeddingStore (opened read-only)
+        """
+        cpu_count = os.cpu_count() or 1
+        if num_workers is None:
+            num_workers = max(1, cpu_count // threads_per_worker)
+
+        ids = [str(p.get("product_id", i)) for i, p in enumerate(products)]
+        store = EmbeddingStore.create(
+            output_path, dim=self.embedding_dim, ids=ids,
+            meta={"model_path": self.model_path, "projection_path": self.projection_path,
+                  "normalized": normalize, "complete": False}
+        )
+        store.close()
+
+        ctx = mp.get_context("spawn")
+        cpu_sets = ctx.Queue()
+        for w in range(num_workers):
+            cpus = [(w * threads_per_worker + t) % cpu_count for t in range(threads_per_worker)]
+            cpu_sets.put(cpus if pin_cpus else None)
+
+        chunks = [(start, products[start:start + chunk_size])
+                  for start in range(0, len(products), chunk_size)]
+        progress = None
+        if show_progress:
+            from tqdm import tqdm
+            progress = tqdm(total=len(products), desc="Encoding products")
+
+        executor = ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=ctx,
+            initializer=_pool_init,
+            initargs=(self.model_path, threads_per_worker, cpu_sets, self.projection_path,
+                      self.token_cache_dir)
+        )
+        try:
+            futures = [
+                executor.submit(_pool_encode_chunk, output_path, start,
+                                [self.format_product(p) for p in chunk],
+                                normalize, max_tokens_per_batch)
+                for start, chunk in chunks
+            ]
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_EXCEPTION)
+                for future in done:
+                    count, new_hashes, new_token_ids = future.result()  # re-raises worker errors
+                    if self.token_cache is not None:
+                        self.token_cache.add(new_hashes, new_token_ids)
+                    if progress is not None:
+                        progress.update(count)
+        except BaseException:
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        else:
+            executor.shutdown(wait=True)
+        finally:
+            if progress is not None:
+                progress.close()
+            self.flush_token_cache()
+
+        store = EmbeddingStore(output_path, mode="r+")
+        store.update_meta(complete=True)
+        return EmbeddingStore(output_path)
+
     def get_embedding_dimension(self) -> int:
         """Get the dimensionality of the embeddings."""
         return self.embedding_dim
@@ -213,6 +617,45 @@ class GrocerySearchModel:
             raise ValueError(f"Unsupported format: {format}. Use 'npy' or 'json'")
 
 
+# Per-process model used by encode_products_parallel workers
+_worker_model: Optional[GrocerySearchModel] = None
+
+
+def _pool_init(model_path: str, num_threads: int, cpu_sets, projection_path: Optional[str] = None,
+               token_cache_dir: Optional[str] = None):
+    """Worker initializer: pin CPUs and threads, then load the model once."""
+    global _worker_model
+    cpus = cpu_sets.get()
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(num_threads)
+    torch.set_num_interop_threads(1)
+    _worker_model = GrocerySearchModel(model_path=model_path, projection_path=projection_path)
+    if token_cache_dir:
+        # Lookups only: the parent merges this worker's misses (see _pool_encode_chunk)
+        _worker_model.token_cache = TokenCache.for_model(_worker_model.model, token_cache_dir,
+                                                         read_only=True)
+
+
+def _pool_encode_chunk(output_path: str, start: int, texts: List[str],
+                       normalize: bool, max_tokens_per_batch: int):
+    """
+    Encode one chunk and write it into the store at its row offset.
+
+    Returns:
+        (rows written, hashes, token ids) of the texts this worker had to tokenize
+    """
+    embeddings = _worker_model.encode_texts_bucketed(
+        texts, normalize=normalize, max_tokens_per_batch=max_tokens_per_batch
+    )
+    store = EmbeddingStore(output_path, mode="r+")
+    store.write_rows(start, embeddings)
+    store.close()
+    if _worker_model.token_cache is None:
+        return len(texts), np.empty(0, dtype=np.uint64), []
+    return (len(texts),) + _worker_model.token_cache.pop_pending()
+
+
 # Example usage
 if __name__ == "__main__":
     # Initialize model
@@ -0,0 +1,151 @@
+"""
+Linear-time scoring of labelled (query, product) pairs.
+
+Scoring N pairs with util.cos_sim(query_embeddings, product_embeddings) builds
+an N x N matrix to read its diagonal, and calling cos_sim once per pair pays
+the tensor overhead N times. PairIndex instead:
+
+- Deduplicates each side, so every distinct query and product is encoded once
+- Normalizes the unique embeddings once
+- Computes only the row-wise cosines, in fixed-size chunks, so memory stays
+  O(unique items + chunk) no matter how many pairs there are
+
+Usage:
+    from pair_scoring import PairIndex
+
+    pairs = PairIndex(queries, products)
+    scores = pairs.score(model.encode_texts_bucketed, model.encode_texts_bucketed)
+
+    # Products as dicts: deduplicate by product id
+    pairs = PairIndex(queries, product_dicts, right_key=lambda p: p['product_id'])
+    scores = pairs.score(model.encode_texts_bucketed, model.encode_products)
+"""
+
+import numpy as np
+import torch
+from typing import Callable, Hashable, List, Optional, Sequence
+
+DEFAULT_CHUNK_SIZE = 65536
+
+
+def _unique(items: Sequence, key: Optional[Callable[[object], Hashable]]):
+    """Return (unique items in first-seen order, index of each item in that list)."""
+    positions = {}
+    unique = []
+    index = np.empty(len(items), dtype=np.int64)
+    for i, item in enumerate(items):
+        k = key(item) if key is not None else item
+        pos = positions.get(k)
+        if pos is None:
+            pos = positions[k] = len(unique)
+            unique.append(item)
+        index[i] = pos
+    return unique, index
+
+
+def _as_numpy(embeddings) -> np.ndarray:
+    if isinstance(embeddings, torch.Tensor):
+        embeddings = embeddings.detach().cpu().numpy()
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def normalize_rows(embeddings: np.ndarray, eps: float = 1e-12) -> np.ndarray:
+    """L2-normalize each row (same epsilon as torch.nn.functional.normalize)."""
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, eps)
+
+
+def rowwise_cosine(
+    left_embeddings,
+    right_embeddings,
+    left: Optional[np.ndarray] = None,
+    right: Optional[np.ndarray] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> np.ndarray:
+    """
+    Cosine similarity of pairs of rows.
+
+    Args:
+        left_embeddings: (n_left, dim) array or tensor
+        right_embeddings: (n_right, dim) array or tensor
+        left: Row of left_embeddings for each pair (default: 0..n-1)
+        right: Row of right_embeddings for each pair (default: 0..n-1)
+        chunk_size: Pairs gathered and scored at a time
+
+    Returns:
+        float32 array with one cosine per pair
+    """
+    a = normalize_rows(_as_numpy(left_embeddings))
+    b = normalize_rows(_as_numpy(right_embeddings))
+    if left is None:
+        left = np.arange(len(a))
+    if right is None:
+        right = np.arange(len(b))
+    if len(left) != len(right):
+        raise ValueError(f"Got {len(left)} left rows for {len(right)} right rows")
+
+    scores = np.empty(len(left), dtype=np.float32)
+    for start in range(0, len(left), chunk_size):
+        end = start + chunk_size
+        np.einsum("ij,ij->i", a[left[start:end]], b[right[start:end]], out=scores[start:end])
+    return scores
+
+
+class PairIndex:
+    """
+    Deduplicated view of a list of (left, right) pairs.
+
+    Attributes:
+        left_items: Distinct left items (e.g. query texts), first-seen order
+        right_items: Distinct right items (e.g. product texts or dicts)
+        left: Index into left_items for each pair
+        right: Index into right_items for each pair
+    """
+
+    def __init__(
+        self,
+        left_items: Sequence,
+        right_items: Sequence,
+        left_key: Optional[Callable[[object], Hashable]] = None,
+        right_key: Optional[Callable[[object], Hashable]] = None
+    ):
+        """
+        Args:
+            left_items: Left item of each pair
+            right_items: Right item of each pair
+            left_key: Deduplication key for left items (default: the item itself)
+            right_key: Deduplication key for right items (default: the item itself)
+        """
+        if len(left_items) != len(right_items):
+            raise ValueError(f"Got {len(left_items)} left items for {len(right_items)} right items")
+        self.left_items, self.left = _unique(left_items, left_key)
+        self.right_items, self.right = _unique(right_items, right_key)
+
+    def __len__(self) -> int:
+        return len(self.left)
+
+    @property
+    def num_unique(self) -> int:
+        """Number of items that are actually encoded."""
+        return len(self.left_items) + len(self.right_items)
+
+    def score(
+        self,
+        encode_left: Callable[[List], object],
+        encode_right: Callable[[List], object],
+        chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> np.ndarray:
+        """
+        Encode each distinct item once and return the cosine of every pair.
+
+        Args:
+            encode_left: Encodes a list of left items -> (n, dim) array or tensor
+            encode_right: Encodes a list of right items -> (n, dim) array or tensor
+            chunk_size: Pairs scored at a time
+
+        Returns:
+            float32 array with one cosine per pair, in input order
+        """
+        left_embeddings = encode_left(self.left_items)
+        right_embeddings = encode_right(self.right_items)
+        return rowwise_cosine(left_embeddings, right_embeddings, self.left, self.right, chunk_size)
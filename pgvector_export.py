@@ -0,0 +1,393 @@
+"""
+Export the catalog and its embeddings as a PostgreSQL COPY file for pgvector.
+
+DatabaseBuildingService loads the product table with one INSERT per product
+(PostgresRepository.insertProduct), each carrying three vector literals built
+with ArrayList.toString(). This stage writes the same rows as one COPY stream
+instead, from the stored embeddings (EmbeddingStore directories, e.g. written
+by bulk_embed.py / image_embeddings.py) and the catalog fields:
+
+    product_id TEXT PRIMARY KEY, dense_embedding VECTOR(384), sparse_embedding VECTOR(1000),
+    image_embedding VECTOR(512), title, description, brand, category_path, safety_warning,
+    ingredients TEXT
+
+Formats:
+    text     tab-separated COPY text format, vectors as '[x1,...,xn]' (%.9g, exact for float32)
+    binary   PGCOPY binary format, vectors in pgvector's binary layout
+             (int16 dim, int16 unused, dim big-endian float4); smaller and faster to load
+
+Products missing from a store get NULL in that column; products listed twice
+in the catalog are written once (the table's primary key would reject the
+COPY). The file streams product by product, so memory stays flat, and can be
+read back with parse_copy_text / parse_copy_binary to check it without a
+database (--verify).
+
+Load it with (table from PostgresRepository.createTable):
+    psql "$DATABASE_URL" -c "\\copy product (product_id, dense_embedding, ...) FROM 'output/product.copy' WITH (FORMAT binary)"
+
+Usage:
+    python pgvector_export.py --output output/product.copy --format binary --verify
+    python pgvector_export.py --format text --dense output/embeddings/dense-service --image ""
+
+    # or from Python (psycopg2)
+    with open("output/product.copy", "rb") as f:
+        cursor.copy_expert(copy_statement("product", "binary"), f)
+"""
+
+import argparse
+import os
+import struct
+import time
+import numpy as np
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+from catalog import PRODUCTS_PATH, iter_chunks, iter_products
+from embedding_store import EmbeddingStore
+
+VECTOR_COLUMNS = {"dense_embedding": 384, "sparse_embedding": 1000, "image_embedding": 512}
+TEXT_COLUMNS = ("title", "description", "brand", "category_path", "safety_warning", "ingredients")
+COLUMNS = ("product_id",) + tuple(VECTOR_COLUMNS) + TEXT_COLUMNS
+FORMATS = ("text", "binary")
+
+DEFAULT_STORES = {
+    "dense_embedding": "output/embeddings/dense-service",
+    "sparse_embedding": "output/embeddings/sparse-service",
+    "image_embedding": "output/embeddings/image",
+}
+
+BINARY_SIGNATURE = b"PGCOPY\n\377\r\n\0"
+_TEXT_ESCAPES = str.maketrans({"\\": "\\\\", "\n": "\\n", "\r": "\\r", "\t": "\\t"})
+_TEXT_UNESCAPES = {"\\": "\\", "n": "\n", "r": "\r", "t": "\t", "b": "\b", "f": "\f", "v": "\v"}
+
+
+def copy_statement(table: str = "product", fmt: str = "binary") -> str:
+    """COPY ... FROM STDIN statement matching the exported column order."""
+    return f"COPY {table} ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT {fmt})"
+
+
+# ============================================================================
+# WRITERS
+# ============================================================================
+
+class CopyTextWriter:
+    """COPY text format: one tab-separated line per row, \\N for NULL."""
+
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        self._vector_formats: Dict[int, str] = {}
+
+    def _vector(self, vec: np.ndarray) -> str:
+        fmt = self._vector_formats.get(len(vec))
+        if fmt is None:
+            fmt = self._vector_formats[len(vec)] = "[" + ",".join(["%.9g"] * len(vec)) + "]"
+        return fmt % tuple(vec.tolist())
+
+    def write_header(self):
+        pass
+
+    def write_row(self, values: List):
+        fields = []
+        for value in values:
+            if value is None:
+                fields.append("\\N")
+            elif isinstance(value, np.ndarray):
+                fields.append(self._vector(value))
+            else:
+                fields.append(str(value).translate(_TEXT_ESCAPES))
+        self.f.write(("\t".join(fields) + "\n").encode("utf-8"))
+
+    def write_trailer(self):
+        pass
+
+
+class CopyBinaryWriter:
+    """COPY binary format: signature, per-row field count and length-prefixed fields, -1 trailer."""
+
+    def __init__(self, f: BinaryIO):
+        self.f = f
+
+    def write_header(self):
+        # Signature, flags (no OIDs), header extension length
+        self.f.write(BINARY_SIGNATURE + struct.pack(">ii", 0, 0))
+
+    def write_row(self, values: List):
+        parts = [struct.pack(">h", len(values))]
+        for value in values:
+            if value is None:
+                parts.append(struct.pack(">i", -1))
+                continue
+            if isinstance(value, np.ndarray):
+                # pgvector vector_recv: int16 dim, int16 unused, float4[dim]
+                data = struct.pack(">hh", len(value), 0) + value.astype(">f4").tobytes()
+            else:
+                data = str(value).encode("utf-8")
+            parts.append(struct.pack(">i", len(data)))
+            parts.append(data)
+        self.f.write(b"".join(parts))
+
+    def write_trailer(self):
+        self.f.write(struct.pack(">h", -1))
+
+
+# ============================================================================
+# READERS (round-trip checks, no database needed)
+# ============================================================================
+
+def _parse_text_field(field: str, column: str):
+    if field == "\\N":
+        return None
+    if "\\" in field:
+        out, i = [], 0
+        while i < len(field):
+            ch = field[i]
+            if ch == "\\" and i + 1 < len(field):
+                out.append(_TEXT_UNESCAPES.get(field[i + 1], field[i + 1]))
+                i += 2
+            else:
+                out.append(ch)
+                i += 1
+        field = "".join(out)
+    if column in VECTOR_COLUMNS:
+        return np.array(field.strip("[]").split(","), dtype=np.float32)
+    return field
+
+
+def parse_copy_text(f: BinaryIO, columns: Tuple[str, ...] = COLUMNS) -> Iterator[Dict]:
+    """
+    Parse a COPY text file back into rows.
+
+    Yields:
+        {column: value} per row; vectors as float32 arrays, NULL as None
+    """
+    for line in f:
+        line = line.decode("utf-8").rstrip("\n")
+        if line == "\\.":
+            break
+        fields = line.split("\t")
+        if len(fields) != len(columns):
+            raise ValueError(f"Expected {len(columns)} fields, got {len(fields)}: {line[:80]!r}")
+        yield {column: _parse_text_field(field, column) for column, field in zip(columns, fields)}
+
+
+def _read_exact(f: BinaryIO, n: int) -> bytes:
+    data = f.read(n)
+    if len(data) != n:
+        raise ValueError(f"Truncated COPY binary file: wanted {n} bytes, got {len(data)}")
+    return data
+
+
+def parse_copy_binary(f: BinaryIO, columns: Tuple[str, ...] = COLUMNS) -> Iterator[Dict]:
+    """
+    Parse a COPY binary file back into rows.
+
+    Yields:
+        {column: value} per row; vectors as float32 arrays, NULL as None
+    """
+    if _read_exact(f, len(BINARY_SIGNATURE)) != BINARY_SIGNATURE:
+        raise ValueError("Not a PGCOPY binary file")
+    _flags, extension = struct.unpack(">ii", _read_exact(f, 8))
+    _read_exact(f, extension)
+    while True:
+        (num_fields,) = struct.unpack(">h", _read_exact(f, 2))
+        if num_fields == -1:
+            return
+        if num_fields != len(columns):
+            raise ValueError(f"Expected {len(columns)} fields, got {num_fields}")
+        row = {}
+        for column in columns:
+            (length,) = struct.unpack(">i", _read_exact(f, 4))
+            if length == -1:
+                row[column] = None
+                continue
+            data = _read_exact(f, length)
+            if column in VECTOR_COLUMNS:
+                dim, _ = struct.unpack(">hh", data[:4])
+                if length != 4 + 4 * dim:
+                    raise ValueError(f"{column}: length {length} does not match dimension {dim}")
+                row[column] = np.frombuffer(data, dtype=">f4", offset=4).astype(np.float32)
+            else:
+                row[column] = data.decode("utf-8")
+        yield row
+
+
+def parse_copy(path: str, fmt: str = "binary") -> Iterator[Dict]:
+    """Rows of an exported file (see parse_copy_text / parse_copy_binary)."""
+    with open(path, 'rb') as f:
+        yield from (parse_copy_binary(f) if fmt == "binary" else parse_copy_text(f))
+
+
+# ============================================================================
+# EXPORT
+# ============================================================================
+
+def open_stores(paths: Dict[str, Optional[str]]) -> Dict[str, EmbeddingStore]:
+    """
+    Open the embedding store of each vector column, checking the schema dimension.
+
+    Columns with no (or a missing) store are exported as NULL.
+    """
+    stores = {}
+    for column, path in paths.items():
+        if not path:
+            continue
+        if not os.path.exists(os.path.join(path, EmbeddingStore.META_FILE)):
+            print(f"⚠️  No store at {path}, {column} will be NULL")
+            continue
+        store = EmbeddingStore(path)
+        if store.dim != VECTOR_COLUMNS[column]:
+            raise SystemExit(f"❌ {path} has {store.dim}-dim vectors, {column} is VECTOR({VECTOR_COLUMNS[column]})")
+        stores[column] = store
+    return stores
+
+
+def iter_rows(products: Iterable[Dict], stores: Dict[str, EmbeddingStore], stats: Dict,
+              chunk_size: int = 1024) -> Iterator[List]:
+    """
+    Table rows in COLUMNS order, reading each chunk's vectors with one gather per store.
+
+    Args:
+        products: Catalog products
+        stores: Vector column -> EmbeddingStore
+        stats: Updated with rows, duplicates and per-column null counts
+        chunk_size: Products per gather
+
+    Yields:
+        [product_id, dense, sparse, image, title, ...] with None for NULL
+    """
+    index = {column: store.id_to_index for column, store in stores.items()}
+    seen = set()
+    stats.setdefault("rows", 0)
+    stats.setdefault("duplicates", 0)
+    nulls = stats.setdefault("nulls", {column: 0 for column in VECTOR_COLUMNS})
+
+    for chunk in iter_chunks(products, chunk_size):
+        batch = []
+        for product in chunk:
+            product_id = str(product["product_id"])
+            if product_id in seen:
+                stats["duplicates"] += 1
+                continue
+            seen.add(product_id)
+            batch.append((product_id, product))
+
+        vectors = {}
+        for column in VECTOR_COLUMNS:
+            rows = np.array([index[column].get(pid, -1) for pid, _ in batch] if column in index else
+                            [-1] * len(batch), dtype=np.int64)
+            found = rows >= 0
+            nulls[column] += int((~found).sum())
+            gathered = np.asarray(stores[column].vectors[rows[found]], dtype=np.float32) if found.any() else None
+            column_vectors: List[Optional[np.ndarray]] = [None] * len(batch)
+            for j, i in enumerate(np.flatnonzero(found)):
+                column_vectors[i] = gathered[j]
+            vectors[column] = column_vectors
+
+        for i, (product_id, product) in enumerate(batch):
+            yield ([product_id] + [vectors[column][i] for column in VECTOR_COLUMNS]
+                   + [product.get(column) for column in TEXT_COLUMNS])
+            stats["rows"] += 1
+
+
+def export_copy(products: Iterable[Dict], stores: Dict[str, EmbeddingStore], output_path: str,
+                fmt: str = "binary") -> Dict:
+    """
+    Write the product table as a COPY file.
+
+    Args:
+        products: Catalog products (streamed)
+        stores: Vector column -> EmbeddingStore
+        output_path: COPY file to write
+        fmt: "text" or "binary"
+
+    Returns:
+        Stats: rows, duplicates, nulls per vector column, bytes, seconds
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {FORMATS}")
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    stats: Dict = {}
+    start = time.perf_counter()
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, 'wb', buffering=1 << 20) as f:
+        writer = CopyBinaryWriter(f) if fmt == "binary" else CopyTextWriter(f)
+        writer.write_header()
+        for row in iter_rows(products, stores, stats):
+            writer.write_row(row)
+        writer.write_trailer()
+    os.replace(tmp_path, output_path)
+    stats["bytes"] = os.path.getsize(output_path)
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+
+def verify_copy(path: str, fmt: str, products_path: str, stores: Dict[str, EmbeddingStore]) -> int:
+    """
+    Parse an exported file and compare every row with the catalog and stores.
+
+    Returns:
+        Rows checked
+
+    Raises:
+        ValueError: on the first mismatch
+    """
+    products = {}
+    for product in iter_products(products_path):
+        products.setdefault(str(product["product_id"]), product)
+    index = {column: store.id_to_index for column, store in stores.items()}
+    checked = 0
+    for row in parse_copy(path, fmt):
+        product_id = row["product_id"]
+        product = products.get(product_id)
+        if product is None:
+            raise ValueError(f"{product_id}: not in the catalog")
+        for column in TEXT_COLUMNS:
+            if row[column] != product.get(column):
+                raise ValueError(f"{product_id}: {column} differs")
+        for column in VECTOR_COLUMNS:
+            i = index.get(column, {}).get(product_id)
+            expected = None if i is None else np.asarray(stores[column].vectors[i], dtype=np.float32)
+            if (row[column] is None) != (expected is None) or (
+                    expected is not None and not np.array_equal(row[column], expected)):
+                raise ValueError(f"{product_id}: {column} differs")
+        checked += 1
+    return checked
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the product table as a pgvector COPY file')
+    parser.add_argument('--products', default=PRODUCTS_PATH,
+                        help=f'Products file, JSON array or JSONL (default: {PRODUCTS_PATH})')
+    for column, path in DEFAULT_STORES.items():
+        channel = column.split("_")[0]
+        parser.add_argument(f'--{channel}', default=path,
+                            help=f'EmbeddingStore for {column}, "" for NULL (default: {path})')
+    parser.add_argument('--output', '-o', default=None,
+                        help='COPY file (default: output/product.copy, or .tsv for --format text)')
+    parser.add_argument('--format', choices=FORMATS, default='binary', help='COPY format (default: binary)')
+    parser.add_argument('--table', default='product', help='Table name for the printed COPY command (default: product)')
+    parser.add_argument('--verify', action='store_true', help='Parse the file back and compare every row')
+    args = parser.parse_args()
+
+    output = args.output or ("output/product.copy" if args.format == "binary" else "output/product.tsv")
+    stores = open_stores({column: getattr(args, column.split("_")[0]) for column in VECTOR_COLUMNS})
+    for column, store in stores.items():
+        print(f"✅ {column}: {store.count:,} x {store.dim} from {store.path}")
+
+    stats = export_copy(iter_products(args.products), stores, output, args.format)
+    seconds = max(stats["seconds"], 1e-9)
+    nulls = ", ".join(f"{column} {count:,}" for column, count in stats["nulls"].items())
+    print(f"\n📊 {stats['rows']:,} rows, {stats['bytes'] / 2**20:,.1f} MB in {seconds:.1f}s "
+          f"({stats['rows'] / seconds:,.0f} rows/sec), {stats['duplicates']:,} duplicate ids skipped")
+    print(f"   NULL vectors: {nulls}")
+
+    if args.verify:
+        start = time.perf_counter()
+        checked = verify_copy(output, args.format, args.products, stores)
+        print(f"✅ Verified {checked:,} rows round-trip in {time.perf_counter() - start:.1f}s")
+
+    print(f"\n✅ Saved {output}; load with:")
+    print(f"   psql \"$DATABASE_URL\" -c \"\\copy {args.table} ({', '.join(COLUMNS)}) "
+          f"FROM '{output}' WITH (FORMAT {args.format})\"")
+
+
+if __name__ == "__main__":
+    main()
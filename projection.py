@@ -0,0 +1,286 @@
+"""
+Fit-once linear projection (PCA) of catalog embeddings to fewer dimensions.
+
+A Projection is learned on the L2-normalized vectors of an EmbeddingStore and
+applied the same way to queries and products:
+
+    projected = normalize(x) @ components.T
+
+The components are the top eigenvectors of the uncentered second moment
+(a truncated SVD): centering on the catalog mean would add a per-product
+offset to every query-product dot product and reorder results, while the
+uncentered projection is exact at full dimension and degrades smoothly
+below it, so cosine / dot-product search keeps working on the shorter
+vectors. Each
+projection is saved as one .npz next to the model it was fitted for
+(<model_dir>/projection/<name>-<dim>.npz by default) together with the
+fingerprint of that model (embedding_cache.model_fingerprint); loading it
+against different weights raises instead of silently mixing spaces.
+
+Usage:
+    python projection.py --store output/embeddings/dense --dims 256 128 64
+    python projection.py --store output/embeddings/image --query-model clip-ViT-B-32 --name image
+    python projection.py --store output/embeddings/dense --dims 128 --write-stores
+
+    from projection import Projection
+    model = GrocerySearchModel(projection_path="output/heb-semantic-search/projection/dense-128.npz")
+    model.encode_query("organic soup")              # (128,)
+"""
+
+import argparse
+import json
+import os
+import time
+import numpy as np
+from typing import Dict, Optional
+from catalog import QUERIES_PATH
+from embedding_store import EmbeddingStore
+from pair_scoring import normalize_rows
+from quantized_search import load_query_vectors, recall_at_k
+from vector_search import top_k
+
+PROJECTION_VERSION = 1
+PROJECTION_SUBDIR = "projection"
+FALLBACK_DIR = "output/projections"
+
+
+class Projection:
+    """Orthonormal linear projection from input_dim to output_dim."""
+
+    def __init__(self, components: np.ndarray, explained_variance: np.ndarray,
+                 meta: Optional[Dict] = None):
+        """
+        Args:
+            components: (output_dim, input_dim) orthonormal projection rows
+            explained_variance: (output_dim,) mean squared projection on each component
+            meta: Version / provenance fields saved with the projection
+        """
+        self.components = np.asarray(components, dtype=np.float32)
+        self.explained_variance = np.asarray(explained_variance, dtype=np.float32)
+        self.meta = dict(meta or {})
+
+    @property
+    def input_dim(self) -> int:
+        return self.components.shape[1]
+
+    @property
+    def output_dim(self) -> int:
+        return self.components.shape[0]
+
+    @classmethod
+    def fit(cls, store: EmbeddingStore, output_dim: int, max_rows: int = 200000,
+            chunk_size: int = 65536, seed: int = 42, meta: Optional[Dict] = None) -> "Projection":
+        """
+        Uncentered PCA of a store's normalized vectors.
+
+        The second-moment matrix is accumulated chunk by chunk (float64), so the store is
+        never loaded whole; stores larger than max_rows are subsampled.
+
+        Args:
+            store: EmbeddingStore to fit on
+            output_dim: Number of components to keep
+            max_rows: Row sample cap
+            chunk_size: Rows read per chunk
+            seed: Sampling seed
+            meta: Extra provenance fields (model_path, model_fingerprint, ...)
+
+        Returns:
+            Projection keeping the output_dim highest-variance directions
+        """
+        if not 0 < output_dim <= store.dim:
+            raise ValueError(f"output_dim must be in 1..{store.dim}, got {output_dim}")
+        rows = np.arange(store.count)
+        if store.count > max_rows:
+            rows = np.sort(np.random.default_rng(seed).choice(store.count, max_rows, replace=False))
+
+        gram = np.zeros((store.dim, store.dim), dtype=np.float64)
+        for start in range(0, len(rows), chunk_size):
+            chunk = normalize_rows(np.asarray(store.vectors[rows[start:start + chunk_size]], dtype=np.float32))
+            chunk = chunk.astype(np.float64)
+            gram += chunk.T @ chunk
+
+        eigvals, eigvecs = np.linalg.eigh(gram / max(len(rows), 1))
+        order = np.argsort(eigvals)[::-1]
+        eigvals, eigvecs = np.clip(eigvals[order], 0, None), eigvecs[:, order]
+
+        meta = {
+            "version": PROJECTION_VERSION,
+            "method": "uncentered-pca",
+            "fit_rows": int(len(rows)),
+            "total_variance": float(eigvals.sum()),
+            "explained_variance_ratio": float(eigvals[:output_dim].sum() / max(eigvals.sum(), 1e-12)),
+            "model_path": store.meta.get("model_path"),
+            **(meta or {})
+        }
+        return cls(eigvecs[:, :output_dim].T, eigvals[:output_dim], meta)
+
+    def truncate(self, output_dim: int) -> "Projection":
+        """The same projection keeping only the first output_dim components."""
+        meta = dict(self.meta)
+        if "total_variance" in meta:
+            meta["explained_variance_ratio"] = float(
+                self.explained_variance[:output_dim].sum() / max(meta["total_variance"], 1e-12))
+        return Projection(self.components[:output_dim], self.explained_variance[:output_dim], meta)
+
+    def transform(self, embeddings: np.ndarray, normalize: bool = False) -> np.ndarray:
+        """
+        Project embeddings (single vector or batch).
+
+        Args:
+            embeddings: (input_dim,) or (n, input_dim) raw embeddings
+            normalize: L2-normalize the projected vectors
+
+        Returns:
+            float32 array of shape (output_dim,) or (n, output_dim)
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        single = embeddings.ndim == 1
+        projected = normalize_rows(np.atleast_2d(embeddings)) @ self.components.T
+        if normalize:
+            projected = normalize_rows(projected)
+        return projected[0] if single else projected
+
+    def check(self, fingerprint: Optional[str]):
+        """Raise if the projection was fitted for different model weights."""
+        expected = self.meta.get("model_fingerprint")
+        if expected and fingerprint and expected != fingerprint:
+            raise ValueError(f"Projection was fitted for model {expected}, not {fingerprint}; "
+                             f"refit it with projection.py")
+
+    def save(self, path: str):
+        """Write the projection as a single .npz (arrays plus JSON meta)."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        meta = {**self.meta, "input_dim": self.input_dim, "output_dim": self.output_dim}
+        np.savez(path, components=self.components,
+                 explained_variance=self.explained_variance,
+                 meta=np.array(json.dumps(meta)))
+
+    @classmethod
+    def load(cls, path: str) -> "Projection":
+        """Load a projection written by save()."""
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta.get("version", 0) > PROJECTION_VERSION:
+                raise ValueError(f"{path} has projection version {meta['version']}, "
+                                 f"this code reads up to {PROJECTION_VERSION}")
+            return cls(data["components"], data["explained_variance"], meta)
+
+
+def default_projection_path(model_path: Optional[str], name: str, output_dim: int) -> str:
+    """<model_dir>/projection/<name>-<dim>.npz, or output/projections/ for hub models."""
+    if model_path and os.path.isdir(model_path):
+        return os.path.join(model_path, PROJECTION_SUBDIR, f"{name}-{output_dim}.npz")
+    return os.path.join(FALLBACK_DIR, f"{name}-{output_dim}.npz")
+
+
+def project_store(store: EmbeddingStore, projection_path: str, output_path: str,
+                  chunk_size: int = 65536) -> EmbeddingStore:
+    """
+    Write the projected (normalized) vectors of a store into a new store.
+
+    The new store records projection_path in its meta, like stores written by
+    GrocerySearchModel(projection_path=...), so batch_retrieval and
+    quantized_search encode queries into the same space.
+
+    Args:
+        store: Unprojected source store
+        projection_path: Saved projection (.npz) to apply
+        output_path: New EmbeddingStore directory
+        chunk_size: Rows projected per chunk
+    """
+    if store.meta.get("projection_path"):
+        raise ValueError(f"Store {store.path} is already projected with {store.meta['projection_path']}")
+    projection = Projection.load(projection_path)
+    out = EmbeddingStore.create(
+        output_path, dim=projection.output_dim, ids=store.ids,
+        meta={**store.meta, "projection_path": projection_path, "normalized": True, "complete": False}
+    )
+    for start in range(0, store.count, chunk_size):
+        out.write_rows(start, projection.transform(store.vectors[start:start + chunk_size], normalize=True))
+    out.update_meta(complete=True)
+    out.close()
+    return EmbeddingStore(output_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit PCA projections of catalog embeddings and report recall vs dimension')
+    parser.add_argument('--store', required=True, help='Float EmbeddingStore directory to fit on')
+    parser.add_argument('--dims', type=int, nargs='+', default=[256, 128, 64],
+                        help='Output dimensions to fit and evaluate (default: 256 128 64)')
+    parser.add_argument('--name', default=None,
+                        help='Projection name, e.g. dense / image / sparse (default: store directory name)')
+    parser.add_argument('--query-model',
+                        help='Encode --queries with this model (default: the store\'s model_path, '
+                             'or sampled catalog vectors if the store has none)')
+    parser.add_argument('--queries', default=QUERIES_PATH,
+                        help=f'Query file for --query-model (default: {QUERIES_PATH})')
+    parser.add_argument('--sample-queries', type=int, default=500,
+                        help='Catalog vectors used as queries without a query model (default: 500)')
+    parser.add_argument('--k', type=int, nargs='+', default=[10, 30],
+                        help='Recall cutoffs (default: 10 30)')
+    parser.add_argument('--max-rows', type=int, default=200000,
+                        help='Rows sampled for fitting (default: 200000)')
+    parser.add_argument('--output-dir', default=None,
+                        help='Where to save projections (default: <model_dir>/projection)')
+    parser.add_argument('--write-stores', action='store_true',
+                        help='Also write <store>-pca<dim> stores with the projected catalog')
+    args = parser.parse_args()
+
+    store = EmbeddingStore(args.store)
+    if args.write_stores and store.meta.get("projection_path"):
+        raise SystemExit(f"❌ Store {args.store} is already projected ({store.meta['projection_path']}); "
+                         f"--write-stores needs an unprojected store")
+    name = args.name or os.path.basename(os.path.normpath(args.store))
+    query_model = args.query_model or store.meta.get("model_path")
+    queries, source = load_query_vectors(store, query_model, args.queries, args.sample_queries)
+    print(f"✅ Store {args.store}: {store.count:,} x {store.dim} float32; {source}")
+
+    meta = {"model_path": store.meta.get("model_path"), "name": name}
+    if query_model:
+        from sentence_transformers import SentenceTransformer
+        from embedding_cache import model_fingerprint
+        meta["model_fingerprint"] = model_fingerprint(SentenceTransformer(query_model))
+
+    start = time.perf_counter()
+    full = Projection.fit(store, max(args.dims), max_rows=args.max_rows, meta=meta)
+    print(f"✅ Fitted PCA on {full.meta['fit_rows']:,} rows in {time.perf_counter() - start:.1f}s")
+
+    catalog = normalize_rows(np.asarray(store.vectors, dtype=np.float32))
+    queries = np.asarray(queries, dtype=np.float32)
+    max_k = max(args.k)
+    exact_rows, _ = top_k(normalize_rows(queries), catalog, max_k)
+
+    print(f"\n{'=' * 80}")
+    print("📊 RETRIEVAL QUALITY vs OUTPUT DIMENSION")
+    print('=' * 80)
+    header = f"{'Dim':>6}{'Variance':>10}{'Memory':>12}{'ms/query':>10}" + \
+             "".join(f"{'R@' + str(k):>8}" for k in args.k) + "  Saved"
+    print(header)
+    print('-' * len(header))
+    print(f"{store.dim:>6}{1.0:>10.3f}{catalog.nbytes / 2**20:>10.1f}MB{'-':>10}" +
+          "".join(f"{1.0:>8.3f}" for _ in args.k) + "  -")
+
+    for dim in sorted(args.dims, reverse=True):
+        projection = full.truncate(dim)
+        path = default_projection_path(store.meta.get("model_path"), name, dim)
+        if args.output_dir:
+            path = os.path.join(args.output_dir, f"{name}-{dim}.npz")
+        projection.save(path)
+
+        projected = projection.transform(catalog, normalize=True)
+        start = time.perf_counter()
+        rows, _ = top_k(projection.transform(queries, normalize=True), projected, max_k)
+        seconds = time.perf_counter() - start
+        recalls = [recall_at_k(rows, exact_rows, k) for k in args.k]
+        print(f"{dim:>6}{projection.meta['explained_variance_ratio']:>10.3f}"
+              f"{projected.nbytes / 2**20:>10.1f}MB{seconds * 1000 / len(queries):>10.2f}" +
+              "".join(f"{r:>8.3f}" for r in recalls) + f"  {path}")
+
+        if args.write_stores:
+            project_store(store, path, f"{os.path.normpath(args.store)}-pca{dim}")
+
+    print("\nRecall is measured against exact full-dimension cosine top-k.")
+
+
+if __name__ == "__main__":
+    main()
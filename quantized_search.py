@@ -0,0 +1,320 @@
+"""
+Quantized copies of catalog embeddings with exact float rescoring.
+
+Builds int8 or binary (sign-bit) copies of an EmbeddingStore (dense
+GrocerySearchModel vectors, CLIP image vectors, hashed sparse vectors, ...)
+and searches them in two stages:
+
+1. Candidate scan over the quantized copy
+   - int8:   rows are L2-normalized and scaled per row to [-127, 127]; queries
+             likewise, and candidates are ranked by the integer dot product
+             times the row scale (int8 x int8 sums are exact in float32 BLAS
+             up to ~1000 dims)
+   - binary: rows are centered on the catalog mean and reduced to sign bits
+             (packed 8 per byte); candidates are ranked by Hamming distance
+2. Rescoring: the top `rescore` candidates per query are re-ranked by exact
+   cosine against the float vectors, read from the memory-mapped store
+
+Quantized copies are saved next to the store (int8.npy / int8_scale.npy,
+binary.npy / binary_center.npy) and memory-mapped on load. A fingerprint of
+the source vectors (file size and mtime, model and projection from the store
+meta) is saved with them (<mode>_source.json); open() rebuilds the copy when
+the store no longer matches it.
+
+Usage:
+    python quantized_search.py --store output/embeddings/dense
+    python quantized_search.py --store output/embeddings/image --query-model clip-ViT-B-32 --k 10 30
+
+    from quantized_search import QuantizedIndex
+    index = QuantizedIndex.open("output/embeddings/dense", mode="int8")
+    rows, scores = index.search(query_embeddings, k=30, rescore=120)
+"""
+
+import argparse
+import json
+import time
+import numpy as np
+from pathlib import Path
+from typing import Optional, Tuple
+from catalog import QUERIES_PATH
+from embedding_store import EmbeddingStore
+from pair_scoring import normalize_rows
+from vector_search import top_k, top_k_blocks
+
+MODES = ("int8", "binary")
+
+if hasattr(np, "bitwise_count"):
+    _popcount = np.bitwise_count
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(x: np.ndarray) -> np.ndarray:
+        return _POPCOUNT_TABLE[x]
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Per-row symmetric int8 quantization of L2-normalized rows -> (codes, scales)."""
+    vectors = normalize_rows(np.asarray(vectors, dtype=np.float32))
+    scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+    codes = np.round(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def quantize_binary(vectors: np.ndarray, center: np.ndarray) -> np.ndarray:
+    """Sign bits of centered, L2-normalized rows, packed 8 per byte."""
+    vectors = normalize_rows(np.asarray(vectors, dtype=np.float32)) - center
+    return np.packbits(vectors > 0, axis=1)
+
+
+class QuantizedIndex:
+    """int8 or binary copy of an EmbeddingStore, rescored against its float vectors."""
+
+    def __init__(self, store: EmbeddingStore, mode: str, codes: np.ndarray, aux: np.ndarray):
+        """
+        Use QuantizedIndex.open() / build() instead of calling this directly.
+
+        Args:
+            store: Float EmbeddingStore (memory-mapped, used for rescoring)
+            mode: "int8" or "binary"
+            codes: int8 rows or packed sign bits
+            aux: Per-row scales (int8) or the catalog mean (binary)
+        """
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}, got {mode!r}")
+        self.store = store
+        self.mode = mode
+        self.codes = codes
+        self.aux = aux
+
+    @staticmethod
+    def _paths(store_path: str, mode: str) -> Tuple[Path, Path]:
+        base = Path(store_path)
+        return base / f"{mode}.npy", base / (f"{mode}_scale.npy" if mode == "int8" else f"{mode}_center.npy")
+
+    @staticmethod
+    def _source_path(store_path: str, mode: str) -> Path:
+        return Path(store_path) / f"{mode}_source.json"
+
+    @staticmethod
+    def source_fingerprint(store: EmbeddingStore) -> dict:
+        """What the quantized copy was built from; any change means the codes are stale."""
+        stat = (store.path / EmbeddingStore.VECTORS_FILE).stat()
+        return {
+            "vectors_size": stat.st_size,
+            "vectors_mtime_ns": stat.st_mtime_ns,
+            "count": store.count,
+            "dim": store.dim,
+            "model_path": store.meta.get("model_path"),
+            "projection_path": store.meta.get("projection_path"),
+        }
+
+    @classmethod
+    def build(cls, store_path: str, mode: str, chunk_size: int = 65536) -> "QuantizedIndex":
+        """Quantize a store chunk by chunk and save the copy next to it."""
+        store = EmbeddingStore(store_path)
+        vectors = store.vectors
+        codes_path, aux_path = cls._paths(store_path, mode)
+
+        if mode == "int8":
+            codes = np.lib.format.open_memmap(codes_path, mode="w+", dtype=np.int8,
+                                              shape=(store.count, store.dim))
+            aux = np.empty(store.count, dtype=np.float32)
+            for start in range(0, store.count, chunk_size):
+                codes[start:start + chunk_size], aux[start:start + chunk_size] = \
+                    quantize_int8(vectors[start:start + chunk_size])
+        elif mode == "binary":
+            aux = np.zeros(store.dim, dtype=np.float64)
+            for start in range(0, store.count, chunk_size):
+                aux += normalize_rows(np.asarray(vectors[start:start + chunk_size], dtype=np.float32)).sum(axis=0)
+            aux = (aux / max(store.count, 1)).astype(np.float32)
+            codes = np.lib.format.open_memmap(codes_path, mode="w+", dtype=np.uint8,
+                                              shape=(store.count, (store.dim + 7) // 8))
+            for start in range(0, store.count, chunk_size):
+                codes[start:start + chunk_size] = quantize_binary(vectors[start:start + chunk_size], aux)
+        else:
+            raise ValueError(f"mode must be one of {MODES}, got {mode!r}")
+
+        codes.flush()
+        np.save(aux_path, aux)
+        # Written last: a copy without it (e.g. an interrupted build) is never trusted
+        with open(cls._source_path(store_path, mode), "w") as f:
+            json.dump(cls.source_fingerprint(store), f, indent=2)
+        return cls(store, mode, np.load(codes_path, mmap_mode="r"), aux)
+
+    @classmethod
+    def open(cls, store_path: str, mode: str = "int8", rebuild: bool = False) -> "QuantizedIndex":
+        """Load the quantized copy of a store, building it if missing or stale."""
+        codes_path, aux_path = cls._paths(store_path, mode)
+        source_path = cls._source_path(store_path, mode)
+        store = EmbeddingStore(store_path)
+        if not rebuild and codes_path.exists() and aux_path.exists() and source_path.exists():
+            with open(source_path) as f:
+                source = json.load(f)
+            if source == cls.source_fingerprint(store):
+                return cls(store, mode, np.load(codes_path, mmap_mode="r"), np.load(aux_path))
+        return cls.build(store_path, mode)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def memory_bytes(self) -> int:
+        """Bytes of the quantized copy (codes plus scales / center)."""
+        return int(self.codes.nbytes + self.aux.nbytes)
+
+    def float_bytes(self) -> int:
+        """Bytes of the float32 vectors the copy replaces."""
+        return int(self.store.count * self.store.dim * 4)
+
+    def candidates(self, queries: np.ndarray, k: int,
+                   query_chunk: int = 256, product_chunk: int = 16384) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k rows by the quantized score only."""
+        if self.mode == "int8":
+            q_codes, _ = quantize_int8(queries)
+            q_codes = q_codes.astype(np.float32)
+
+            def score_block(q: np.ndarray, start: int, end: int) -> np.ndarray:
+                block = np.asarray(self.codes[start:end], dtype=np.float32)
+                return (q @ block.T) * self.aux[start:end]
+
+            return top_k_blocks(q_codes, len(self), k, score_block, query_chunk, product_chunk)
+
+        q_bits = quantize_binary(queries, self.aux)
+
+        def hamming_block(q: np.ndarray, start: int, end: int) -> np.ndarray:
+            block = np.asarray(self.codes[start:end])
+            distance = _popcount(q[:, None, :] ^ block[None, :, :]).sum(axis=2, dtype=np.int32)
+            return -distance
+
+        # XOR blocks are (queries x rows x bytes); keep them small
+        return top_k_blocks(q_bits, len(self), k, hamming_block,
+                            query_chunk=min(query_chunk, 64), product_chunk=min(product_chunk, 4096))
+
+    def search(self, queries: np.ndarray, k: int = 30, rescore: int = 120) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Quantized candidate scan, then exact cosine rescoring.
+
+        Args:
+            queries: (n, dim) float query embeddings
+            k: Results per query
+            rescore: Candidates per query rescored with float vectors (0 = no rescoring)
+
+        Returns:
+            (rows, scores), each (n, k), best first
+        """
+        queries = normalize_rows(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        if rescore <= 0:
+            return self.candidates(queries, k)
+
+        rows, _ = self.candidates(queries, max(k, rescore))
+        # Read only the candidate rows from the memory-mapped float store
+        unique_rows, inverse = np.unique(rows, return_inverse=True)
+        exact = normalize_rows(np.asarray(self.store.vectors[unique_rows], dtype=np.float32))
+        cand = exact[inverse.reshape(rows.shape)]
+        scores = np.einsum("qd,qcd->qc", queries, cand)
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(rows, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+
+def recall_at_k(approx: np.ndarray, exact: np.ndarray, k: int) -> float:
+    """Mean fraction of the exact top k found in the approximate top k."""
+    hits = [len(np.intersect1d(a[:k], e[:k], assume_unique=True)) for a, e in zip(approx, exact)]
+    return float(np.mean(hits)) / k if hits else 0.0
+
+
+def load_query_vectors(store: EmbeddingStore, query_model: Optional[str] = None, queries_path: str = QUERIES_PATH,
+                       sample: int = 500) -> Tuple[np.ndarray, str]:
+    """
+    Query embeddings for recall reports against a store.
+
+    If the store was written with a projection (meta projection_path), the
+    encoded queries are projected the same way, so they match its rows.
+
+    Args:
+        store: Catalog store the queries will be searched against
+        query_model: Model that encodes queries_path; None to sample catalog rows instead
+        queries_path: Query file (JSON array or JSONL with a "query" field)
+        sample: Catalog rows used as queries without a query model
+
+    Returns:
+        (query vectors, description of where they came from)
+    """
+    if query_model:
+        from sentence_transformers import SentenceTransformer
+        from ranking_metrics import load_records
+        texts = [r["query"] for r in load_records(queries_path)]
+        model = SentenceTransformer(query_model)
+        vectors = model.encode(texts, convert_to_numpy=True)
+        projection_path = store.meta.get("projection_path")
+        if not projection_path:
+            return vectors, f"{len(texts):,} queries from {queries_path} ({query_model})"
+        from embedding_cache import model_fingerprint
+        from projection import Projection
+        projection = Projection.load(projection_path)
+        projection.check(model_fingerprint(model))
+        vectors = projection.transform(vectors, normalize=True)
+        return vectors, f"{len(texts):,} queries from {queries_path} ({query_model}, {projection_path})"
+    rng = np.random.default_rng(42)
+    rows = np.sort(rng.choice(store.count, min(sample, store.count), replace=False))
+    return np.asarray(store.vectors[rows]), f"{len(rows):,} catalog vectors as queries"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recall and memory of int8 / binary quantized catalog search')
+    parser.add_argument('--store', required=True, help='Float EmbeddingStore directory')
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=MODES,
+                        help='Quantization modes to evaluate (default: int8 binary)')
+    parser.add_argument('--query-model',
+                        help='Encode --queries with this model (default: the store\'s model_path, '
+                             'or sampled catalog vectors if the store has none)')
+    parser.add_argument('--queries', default=QUERIES_PATH,
+                        help=f'Query file for --query-model (default: {QUERIES_PATH})')
+    parser.add_argument('--sample-queries', type=int, default=500,
+                        help='Catalog vectors used as queries without a query model (default: 500)')
+    parser.add_argument('--k', type=int, nargs='+', default=[10, 30],
+                        help='Recall cutoffs (default: 10 30)')
+    parser.add_argument('--rescore', type=int, nargs='+', default=[0, 60, 120, 300],
+                        help='Candidates rescored with float vectors (default: 0 60 120 300)')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the quantized copies')
+    args = parser.parse_args()
+
+    store = EmbeddingStore(args.store)
+    query_model = args.query_model or store.meta.get("model_path")
+    queries, source = load_query_vectors(store, query_model, args.queries, args.sample_queries)
+    print(f"✅ Store {args.store}: {store.count:,} x {store.dim} float32; {source}")
+
+    max_k = max(args.k)
+    start = time.perf_counter()
+    exact_rows, _ = top_k(normalize_rows(np.asarray(queries, dtype=np.float32)),
+                          normalize_rows(np.asarray(store.vectors, dtype=np.float32)), max_k)
+    exact_seconds = time.perf_counter() - start
+    float_bytes = store.count * store.dim * 4
+
+    print(f"\n{'=' * 80}")
+    print("📊 QUANTIZED SEARCH vs FULL PRECISION")
+    print('=' * 80)
+    header = f"{'Mode':<8}{'Rescore':>9}{'Memory':>12}{'Ratio':>8}{'ms/query':>10}" + \
+             "".join(f"{'R@' + str(k):>8}" for k in args.k)
+    print(header)
+    print('-' * len(header))
+    print(f"{'float32':<8}{'-':>9}{float_bytes / 2**20:>10.1f}MB{1.0:>8.1f}"
+          f"{exact_seconds * 1000 / len(queries):>10.2f}" + "".join(f"{1.0:>8.3f}" for _ in args.k))
+
+    for mode in args.modes:
+        start = time.perf_counter()
+        index = QuantizedIndex.open(args.store, mode, rebuild=args.rebuild)
+        build_seconds = time.perf_counter() - start
+        for rescore in args.rescore:
+            start = time.perf_counter()
+            rows, _ = index.search(queries, k=max_k, rescore=rescore)
+            seconds = time.perf_counter() - start
+            recalls = [recall_at_k(rows, exact_rows, k) for k in args.k]
+            print(f"{mode:<8}{rescore or '-':>9}{index.memory_bytes() / 2**20:>10.1f}MB"
+                  f"{float_bytes / index.memory_bytes():>8.1f}{seconds * 1000 / len(queries):>10.2f}"
+                  + "".join(f"{r:>8.3f}" for r in recalls))
+        print(f"   ({mode} copy ready in {build_seconds:.1f}s)")
+
+    print("\nRescoring reads only the candidate rows from the memory-mapped float store.")
+
+
+if __name__ == "__main__":
+    main()
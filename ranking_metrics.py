@@ -0,0 +1,421 @@
+"""
+Offline ranking metrics for submission files.
+
+Scores one or more submissions ({query_id, product_id, rank} records, JSON
+array or JSONL, as written by generate_responses.py) against the graded labels
+({query_id, product_id, relevance}) without submitting them:
+
+- nDCG@k  (gain 2^rel - 1, or linear gain with --linear-gain)
+- Recall@k (a product counts as relevant when relevance >= --min-relevance)
+- MRR      (reciprocal rank of the first relevant result)
+
+Submissions and labels are turned into dense per-query arrays once; every
+metric is then computed for all queries at once with numpy, so hundreds of
+thousands of queries take seconds. Labelled queries missing from a submission
+score 0; submitted queries without labels are ignored (and counted).
+
+Usage:
+    python ranking_metrics.py submission.json
+    python ranking_metrics.py run_a.json run_b.jsonl --labels data/labels_synth_train.json
+    python ranking_metrics.py submission.json --per-query per_query.csv --json metrics.json
+
+    from ranking_metrics import Labels, evaluate_submission
+    labels = Labels.load("data/labels_synth_train.json")
+    result = evaluate_submission(labels, "submission.json", ks=(10, 30))
+    print(result.summary())
+"""
+
+import argparse
+import csv
+import json
+import time
+import numpy as np
+from typing import Dict, Iterable, List, Sequence, Tuple
+from catalog import LABELS_PATH, iter_jsonl
+
+DEFAULT_KS = (10, 30)
+
+
+def load_records(path: str) -> List[Dict]:
+    """Load a JSON array or JSONL file of records."""
+    with open(path, 'r') as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            return list(iter_jsonl(f))
+        head = f.read(1)
+        while head and head.isspace():
+            head = f.read(1)
+        f.seek(0)
+        if head == "[":
+            return json.load(f)
+        return list(iter_jsonl(f))
+
+
+class Labels:
+    """
+    Graded labels as sorted integer keys.
+
+    Attributes:
+        query_ids: Labelled query ids (row order of all per-query arrays)
+        query_index: query id -> row
+        product_index: product id -> column id (labelled products only)
+        keys: Sorted int64 key query_row * num_products + product_col
+        relevance: Relevance of each key
+    """
+
+    def __init__(self, query: np.ndarray, product: np.ndarray, relevance: np.ndarray,
+                 query_ids: List[str], product_ids: List[str]):
+        self.query_ids = query_ids
+        self.query_index = {qid: i for i, qid in enumerate(query_ids)}
+        self.product_index = {pid: i for i, pid in enumerate(product_ids)}
+        self.num_products = len(product_ids)
+
+        keys = query.astype(np.int64) * self.num_products + product
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.relevance = relevance[order].astype(np.int64)
+        self.query = query[order]
+        self._ideal_cache: Dict[Tuple[int, int], Tuple[np.ndarray, np.ndarray]] = {}
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict]) -> "Labels":
+        """Build from {query_id, product_id, relevance} records (last duplicate wins)."""
+        query_index: Dict[str, int] = {}
+        product_index: Dict[str, int] = {}
+        query, product, relevance = [], [], []
+        for r in records:
+            query.append(query_index.setdefault(r["query_id"], len(query_index)))
+            product.append(product_index.setdefault(r["product_id"], len(product_index)))
+            relevance.append(r["relevance"])
+
+        query = np.array(query, dtype=np.int64)
+        product = np.array(product, dtype=np.int64)
+        relevance = np.array(relevance, dtype=np.int64)
+
+        # Keep the last label of duplicated (query, product) pairs
+        keys = query * max(1, len(product_index)) + product
+        _, last = np.unique(keys[::-1], return_index=True)
+        keep = np.sort(len(keys) - 1 - last)
+        return cls(query[keep], product[keep], relevance[keep],
+                   list(query_index), list(product_index))
+
+    @classmethod
+    def load(cls, path: str = LABELS_PATH) -> "Labels":
+        """Load labels from a JSON array or JSONL file."""
+        return cls.from_records(load_records(path))
+
+    @property
+    def num_queries(self) -> int:
+        return len(self.query_ids)
+
+    def ideal_gains(self, depth: int, min_relevance: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Per-query relevance of the ideal ranking and the number of relevant products.
+
+        Args:
+            depth: Ranks to keep
+            min_relevance: Relevance at which a product counts as relevant
+
+        Returns:
+            (num_queries, depth) relevance matrix sorted descending, and
+            per-query relevant counts
+        """
+        cached = self._ideal_cache.get((depth, min_relevance))
+        if cached is not None:
+            return cached
+
+        order = np.lexsort((-self.relevance, self.query))
+        q = self.query[order]
+        rel = self.relevance[order]
+        group_start = np.searchsorted(q, q, side="left")
+        position = np.arange(len(q)) - group_start
+
+        ideal = np.zeros((self.num_queries, depth), dtype=np.int64)
+        keep = position < depth
+        ideal[q[keep], position[keep]] = rel[keep]
+        num_relevant = np.bincount(self.query[self.relevance >= min_relevance],
+                                   minlength=self.num_queries)
+        self._ideal_cache[(depth, min_relevance)] = (ideal, num_relevant)
+        return ideal, num_relevant
+
+
+class Submission:
+    """
+    A submission as a dense (num_queries, depth) matrix of graded relevance.
+
+    Row i holds the label relevance of the products ranked 1..depth for
+    labels.query_ids[i]; unranked slots and unlabelled products are 0.
+    A product repeated within a query counts only at its first rank.
+    """
+
+    def __init__(self, name: str, relevance: np.ndarray, submitted: np.ndarray,
+                 unknown_queries: int, duplicate_rows: int = 0):
+        self.name = name
+        self.relevance = relevance
+        self.submitted = submitted
+        self.unknown_queries = unknown_queries
+        self.duplicate_rows = duplicate_rows
+
+    @classmethod
+    def from_records(cls, labels: Labels, records: Sequence[Dict], depth: int,
+                     name: str = "submission") -> "Submission":
+        """
+        Args:
+            labels: Labels to grade against
+            records: {query_id, product_id, rank} records (rank is 1-based; if
+                missing, record order within a query is used)
+            depth: Ranks to keep per query
+            name: Display name
+        """
+        n = len(records)
+        query = np.fromiter((labels.query_index.get(r["query_id"], -1) for r in records),
+                            dtype=np.int64, count=n)
+        product = np.fromiter((labels.product_index.get(r["product_id"], -1) for r in records),
+                              dtype=np.int64, count=n)
+        # Code for every submitted product id, labelled or not, to find repeats
+        codes: Dict[str, int] = {}
+        product_code = np.fromiter((codes.setdefault(r["product_id"], len(codes)) for r in records),
+                                   dtype=np.int64, count=n)
+        if n and all("rank" in r for r in records):
+            rank = np.fromiter((r["rank"] for r in records), dtype=np.int64, count=n) - 1
+        else:
+            rank = cls._positions(query)
+
+        known = query >= 0
+        unknown_queries = len({records[i]["query_id"] for i in np.flatnonzero(~known).tolist()})
+        submitted = np.zeros(labels.num_queries, dtype=bool)
+        submitted[query[known]] = True
+
+        # Keep only the first rank of each (query, product)
+        valid = np.flatnonzero(known & (rank >= 0))
+        order = valid[np.lexsort((rank[valid], product_code[valid], query[valid]))]
+        repeat = np.zeros(len(order), dtype=bool)
+        repeat[1:] = (query[order[1:]] == query[order[:-1]]) & \
+                     (product_code[order[1:]] == product_code[order[:-1]])
+        duplicate_rows = int(repeat.sum())
+
+        keep = np.zeros(n, dtype=bool)
+        keep[order[~repeat]] = True
+        keep &= rank < depth
+        query, product, rank = query[keep], product[keep], rank[keep]
+
+        # Look up each (query, product) in the sorted label keys
+        relevance_at = np.zeros(len(query), dtype=np.int64)
+        labelled = product >= 0
+        if len(labels.keys) and labelled.any():
+            keys = query[labelled] * labels.num_products + product[labelled]
+            pos = np.minimum(np.searchsorted(labels.keys, keys), len(labels.keys) - 1)
+            hit = labels.keys[pos] == keys
+            relevance_at[np.flatnonzero(labelled)[hit]] = labels.relevance[pos[hit]]
+
+        relevance = np.zeros((labels.num_queries, depth), dtype=np.int64)
+        relevance[query, rank] = relevance_at
+        return cls(name, relevance, submitted, unknown_queries, duplicate_rows)
+
+    @staticmethod
+    def _positions(query: np.ndarray) -> np.ndarray:
+        """0-based position of each record among the records of its query."""
+        order = np.argsort(query, kind="stable")
+        q = query[order]
+        position = np.empty(len(q), dtype=np.int64)
+        position[order] = np.arange(len(q)) - np.searchsorted(q, q, side="left")
+        return position
+
+    @classmethod
+    def load(cls, labels: Labels, path: str, depth: int) -> "Submission":
+        """Load a submission from a JSON array or JSONL file."""
+        return cls.from_records(labels, load_records(path), depth, name=path)
+
+
+def dcg(relevance: np.ndarray, k: int, linear_gain: bool = False) -> np.ndarray:
+    """Discounted cumulative gain at k of each row of a relevance matrix."""
+    rel = relevance[:, :k]
+    gains = rel.astype(np.float64) if linear_gain else np.exp2(rel) - 1.0
+    discounts = 1.0 / np.log2(np.arange(2, rel.shape[1] + 2))
+    return gains @ discounts
+
+
+class RankingResult:
+    """Per-query metric arrays for one submission."""
+
+    def __init__(self, name: str, query_ids: List[str], per_query: Dict[str, np.ndarray],
+                 submitted: np.ndarray, unknown_queries: int, seconds: float,
+                 duplicate_rows: int = 0):
+        self.name = name
+        self.query_ids = query_ids
+        self.per_query = per_query
+        self.submitted = submitted
+        self.unknown_queries = unknown_queries
+        self.seconds = seconds
+        self.duplicate_rows = duplicate_rows
+
+    def summary(self) -> Dict[str, float]:
+        """Mean of each metric over labelled queries (recall over queries with relevant products)."""
+        out = {name: float(np.nanmean(values)) if np.isfinite(values).any() else 0.0
+               for name, values in self.per_query.items()}
+        out["queries"] = len(self.query_ids)
+        out["queries_submitted"] = int(self.submitted.sum())
+        out["unknown_queries"] = self.unknown_queries
+        out["duplicate_rows"] = self.duplicate_rows
+        return out
+
+    def write_per_query(self, path: str):
+        """Write one CSV row per labelled query with every metric."""
+        names = list(self.per_query)
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["query_id", "submitted"] + names)
+            columns = [self.per_query[n] for n in names]
+            for i, qid in enumerate(self.query_ids):
+                writer.writerow([qid, int(self.submitted[i])] + [f"{c[i]:.6f}" for c in columns])
+
+
+def compute_metrics(
+    labels: Labels,
+    submission: Submission,
+    ks: Sequence[int] = DEFAULT_KS,
+    min_relevance: int = 1,
+    linear_gain: bool = False
+) -> RankingResult:
+    """
+    Compute nDCG@k, Recall@k and MRR for every labelled query.
+
+    Args:
+        labels: Graded labels
+        submission: Submission built with depth >= max(ks)
+        ks: Cutoffs
+        min_relevance: Relevance at which a product counts as relevant
+        linear_gain: Use gain = rel instead of 2^rel - 1 for nDCG
+
+    Returns:
+        RankingResult with one array per metric
+    """
+    start = time.perf_counter()
+    depth = submission.relevance.shape[1]
+    if max(ks) > depth:
+        raise ValueError(f"Submission depth {depth} is smaller than k={max(ks)}")
+
+    ideal, num_relevant = labels.ideal_gains(depth, min_relevance)
+    is_relevant = submission.relevance >= min_relevance
+    hits = np.cumsum(is_relevant, axis=1)
+
+    per_query: Dict[str, np.ndarray] = {}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for k in ks:
+            idcg = dcg(ideal, k, linear_gain)
+            per_query[f"ndcg@{k}"] = np.where(idcg > 0, dcg(submission.relevance, k, linear_gain) / idcg, 0.0)
+        for k in ks:
+            per_query[f"recall@{k}"] = np.where(num_relevant > 0, hits[:, k - 1] / num_relevant, np.nan)
+
+    first = np.argmax(is_relevant, axis=1)
+    per_query["mrr"] = np.where(is_relevant.any(axis=1), 1.0 / (first + 1), 0.0)
+
+    return RankingResult(submission.name, labels.query_ids, per_query, submission.submitted,
+                         submission.unknown_queries, time.perf_counter() - start,
+                         submission.duplicate_rows)
+
+
+def evaluate_submission(labels: Labels, path: str, ks: Sequence[int] = DEFAULT_KS,
+                        min_relevance: int = 1, linear_gain: bool = False) -> RankingResult:
+    """Load a submission file and compute its metrics."""
+    submission = Submission.load(labels, path, depth=max(ks))
+    return compute_metrics(labels, submission, ks, min_relevance, linear_gain)
+
+
+def compare(results: List[RankingResult], metric: str) -> List[Dict]:
+    """
+    Per-query wins/ties/losses of each result against the first one.
+
+    Args:
+        results: Results on the same labels; results[0] is the reference
+        metric: Per-query metric to compare, e.g. "ndcg@10"
+
+    Returns:
+        One dict per non-reference result
+    """
+    base = np.nan_to_num(results[0].per_query[metric])
+    rows = []
+    for result in results[1:]:
+        values = np.nan_to_num(result.per_query[metric])
+        diff = values - base
+        rows.append({
+            "name": result.name,
+            "metric": metric,
+            "mean_delta": float(diff.mean()) if len(diff) else 0.0,
+            "wins": int((diff > 1e-9).sum()),
+            "ties": int((np.abs(diff) <= 1e-9).sum()),
+            "losses": int((diff < -1e-9).sum()),
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute nDCG@k / Recall@k / MRR for submission files')
+    parser.add_argument('submissions', nargs='+',
+                        help='Submission files (JSON array or JSONL of {query_id, product_id, rank})')
+    parser.add_argument('--labels', default=LABELS_PATH,
+                        help=f'Graded labels file (default: {LABELS_PATH})')
+    parser.add_argument('--k', type=int, nargs='+', default=list(DEFAULT_KS),
+                        help='Cutoffs (default: 10 30)')
+    parser.add_argument('--min-relevance', type=int, default=1,
+                        help='Relevance at which a product counts as relevant for recall/MRR (default: 1)')
+    parser.add_argument('--linear-gain', action='store_true',
+                        help='Use gain = relevance for nDCG instead of 2^relevance - 1')
+    parser.add_argument('--per-query',
+                        help='Write per-query metrics of the first submission to this CSV')
+    parser.add_argument('--json', help='Write summary metrics to this JSON file')
+    args = parser.parse_args()
+
+    print(f"Loading labels from {args.labels}...")
+    labels = Labels.load(args.labels)
+    print(f"✅ {len(labels.keys):,} labels for {labels.num_queries:,} queries")
+
+    results = []
+    for path in args.submissions:
+        start = time.perf_counter()
+        result = evaluate_submission(labels, path, args.k, args.min_relevance, args.linear_gain)
+        print(f"✅ {path}: scored in {time.perf_counter() - start:.2f}s "
+              f"(metrics {result.seconds * 1000:.0f}ms)")
+        results.append(result)
+
+    summaries = [r.summary() for r in results]
+    metric_names = list(results[0].per_query)
+    name_width = max(len('Submission'), *(len(r.name) for r in results)) + 2
+
+    print(f"\n{'=' * 80}")
+    print("📊 RANKING METRICS")
+    print('=' * 80)
+    print(f"{'Submission':<{name_width}}" + "".join(f"{m:>11}" for m in metric_names) + f"{'Queries':>10}")
+    print('-' * (name_width + 11 * len(metric_names) + 10))
+    for result, summary in zip(results, summaries):
+        print(f"{result.name:<{name_width}}" + "".join(f"{summary[m]:>11.4f}" for m in metric_names)
+              + f"{summary['queries_submitted']:>10,}")
+    for result, summary in zip(results, summaries):
+        missing = summary['queries'] - summary['queries_submitted']
+        if missing or summary['unknown_queries']:
+            print(f"⚠️  {result.name}: {missing:,} labelled queries missing, "
+                  f"{summary['unknown_queries']:,} submitted queries without labels")
+        if summary['duplicate_rows']:
+            print(f"⚠️  {result.name}: {summary['duplicate_rows']:,} repeated products ignored "
+                  f"(only the first rank of each counts)")
+
+    comparisons = []
+    if len(results) > 1:
+        metric = f"ndcg@{args.k[0]}"
+        comparisons = compare(results, metric)
+        print(f"\n📈 Per-query {metric} vs {results[0].name}:")
+        for row in comparisons:
+            print(f"  {row['name']}: {row['mean_delta']:+.4f} mean, "
+                  f"{row['wins']:,} better / {row['ties']:,} tied / {row['losses']:,} worse")
+
+    if args.per_query:
+        results[0].write_per_query(args.per_query)
+        print(f"\n✅ Per-query metrics written to {args.per_query}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"submissions": {r.name: s for r, s in zip(results, summaries)},
+                       "comparisons": comparisons}, f, indent=2)
+        print(f"✅ Summary written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
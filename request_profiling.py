@@ -0,0 +1,232 @@
+"""
+On-demand request profiling for the FastAPI model services.
+
+Off by default. When PROFILING_ENABLED=1, a request is profiled if it carries
+an "X-Profile" header, or if profiling was armed for the next N requests via
+the admin endpoint. Each profiled request writes one trace file to PROFILE_DIR:
+
+- cProfile (default): <dir>/<endpoint>-<timestamp>.prof  (open with snakeviz / pstats)
+- torch profiler:     <dir>/<endpoint>-<timestamp>.json  (open in chrome://tracing / Perfetto)
+
+When profiling is disabled, install_profiling() adds nothing to the app and
+@profiled returns the endpoint function unchanged, so there is no overhead.
+
+Usage:
+    from request_profiling import install_profiling, profiled
+
+    app = FastAPI()
+    install_profiling(app)
+
+    @app.post("/dense-embed")
+    @profiled
+    def denseEncode(req):
+        ...
+
+    # Profile one request
+    curl -H "X-Profile: cprofile" -X POST .../dense-embed -d '...'
+
+    # Profile the next 5 requests with the torch profiler
+    curl -X POST ".../admin/profile?count=5&mode=torch"
+"""
+
+import cProfile
+import functools
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException, Header
+
+logger = logging.getLogger("request_profiling")
+
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "0") == "1"
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+# Optional shared secret required by the admin endpoint
+PROFILE_ADMIN_TOKEN = os.environ.get("PROFILE_ADMIN_TOKEN", "")
+
+PROFILE_MODES = ("cprofile", "torch")
+
+# Per-request profiling state: {"mode": ..., "endpoint": ..., "output": ...};
+# mode is None until the request is picked for profiling
+_request_state: ContextVar[Optional[dict]] = ContextVar("profile_request", default=None)
+
+
+class ProfileController:
+    """Counts down how many upcoming requests should be profiled."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.remaining = 0
+        self.mode = "cprofile"
+
+    def arm(self, count: int, mode: str):
+        """Profile the next `count` requests with `mode`."""
+        with self._lock:
+            self.remaining = count
+            self.mode = mode
+
+    def take(self) -> Optional[str]:
+        """Claim one armed slot; returns the mode or None if not armed."""
+        if self.remaining <= 0:
+            return None
+        with self._lock:
+            if self.remaining <= 0:
+                return None
+            self.remaining -= 1
+            return self.mode
+
+
+controller = ProfileController()
+
+# cProfile and the torch profiler are process-wide tools; profile one request at a time
+_profile_lock = threading.Lock()
+
+
+def _mode_from_header(value: str) -> str:
+    value = value.strip().lower()
+    return value if value in PROFILE_MODES else "cprofile"
+
+
+class ProfilingMiddleware:
+    """
+    Pure ASGI middleware that marks requests for profiling.
+
+    The profiler itself runs inside @profiled, on the worker thread that
+    executes the endpoint. The trace path is returned in an
+    "X-Profile-Output" response header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Armed slots are claimed in @profiled, so only profiled routes use them up
+        mode = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-profile":
+                mode = _mode_from_header(value.decode("latin-1"))
+                break
+
+        state = {"mode": mode, "endpoint": scope.get("path", "request"), "output": None}
+        token = _request_state.set(state)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and state["output"]:
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-output", state["output"].encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_state.reset(token)
+
+
+def _output_path(endpoint: str, suffix: str) -> Path:
+    out_dir = Path(PROFILE_DIR)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    name = endpoint.strip("/").replace("/", "_") or "root"
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    return out_dir / f"{name}-{stamp}-{time.perf_counter_ns() % 1_000_000:06d}{suffix}"
+
+
+def _run_cprofile(state: dict, fn, args, kwargs):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profiler.disable()
+        path = _output_path(state["endpoint"], ".prof")
+        profiler.dump_stats(str(path))
+        state["output"] = str(path)
+        logger.info(f"Wrote cProfile trace to {path}")
+
+
+def _run_torch_profiler(state: dict, fn, args, kwargs):
+    import torch
+    from torch.profiler import ProfilerActivity, profile
+
+    activities = [ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(ProfilerActivity.CUDA)
+
+    prof = profile(activities=activities, record_shapes=True, with_stack=True)
+    prof.__enter__()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        prof.__exit__(None, None, None)
+        path = _output_path(state["endpoint"], ".json")
+        prof.export_chrome_trace(str(path))
+        state["output"] = str(path)
+        logger.info(f"Wrote torch profiler trace to {path}")
+
+
+def profiled(fn):
+    """
+    Decorate a sync endpoint so it can be profiled on demand.
+
+    Returns fn unchanged when PROFILING_ENABLED is off.
+    """
+    if not PROFILING_ENABLED:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        state = _request_state.get()
+        if state is None:
+            return fn(*args, **kwargs)
+        if state["mode"] is None:
+            state["mode"] = controller.take()
+            if state["mode"] is None:
+                return fn(*args, **kwargs)
+        with _profile_lock:
+            if state["mode"] == "torch":
+                return _run_torch_profiler(state, fn, args, kwargs)
+            return _run_cprofile(state, fn, args, kwargs)
+
+    return wrapper
+
+
+def install_profiling(app: FastAPI):
+    """
+    Add the profiling middleware and admin endpoints to an app.
+
+    Does nothing unless PROFILING_ENABLED=1.
+    """
+    if not PROFILING_ENABLED:
+        return
+
+    app.add_middleware(ProfilingMiddleware)
+    logger.info(f"Request profiling enabled, traces go to {PROFILE_DIR}")
+
+    def check_token(token: str):
+        if PROFILE_ADMIN_TOKEN and token != PROFILE_ADMIN_TOKEN:
+            raise HTTPException(status_code=403, detail="Invalid admin token")
+
+    @app.post("/admin/profile", include_in_schema=False)
+    def arm_profiling(count: int = 1, mode: str = "cprofile",
+                      x_admin_token: str = Header(default="")):
+        check_token(x_admin_token)
+        if mode not in PROFILE_MODES:
+            raise HTTPException(status_code=400, detail=f"mode must be one of {PROFILE_MODES}")
+        if count < 0:
+            raise HTTPException(status_code=400, detail="count must be >= 0")
+        controller.arm(count, mode)
+        return {"armed": count, "mode": mode, "profile_dir": PROFILE_DIR}
+
+    @app.get("/admin/profile", include_in_schema=False)
+    def profiling_status(x_admin_token: str = Header(default="")):
+        check_token(x_admin_token)
+        return {"remaining": controller.remaining, "mode": controller.mode,
+                "profile_dir": PROFILE_DIR}
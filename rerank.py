@@ -3,6 +3,9 @@ from pydantic import BaseModel
 from typing import List
 import requests
 import os
+from service_metrics import install_metrics, stage
+from request_profiling import install_profiling, profiled
+from server_startup import install_readiness
 
 # --- CONFIG ---
 HF_TOKEN = ""
@@ -11,6 +14,10 @@ HF_ENDPOINT = ""
 
 # --- APP ---
 app = FastAPI()
+install_metrics(app, service="rerank")
+install_profiling(app)
+# no local model to warm up: scoring happens at HF_ENDPOINT, so /ready is up immediately
+install_readiness(app, {})
 
 class Candidate(BaseModel):
     product: str
@@ -21,6 +28,7 @@ class RerankRequest(BaseModel):
     candidates: List[Candidate]
 
 @app.post("/rerank")
+@profiled
 def rerank(req: RerankRequest):
     headers = {"Authorization": f"Bearer {HF_TOKEN}"}
 
@@ -32,20 +40,23 @@ def rerank(req: RerankRequest):
         }
     }
 
-    response = requests.post(HF_ENDPOINT, headers=headers, json=data)
+    with stage("remote_call"):
+        response = requests.post(HF_ENDPOINT, headers=headers, json=data)
 
     if response.status_code != 200:
         return {"error": response.text}
 
-    scores = response.json()  # The HF model returns a list of scores
-
-    ranked = sorted(
-        [
-            {"id": c.product, "text": c.text, "score": s}
-            for c, s in zip(req.candidates, scores)
-        ],
-        key=lambda x: x["score"],
-        reverse=True,
-    )
+    with stage("decode"):
+        scores = response.json()  # The HF model returns a list of scores
+
+    with stage("sort"):
+        ranked = sorted(
+            [
+                {"id": c.product, "text": c.text, "score": s}
+                for c, s in zip(req.candidates, scores)
+            ],
+            key=lambda x: x["score"],
+            reverse=True,
+        )
 
     return {"results": ranked}
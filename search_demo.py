@@ -4,12 +4,15 @@ Usage:
     python search.py "hearty organic soups for dinner"
     python search.py "organic soup" --model output/heb-semantic-search
     python search.py "organic soup" --model all-MiniLM-L6-v2  # Use untrained baseline
+    python search.py --cache-threshold 0.95   # Interactive, near-duplicate queries served from cache
 """
-import json
 import numpy as np
+import torch
 from sentence_transformers import SentenceTransformer, util
 import sys
 import argparse
+from catalog import Catalog
+from semantic_cache import SemanticQueryCache
 
 # ============================================================================
 # ARGUMENT PARSING
@@ -21,43 +24,35 @@ parser.add_argument('--model', '-m',
                     help='Model name or path (default: output/heb-semantic-search). Use "all-MiniLM-L6-v2" for untrained baseline.')
 parser.add_argument('--top-k', '-k', type=int, default=10,
                     help='Number of results to return (default: 10)')
+parser.add_argument('--cache-threshold', type=float, default=None,
+                    help='Serve queries within this cosine similarity of an earlier query from '
+                         'the semantic query cache (default: off)')
 args = parser.parse_args()
 
 # ============================================================================
 # 1. LOAD MODEL AND DATA
 # ============================================================================
-def load_json(path):
-    with open(path, 'r') as f:
-        return json.load(f)
-
-def format_product(product):
-    """Combine product fields into searchable text."""
-    text_parts = [
-        product.get("title", ""),
-        product.get("description", ""),
-        f"Brand: {product.get('brand', '')}.",
-        f"Category: {product.get('category_path', '')}.",
-        f"Ingredients: {product.get('ingredients', '')}.",
-        f"Warning: {product.get('safety_warning', '')}.",
-    ]
-    return " ".join([t for t in text_parts if t])
-
 print(f"Loading model: {args.model}")
 model = SentenceTransformer(args.model)
 print(f"✓ Model loaded (embedding dim: {model.get_sentence_embedding_dimension()})")
 
 print("Loading products...")
-products = load_json("data/products.json")
+catalog = Catalog.load()
+products = catalog.products
 print(f"Loaded {len(products)} products")
 
 # ============================================================================
 # 2. PRECOMPUTE PRODUCT EMBEDDINGS (DO THIS ONCE)
 # ============================================================================
 print("\nComputing product embeddings...")
-product_texts = [format_product(p) for p in products]
+product_texts = catalog.product_texts
 product_embeddings = model.encode(product_texts, convert_to_tensor=True, show_progress_bar=True)
 print(f"Embeddings shape: {product_embeddings.shape}")
 
+cache = None
+if args.cache_threshold is not None:
+    cache = SemanticQueryCache(model.encode, threshold=args.cache_threshold)
+
 # ============================================================================
 # 3. SEARCH FUNCTION
 # ============================================================================
@@ -74,10 +69,27 @@ def search_products(query, top_k=None):
     """
     if top_k is None:
         top_k = args.top_k
-        
-    # Encode query
-    query_embedding = model.encode(query, convert_to_tensor=True)
-    
+
+    if cache is not None:
+        results, info = cache.lookup(query)
+        # A ranking cached for a smaller top_k is too short: rank again at this depth
+        if info["hit"] and len(results) >= min(top_k, len(products)):
+            print(f"⚡ Cached results of '{info['cached_query']}' (similarity {info['similarity']:.3f})")
+            return results[:top_k]
+        embedding = info.get("embedding")
+        if embedding is None:
+            embedding = model.encode(query)
+        results = rank_products(embedding, top_k)
+        cache.put(query, embedding, results)
+        return results
+
+    return rank_products(model.encode(query), top_k)
+
+def rank_products(query_embedding, top_k):
+    """Rank all products by cosine similarity to a query embedding."""
+    # Query embeddings arrive as CPU numpy arrays; move them next to the products (GPU or CPU)
+    query_embedding = torch.as_tensor(query_embedding, device=product_embeddings.device)
+
     # Calculate cosine similarity
     cos_scores = util.cos_sim(query_embedding, product_embeddings)[0]
     
@@ -133,6 +145,9 @@ if __name__ == "__main__":
             query = input("\nSearch: ").strip()
             
             if query.lower() in ['quit', 'exit', 'q']:
+                if cache is not None:
+                    stats = cache.stats()
+                    print(f"Cache: {stats['hits']}/{stats['lookups']} hits ({stats['hit_rate']:.0%})")
                 print("Goodbye!")
                 break
             
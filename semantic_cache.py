@@ -0,0 +1,347 @@
+"""
+Semantic near-duplicate query cache in front of retrieval and rerank.
+
+"organic soup", "organic soups" and "soup organic" encode to almost the same
+query embedding, so a final ranking computed for one can be served for the
+others. SemanticQueryCache keeps the normalized encode_query embeddings of
+recently answered queries in a small fixed-size matrix; a new query is
+answered from the cache when its cosine similarity to a cached query is at or
+above `threshold`:
+
+    1. exact text match (after lower-casing / whitespace cleanup), no encode needed
+    2. nearest cached embedding (one matrix-vector product) >= threshold
+    3. otherwise compute the ranking (retrieval + rerank) and cache it
+
+Staleness: entries expire after `ttl_seconds`, and every entry is tagged with
+the cache `version` at insert time; bumping the version (new catalog, new
+model, new rerank config) makes all older entries misses. Eviction is least
+recently used.
+
+Usage:
+    from semantic_cache import SemanticQueryCache
+
+    cache = SemanticQueryCache(model.encode_query, threshold=0.95, ttl_seconds=600)
+    ranking = cache.get_or_compute("organic soups", lambda query, emb: search(emb))
+    cache.stats()              # lookups, hit rate, ...
+    cache.set_version("catalog-2024-06-01")
+
+    # Replay query files and report hit rate / ranking agreement per threshold
+    python semantic_cache.py --store output/embeddings/dense --thresholds 0.9 0.95 0.98
+"""
+
+import argparse
+import random
+import re
+import threading
+import time
+import numpy as np
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from catalog import QUERIES_PATH
+
+DEFAULT_THRESHOLD = 0.95
+DEFAULT_CAPACITY = 10000
+DEFAULT_TTL_SECONDS = 600.0
+
+
+def normalize_query(query: str) -> str:
+    """Exact-match key: lower-cased, single-spaced, stripped."""
+    return re.sub(r"\s+", " ", query.lower()).strip()
+
+
+class SemanticQueryCache:
+    """
+    Fixed-capacity query embedding -> final ranking cache.
+
+    Thread-safe: lookups and inserts go through one lock; the similarity scan
+    is a single (capacity x dim) @ (dim,) product.
+    """
+
+    def __init__(
+        self,
+        encode_fn: Callable[[str], np.ndarray],
+        threshold: float = DEFAULT_THRESHOLD,
+        capacity: int = DEFAULT_CAPACITY,
+        ttl_seconds: Optional[float] = DEFAULT_TTL_SECONDS,
+        version: Any = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        Args:
+            encode_fn: query -> embedding (e.g. GrocerySearchModel.encode_query)
+            threshold: Minimum cosine similarity for a semantic hit (> 1 disables
+                semantic hits, leaving an exact-match cache)
+            capacity: Maximum cached queries
+            ttl_seconds: Entry lifetime, None for no expiry
+            version: Initial cache version (see set_version)
+            clock: Time source, seconds
+        """
+        self.encode_fn = encode_fn
+        self.threshold = threshold
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self.version = version
+        self.generation = 0
+        self.clock = clock
+        self._lock = threading.Lock()
+
+        self._embeddings: Optional[np.ndarray] = None  # (capacity, dim), allocated on first insert
+        self._valid = np.zeros(capacity, dtype=bool)
+        self._inserted = np.zeros(capacity, dtype=np.float64)
+        self._last_used = np.zeros(capacity, dtype=np.float64)
+        self._generations = np.zeros(capacity, dtype=np.int64)
+        self._queries: List[Optional[str]] = [None] * capacity
+        self._results: List[Any] = [None] * capacity
+        self._by_text: Dict[str, int] = {}
+
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Zero the lookup counters."""
+        self.lookups = 0
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.stale = 0
+        self._hit_similarity_sum = 0.0
+
+    def set_version(self, version: Any):
+        """Start a new cache version; entries inserted under older versions become stale."""
+        with self._lock:
+            if version != self.version:
+                self.version = version
+                self.generation += 1
+
+    def clear(self):
+        """Drop every entry."""
+        with self._lock:
+            self._valid[:] = False
+            self._by_text.clear()
+            self._results = [None] * self.capacity
+            self._queries = [None] * self.capacity
+
+    def __len__(self) -> int:
+        return int(self._valid.sum())
+
+    def _fresh(self, now: float) -> np.ndarray:
+        """Valid entries of the current version that have not expired; drops the rest."""
+        fresh = self._valid & (self._generations == self.generation)
+        if self.ttl_seconds is not None:
+            fresh &= (now - self._inserted) <= self.ttl_seconds
+        expired = self._valid & ~fresh
+        if expired.any():
+            self.stale += int(expired.sum())
+            for slot in np.flatnonzero(expired):
+                self._evict(slot)
+        return fresh
+
+    def _evict(self, slot: int):
+        self._valid[slot] = False
+        self._by_text.pop(self._queries[slot], None)
+        self._queries[slot] = None
+        self._results[slot] = None
+
+    def _hit(self, slot: int, now: float, similarity: float) -> Tuple[Any, Dict]:
+        self._last_used[slot] = now
+        self._hit_similarity_sum += similarity
+        return self._results[slot], {"hit": True, "similarity": similarity, "cached_query": self._queries[slot]}
+
+    def lookup(self, query: str, embedding: Optional[np.ndarray] = None) -> Tuple[Any, Dict]:
+        """
+        Find a cached ranking for a query.
+
+        Args:
+            query: Query text
+            embedding: Precomputed query embedding (encoded on demand otherwise)
+
+        Returns:
+            (result or None, info) where info has "hit", "similarity",
+            "cached_query" and, when the query was encoded, "embedding"
+        """
+        key = normalize_query(query)
+        with self._lock:
+            self.lookups += 1
+            now = self.clock()
+            fresh = self._fresh(now)
+            slot = self._by_text.get(key)
+            if slot is not None and fresh[slot]:
+                self.exact_hits += 1
+                return self._hit(slot, now, 1.0)
+
+        if embedding is None:
+            embedding = self.encode_fn(query)
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        embedding = embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+
+        with self._lock:
+            fresh = self._fresh(self.clock())
+            if self._embeddings is not None and self.threshold <= 1.0 and fresh.any():
+                slots = np.flatnonzero(fresh)
+                sims = self._embeddings[slots] @ embedding
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    self.semantic_hits += 1
+                    result, info = self._hit(int(slots[best]), self.clock(), float(sims[best]))
+                    info["embedding"] = embedding
+                    return result, info
+            self.misses += 1
+        return None, {"hit": False, "similarity": None, "cached_query": None, "embedding": embedding}
+
+    def put(self, query: str, embedding: np.ndarray, result: Any):
+        """Cache the final ranking for a query, evicting the least recently used entry if full."""
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        embedding = embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+        key = normalize_query(query)
+        with self._lock:
+            if self._embeddings is None:
+                self._embeddings = np.zeros((self.capacity, len(embedding)), dtype=np.float32)
+            now = self.clock()
+            slot = self._by_text.get(key)
+            if slot is None:
+                free = np.flatnonzero(~self._valid)
+                if len(free):
+                    slot = int(free[0])
+                else:
+                    slot = int(np.argmin(self._last_used))
+                    self._evict(slot)
+            self._embeddings[slot] = embedding
+            self._valid[slot] = True
+            self._inserted[slot] = now
+            self._last_used[slot] = now
+            self._generations[slot] = self.generation
+            self._queries[slot] = key
+            self._results[slot] = result
+            self._by_text[key] = slot
+
+    def get_or_compute(self, query: str, compute_fn: Callable[[str, np.ndarray], Any]) -> Any:
+        """
+        Cached ranking for a query, computing and caching it on a miss.
+
+        Args:
+            query: Query text
+            compute_fn: (query, normalized embedding) -> final ranking (retrieval + rerank)
+
+        Returns:
+            The cached or freshly computed ranking
+        """
+        result, info = self.lookup(query)
+        if info["hit"]:
+            return result
+        result = compute_fn(query, info["embedding"])
+        self.put(query, info["embedding"], result)
+        return result
+
+    def stats(self) -> Dict:
+        """Lookup counters, hit rates and occupancy."""
+        hits = self.exact_hits + self.semantic_hits
+        return {
+            "lookups": self.lookups,
+            "hits": hits,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "stale_evictions": self.stale,
+            "hit_rate": hits / self.lookups if self.lookups else 0.0,
+            "mean_hit_similarity": self._hit_similarity_sum / hits if hits else None,
+            "entries": len(self),
+            "capacity": self.capacity,
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+    def publish_metrics(self, registry, cache: str = "query"):
+        """Export stats() as gauges on a service_metrics.MetricsRegistry."""
+        stats = self.stats()
+        for name in ("lookups", "hits", "exact_hits", "semantic_hits", "misses", "stale_evictions", "entries"):
+            registry.set_gauge(f"semantic_cache_{name}", stats[name],
+                               f"Semantic query cache {name.replace('_', ' ')}.", cache=cache)
+        registry.set_gauge("semantic_cache_hit_rate", stats["hit_rate"],
+                           "Fraction of lookups served from the semantic query cache.", cache=cache)
+
+
+def query_variants(query: str, rng: random.Random) -> List[str]:
+    """Near-duplicate rewrites of a query: plural/singular flip, word swap, case and spacing."""
+    words = query.split()
+    variants = [query.upper(), "  " + query + " "]
+    if words:
+        last = words[-1]
+        flipped = last[:-1] if last.endswith("s") and len(last) > 3 else last + "s"
+        variants.append(" ".join(words[:-1] + [flipped]))
+    if len(words) > 1:
+        i = rng.randrange(len(words) - 1)
+        swapped = words[:i] + [words[i + 1], words[i]] + words[i + 2:]
+        variants.append(" ".join(swapped))
+    return variants
+
+
+def main():
+    from batch_retrieval import DEFAULT_STORE, load_queries
+    from model_interface_v2 import GrocerySearchModel
+    from vector_search import VectorIndex
+
+    parser = argparse.ArgumentParser(description='Replay queries through the semantic query cache and report hit rate')
+    parser.add_argument('--model', default='output/heb-semantic-search',
+                        help='Query encoder (default: output/heb-semantic-search)')
+    parser.add_argument('--store', default=DEFAULT_STORE,
+                        help=f'Catalog EmbeddingStore for retrieval (default: {DEFAULT_STORE})')
+    parser.add_argument('--queries', nargs='+', default=[QUERIES_PATH],
+                        help=f'Query files to replay (default: {QUERIES_PATH})')
+    parser.add_argument('--variants', type=int, default=2,
+                        help='Near-duplicate rewrites replayed per query (default: 2)')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.9, 0.95, 0.98, 1.01],
+                        help='Similarity thresholds to compare; > 1 means exact match only '
+                             '(default: 0.9 0.95 0.98 1.01)')
+    parser.add_argument('--capacity', type=int, default=DEFAULT_CAPACITY,
+                        help=f'Cache capacity (default: {DEFAULT_CAPACITY})')
+    parser.add_argument('--top-k', type=int, default=30, help='Ranking depth (default: 30)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    model = GrocerySearchModel(args.model)
+    index = VectorIndex.from_store(args.store)
+    _, texts = load_queries(args.queries)
+
+    rng = random.Random(args.seed)
+    stream = list(texts)
+    for text in texts:
+        stream.extend(rng.sample(query_variants(text, rng), min(args.variants, 4)))
+    rng.shuffle(stream)
+
+    # Uncached rankings (the ground truth each cached answer is compared against)
+    unique = sorted(set(stream))
+    embeddings = model.encode_query(unique, normalize=True)
+    start = time.perf_counter()
+    rows, _ = index.search(embeddings, k=args.top_k)
+    search_ms = (time.perf_counter() - start) * 1000 / len(unique)
+    truth = {text: row for text, row in zip(unique, rows)}
+    embedding_of = {text: emb for text, emb in zip(unique, embeddings)}
+    print(f"✅ Replaying {len(stream):,} lookups ({len(texts):,} queries + {args.variants} variants each) "
+          f"against {len(index):,} products")
+
+    print(f"\n{'=' * 80}")
+    print("📊 SEMANTIC QUERY CACHE")
+    print('=' * 80)
+    header = f"{'Threshold':>10}{'Hit rate':>10}{'Exact':>8}{'Semantic':>10}{'Overlap@' + str(args.top_k):>12}{'Mean sim':>10}"
+    print(header)
+    print('-' * len(header))
+    for threshold in args.thresholds:
+        cache = SemanticQueryCache(lambda q: embedding_of[q], threshold=threshold,
+                                   capacity=args.capacity, ttl_seconds=None)
+        overlaps = []
+        for text in stream:
+            result, info = cache.lookup(text, embedding_of[text])
+            if info["hit"]:
+                overlaps.append(len(np.intersect1d(result, truth[text])) / args.top_k)
+            else:
+                cache.put(text, info["embedding"], truth[text])
+        s = cache.stats()
+        label = f"{threshold:.2f}" if threshold <= 1 else "exact"
+        sim = f"{s['mean_hit_similarity']:.3f}" if s["mean_hit_similarity"] is not None else "-"
+        print(f"{label:>10}{s['hit_rate']:>10.1%}{s['exact_hits']:>8,}{s['semantic_hits']:>10,}"
+              f"{np.mean(overlaps) if overlaps else 1.0:>12.3f}{sim:>10}")
+
+    print(f"\nEach hit saves retrieval + rerank (~{search_ms:.2f} ms/query for in-process retrieval alone).")
+    print(f"Overlap@{args.top_k}: share of the uncached top {args.top_k} that the cached ranking returned.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+Multi-worker launcher for the model services with copy-on-write shared weights.
+
+`uvicorn --workers N get_embeddings:app` imports the app (and loads MiniLM and
+CLIP) once per worker. This launcher imports it once in the parent, then
+forks the workers: model weights live in pages the workers only read, so
+they stay shared copy-on-write and each extra worker costs its private
+working set instead of a full model copy.
+
+- one listening socket, created by the parent and inherited by every worker
+- worker w is pinned to its own CPU set (sched_setaffinity) and runs torch
+  with intra-op threads = size of that set, inter-op threads = 1
+- warmup (server_startup) runs in each worker after the fork, so /ready
+  reflects the worker that answers
+- the parent reports per-worker RSS / PSS / private memory (from
+  /proc/<pid>/smaps_rollup) and request throughput, and respawns workers
+  that exit, with exponential backoff while a worker keeps dying right
+  after start; after MAX_QUICK_EXITS such exits in a row the launcher
+  stops instead of fork-looping
+
+The parent must not run inference before forking (OpenMP thread pools do
+not survive fork), so the app is imported with WARMUP_DEFER=1.
+
+Usage:
+    python serve_workers.py --workers 4
+    python serve_workers.py --app get_embeddings:app --port 8001 --workers 4 --threads-per-worker 2
+"""
+
+import argparse
+import gc
+import importlib
+import logging
+import multiprocessing as mp
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict, List, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("serve_workers")
+
+# A worker that exits within QUICK_EXIT_SECONDS of being forked counts as a
+# failed start: its respawn waits RESPAWN_BACKOFF_SECONDS, doubling per failed
+# start up to RESPAWN_BACKOFF_MAX, and MAX_QUICK_EXITS in a row stop the launcher
+QUICK_EXIT_SECONDS = 30.0
+RESPAWN_BACKOFF_SECONDS = 1.0
+RESPAWN_BACKOFF_MAX = 60.0
+MAX_QUICK_EXITS = 5
+
+
+def cpu_sets(num_workers: int, threads_per_worker: int) -> List[List[int]]:
+    """Split the CPUs available to this process into one set per worker (wrapping if short)."""
+    available = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    return [[available[(w * threads_per_worker + t) % len(available)] for t in range(threads_per_worker)]
+            for w in range(num_workers)]
+
+
+def memory_usage(pid: int) -> Optional[Dict[str, float]]:
+    """
+    Memory of one process in MB from /proc/<pid>/smaps_rollup (Linux).
+
+    Returns:
+        {"rss", "pss", "shared", "private"} or None if unavailable. PSS splits
+        shared pages between the processes mapping them, so the sum of PSS
+        over all workers is their real combined footprint.
+    """
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1]) / 1024
+    except OSError:
+        return None
+    return {
+        "rss": fields.get("Rss", 0.0),
+        "pss": fields.get("Pss", 0.0),
+        "shared": fields.get("Shared_Clean", 0.0) + fields.get("Shared_Dirty", 0.0),
+        "private": fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0),
+    }
+
+
+class RequestCounter:
+    """ASGI wrapper counting finished HTTP requests into a shared per-worker slot."""
+
+    def __init__(self, app, counts, slot: int):
+        self.app = app
+        self.counts = counts
+        self.slot = slot
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if scope["type"] == "http":
+                # Single writer per slot, no lock needed
+                self.counts[self.slot] += 1
+
+
+def _worker_main(module, app, sock: socket.socket, worker: int, cpus: List[int], counts, log_level: str):
+    """Body of a forked worker: pin, size torch threads, warm up, serve."""
+    import torch
+    import uvicorn
+
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(len(cpus))
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    readiness = getattr(module, "readiness", None)
+    if readiness is not None:
+        readiness.start()
+
+    logger.info("Worker %d (pid %d) on CPUs %s, %d torch threads", worker, os.getpid(), cpus, len(cpus))
+    config = uvicorn.Config(RequestCounter(app, counts, worker), log_level=log_level, access_log=False)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Launcher:
+    """Imports the app once, forks pinned workers and supervises them."""
+
+    def __init__(self, app_path: str, host: str, port: int, num_workers: int,
+                 threads_per_worker: int, log_level: str = "warning",
+                 max_quick_exits: int = MAX_QUICK_EXITS):
+        self.app_path = app_path
+        self.host = host
+        self.port = port
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker
+        self.log_level = log_level
+        self.cpu_sets = cpu_sets(num_workers, threads_per_worker)
+        self.counts = mp.get_context("fork").RawArray("d", num_workers)
+        self.max_quick_exits = max_quick_exits
+        self.pids: Dict[int, int] = {}  # pid -> worker index
+        self.started: Dict[int, float] = {}  # worker index -> fork time
+        self.quick_exits: Dict[int, int] = {}  # worker index -> failed starts in a row
+        self.respawn_at: Dict[int, float] = {}  # worker index -> when to fork it again
+        self.stopping = False
+        self.failed = False
+
+    def load(self):
+        """Import the app in the parent (models load here, once)."""
+        os.environ["WARMUP_DEFER"] = "1"
+        os.environ.setdefault("TORCH_INTER_OP_THREADS", "1")
+        module_name, _, attr = self.app_path.partition(":")
+        start = time.perf_counter()
+        self.module = importlib.import_module(module_name)
+        self.app = getattr(self.module, attr or "app")
+        logger.info("Imported %s in %.1fs", self.app_path, time.perf_counter() - start)
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(2048)
+        self.sock.set_inheritable(True)
+
+        # Move everything allocated so far out of the collector's reach, so GC
+        # passes in the workers do not write to (and un-share) the parent's pages
+        gc.collect()
+        gc.freeze()
+
+    def spawn(self, worker: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _worker_main(self.module, self.app, self.sock, worker, self.cpu_sets[worker],
+                             self.counts, self.log_level)
+            except BaseException:
+                logger.exception("Worker %d crashed", worker)
+                code = 1
+            finally:
+                os._exit(code)
+        self.pids[pid] = worker
+        self.started[worker] = time.monotonic()
+
+    def exited(self, pid: int, status: int):
+        """Schedule the respawn of a worker that exited, or give up on it."""
+        worker = self.pids.pop(pid)
+        if self.stopping:
+            return
+        code = os.waitstatus_to_exitcode(status)  # negative: killed by that signal
+        now = time.monotonic()
+        if now - self.started[worker] < QUICK_EXIT_SECONDS:
+            self.quick_exits[worker] = self.quick_exits.get(worker, 0) + 1
+        else:
+            self.quick_exits[worker] = 0
+        failures = self.quick_exits[worker]
+        if failures >= self.max_quick_exits:
+            logger.error("Worker %d (pid %d) exited with code %d after %d failed starts in a row; stopping",
+                         worker, pid, code, failures)
+            self.failed = True
+            self.stop()
+            return
+        delay = min(RESPAWN_BACKOFF_SECONDS * 2 ** (failures - 1), RESPAWN_BACKOFF_MAX) if failures else 0.0
+        logger.warning("Worker %d (pid %d) exited with code %d, respawning in %.1fs", worker, pid, code, delay)
+        self.respawn_at[worker] = now + delay
+
+    def stop(self, *_):
+        self.stopping = True
+        self.respawn_at.clear()
+        for pid in list(self.pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def report(self, previous: List[float], seconds: float):
+        print(f"\n{'Worker':>6}{'PID':>8}{'CPUs':>10}{'RSS MB':>9}{'PSS MB':>9}{'Shared':>9}"
+              f"{'Private':>9}{'Requests':>10}{'req/s':>8}")
+        total_pss = 0.0
+        for pid, worker in sorted(self.pids.items(), key=lambda item: item[1]):
+            mem = memory_usage(pid) or {"rss": 0.0, "pss": 0.0, "shared": 0.0, "private": 0.0}
+            total_pss += mem["pss"]
+            requests = self.counts[worker]
+            rate = (requests - previous[worker]) / seconds if seconds > 0 else 0.0
+            cpus = ",".join(map(str, self.cpu_sets[worker]))
+            print(f"{worker:>6}{pid:>8}{cpus:>10}{mem['rss']:>9.0f}{mem['pss']:>9.0f}{mem['shared']:>9.0f}"
+                  f"{mem['private']:>9.0f}{requests:>10.0f}{rate:>8.1f}")
+        parent = memory_usage(os.getpid())
+        if parent:
+            total_pss += parent["pss"]
+            print(f"{'parent':>6}{os.getpid():>8}{'-':>10}{parent['rss']:>9.0f}{parent['pss']:>9.0f}"
+                  f"{parent['shared']:>9.0f}{parent['private']:>9.0f}")
+        print(f"📊 Total PSS (real footprint of parent + {len(self.pids)} workers): {total_pss:,.0f} MB")
+
+    def run(self, report_interval: float = 30.0):
+        """Fork all workers, then respawn / report until SIGINT or SIGTERM."""
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        for worker in range(self.num_workers):
+            self.spawn(worker)
+        print(f"✅ {self.num_workers} workers serving {self.app_path} on http://{self.host}:{self.port} "
+              f"({self.threads_per_worker} threads each)")
+
+        previous = [0.0] * self.num_workers
+        last_report = time.monotonic()
+        while self.pids or self.respawn_at:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0  # every worker is waiting for its respawn
+            if pid:
+                self.exited(pid, status)
+                continue
+            now = time.monotonic()
+            for worker, when in list(self.respawn_at.items()):
+                if now >= when:
+                    del self.respawn_at[worker]
+                    self.spawn(worker)
+            if report_interval and now - last_report >= report_interval and not self.stopping:
+                self.report(previous, now - last_report)
+                previous = list(self.counts)
+                last_report = now
+            time.sleep(0.2)
+        print("Workers stopped.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fork pinned model-server workers that share weights copy-on-write')
+    parser.add_argument('--app', default='get_embeddings:app', help='ASGI app as module:attr (default: get_embeddings:app)')
+    parser.add_argument('--host', default='127.0.0.1', help='Bind address (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8001, help='Port (default: 8001)')
+    parser.add_argument('--workers', type=int, default=2, help='Worker processes (default: 2)')
+    parser.add_argument('--threads-per-worker', type=int, default=None,
+                        help='CPUs (and torch threads) per worker (default: CPUs // workers)')
+    parser.add_argument('--report-interval', type=float, default=30.0,
+                        help='Seconds between memory / throughput reports, 0 to disable (default: 30)')
+    parser.add_argument('--log-level', default='warning', help='uvicorn log level (default: warning)')
+    parser.add_argument('--max-quick-exits', type=int, default=MAX_QUICK_EXITS,
+                        help=f'Stop after a worker exits within {QUICK_EXIT_SECONDS:.0f}s of starting this many '
+                             f'times in a row (default: {MAX_QUICK_EXITS})')
+    args = parser.parse_args()
+
+    if not hasattr(os, "fork"):
+        sys.exit("❌ serve_workers.py needs os.fork (Linux / macOS)")
+
+    available = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    threads = args.threads_per_worker or max(1, available // args.workers)
+    if args.workers * threads > available:
+        logger.warning("%d workers x %d threads oversubscribes %d CPUs", args.workers, threads, available)
+
+    launcher = Launcher(args.app, args.host, args.port, args.workers, threads, args.log_level,
+                        args.max_quick_exits)
+    launcher.load()
+    launcher.run(args.report_interval)
+    if launcher.failed:
+        sys.exit("❌ A worker kept failing right after start; see the log above")
+
+
+if __name__ == "__main__":
+    main()
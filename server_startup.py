@@ -0,0 +1,203 @@
+"""
+Startup tuning for the FastAPI model services: torch threads, warmup, /ready.
+
+The first requests after a model server starts pay for lazy kernel
+initialization, allocator growth and tokenizer caches. This module:
+
+- sets torch intra-op / inter-op thread counts explicitly (instead of the
+  per-process defaults, which oversubscribe CPUs when several workers run)
+- runs warmup passes over representative input lengths and logs a latency
+  profile (first call vs steady state per input)
+- adds GET /ready, which returns 503 until warmup has finished (200 after),
+  for load balancer / orchestrator readiness probes
+
+Configuration (environment):
+    TORCH_INTRA_OP_THREADS   torch.set_num_threads (default: torch default)
+    TORCH_INTER_OP_THREADS   torch.set_num_interop_threads (default: torch default)
+    WARMUP_PASSES            passes per warmup input (default: 3, 0 = ready immediately)
+    WARMUP_DEFER             1 = do not start warmup on import; the caller
+                             (e.g. a forking launcher) calls readiness.start()
+
+Usage:
+    from server_startup import configure_torch_threads, install_readiness, WARMUP_TEXTS
+
+    configure_torch_threads()          # before loading models
+    model = SentenceTransformer(...)
+
+    app = FastAPI()
+    readiness = install_readiness(app, {
+        f"dense/{label}": (lambda text=text: encode_one(model, text))
+        for label, text in WARMUP_TEXTS.items()
+    })
+"""
+
+import logging
+import os
+import statistics
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+from service_metrics import endpoint_label
+
+logger = logging.getLogger("server_startup")
+
+WARMUP_PASSES = int(os.environ.get("WARMUP_PASSES", "3"))
+WARMUP_DEFER = os.environ.get("WARMUP_DEFER", "0") == "1"
+
+_WORDS = ("organic chicken noodle soup low sodium family size gluten free whole wheat pasta "
+          "creamy peanut butter unsweetened almond milk frozen pepperoni pizza fresh atlantic "
+          "salmon fillet honey roasted turkey breast").split()
+
+# Representative inputs from one-word queries up to product texts at the
+# 256-token truncation limit, so every sequence-length kernel path is hit
+WARMUP_TEXTS = {
+    "short": "milk",
+    "query": "organic chicken noodle soup",
+    "long_query": " ".join(_WORDS[:20]),
+    "product": " ".join((_WORDS * 6)[:120]),
+    "max_length": " ".join((_WORDS * 12)[:300]),
+}
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.environ.get(name, "")
+    return int(value) if value else None
+
+
+def configure_torch_threads(intra_op: Optional[int] = None, inter_op: Optional[int] = None) -> Dict[str, int]:
+    """
+    Set torch thread counts explicitly.
+
+    Call before any model work: the inter-op pool can only be sized before
+    it is first used (later calls are logged and ignored).
+
+    Args:
+        intra_op: torch.set_num_threads value (default: TORCH_INTRA_OP_THREADS)
+        inter_op: torch.set_num_interop_threads value (default: TORCH_INTER_OP_THREADS)
+
+    Returns:
+        Effective {"intra_op": ..., "inter_op": ...} thread counts
+    """
+    import torch
+
+    intra_op = intra_op if intra_op is not None else _env_int("TORCH_INTRA_OP_THREADS")
+    inter_op = inter_op if inter_op is not None else _env_int("TORCH_INTER_OP_THREADS")
+    if intra_op:
+        torch.set_num_threads(intra_op)
+    if inter_op:
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError as e:
+            logger.warning(f"Could not set inter-op threads to {inter_op}: {e}")
+
+    threads = {"intra_op": torch.get_num_threads(), "inter_op": torch.get_num_interop_threads()}
+    logger.info("torch threads: intra-op=%d inter-op=%d", threads["intra_op"], threads["inter_op"])
+    return threads
+
+
+def run_warmup(steps: Dict[str, Callable[[], object]], passes: int = WARMUP_PASSES) -> Dict[str, Dict]:
+    """
+    Run each warmup step `passes` times and log first-call vs steady-state latency.
+
+    Stage timings recorded during warmup are labelled endpoint="warmup" in /metrics.
+
+    Args:
+        steps: Step name -> zero-argument callable
+        passes: Calls per step
+
+    Returns:
+        Step name -> {"first_ms", "median_ms", "passes"}
+    """
+    profile = {}
+    with endpoint_label("warmup"):
+        for name, fn in steps.items():
+            times = []
+            for _ in range(passes):
+                start = time.perf_counter()
+                fn()
+                times.append((time.perf_counter() - start) * 1000)
+            if times:
+                steady = times[1:] or times
+                profile[name] = {"first_ms": round(times[0], 2),
+                                 "median_ms": round(statistics.median(steady), 2),
+                                 "passes": len(times)}
+
+    if profile:
+        width = max(len(name) for name in profile)
+        logger.info("Warmup latency profile (%d passes):", passes)
+        for name, p in profile.items():
+            logger.info("  %-*s  first %8.2f ms   steady %8.2f ms", width, name, p["first_ms"], p["median_ms"])
+    return profile
+
+
+class Readiness:
+    """Warmup state behind /ready."""
+
+    def __init__(self, steps: Dict[str, Callable[[], object]], passes: int = WARMUP_PASSES):
+        self.steps = steps
+        self.passes = passes
+        self.ready = threading.Event()
+        self.error: Optional[str] = None
+        self.profile: Dict[str, Dict] = {}
+        self.warmup_seconds: Optional[float] = None
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self, background: bool = True):
+        """Run warmup once (in a daemon thread by default); later calls do nothing."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        if background:
+            threading.Thread(target=self._run, name="warmup", daemon=True).start()
+        else:
+            self._run()
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            self.profile = run_warmup(self.steps, self.passes)
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            logger.exception("Warmup failed")
+            return
+        self.warmup_seconds = time.perf_counter() - start
+        logger.info("Warmup finished in %.2fs, ready", self.warmup_seconds)
+        self.ready.set()
+
+    def status(self) -> Dict:
+        if self.ready.is_set():
+            return {"ready": True, "warmup_seconds": round(self.warmup_seconds, 3), "warmup": self.profile}
+        return {"ready": False, "status": f"warmup failed: {self.error}" if self.error else "warming up"}
+
+
+def install_readiness(app: FastAPI, steps: Dict[str, Callable[[], object]],
+                      passes: int = WARMUP_PASSES, start: bool = not WARMUP_DEFER) -> Readiness:
+    """
+    Add GET /ready to an app and (unless deferred) start warmup in the background.
+
+    Args:
+        app: FastAPI application
+        steps: Warmup step name -> zero-argument callable
+        passes: Calls per step (0: ready immediately)
+        start: Start warmup now; pass False and call readiness.start() later
+            when the process that serves requests is not this one (fork launchers)
+
+    Returns:
+        The Readiness object backing /ready
+    """
+    readiness = Readiness(steps, passes)
+
+    @app.get("/ready", include_in_schema=False)
+    def ready():
+        status = readiness.status()
+        return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+    if start:
+        readiness.start()
+    return readiness
@@ -0,0 +1,290 @@
+"""
+Request metrics for the FastAPI model services.
+
+Records request counts and latency histograms per endpoint, plus per-stage
+latency breakdowns (fetch, decode, tokenize, forward, serialize, remote_call, ...),
+and exposes everything in Prometheus text format on /metrics.
+
+Usage:
+    from service_metrics import install_metrics, stage
+
+    app = FastAPI()
+    install_metrics(app, service="embeddings")
+
+    @app.post("/dense-embed")
+    def denseEncode(req):
+        with stage("forward"):
+            ...
+"""
+
+import logging
+import math
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+
+# Latency buckets in seconds, from sub-millisecond tokenization up to slow image fetches
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Fraction of requests whose payloads are logged at DEBUG (see log_sampled)
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.01"))
+
+# Endpoint of the request currently being handled, used to label stage timings:
+# the request's ASGI scope (resolved to its route once routing has run) or a fixed label
+_current_endpoint: ContextVar[Union[Dict, str]] = ContextVar("current_endpoint", default="unknown")
+
+
+class Histogram:
+    """Fixed-bucket latency histogram (Prometheus semantics)."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        """Record one observation."""
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """Return (le, cumulative count) pairs including +Inf."""
+        out = []
+        running = 0
+        for bound, n in zip(self.buckets, self.counts):
+            running += n
+            out.append((_format_float(bound), running))
+        out.append(("+Inf", running + self.counts[-1]))
+        return out
+
+
+class MetricsRegistry:
+    """
+    Thread-safe store of request counters and latency histograms.
+
+    FastAPI runs sync endpoints in a thread pool, so every update goes
+    through a single lock; updates are a handful of integer increments.
+    """
+
+    def __init__(self, service: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.service = service
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.requests: Dict[Tuple[str, str, str], int] = {}
+        self.latency: Dict[str, Histogram] = {}
+        self.stages: Dict[Tuple[str, str], Histogram] = {}
+        self.gauges: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self.gauge_help: Dict[str, str] = {}
+
+    def observe_request(self, endpoint: str, method: str, status: int, seconds: float):
+        """Record one finished request."""
+        with self._lock:
+            key = (endpoint, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            hist = self.latency.get(endpoint)
+            if hist is None:
+                hist = self.latency[endpoint] = Histogram(self.buckets)
+            hist.observe(seconds)
+
+    def observe_stage(self, endpoint: str, stage_name: str, seconds: float):
+        """Record the duration of one stage inside a request."""
+        with self._lock:
+            key = (endpoint, stage_name)
+            hist = self.stages.get(key)
+            if hist is None:
+                hist = self.stages[key] = Histogram(self.buckets)
+            hist.observe(seconds)
+
+    def set_gauge(self, name: str, value: float, help_text: str = "", **labels: str):
+        """Set a gauge to an absolute value."""
+        with self._lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+            if help_text:
+                self.gauge_help[name] = help_text
+
+    def render(self) -> str:
+        """Render all metrics in Prometheus text exposition format."""
+        svc = f'service="{self.service}"'
+        lines = []
+        with self._lock:
+            lines.append("# HELP http_requests_total Total HTTP requests handled.")
+            lines.append("# TYPE http_requests_total counter")
+            for (endpoint, method, status), n in sorted(self.requests.items()):
+                lines.append(
+                    f'http_requests_total{{{svc},endpoint="{endpoint}",'
+                    f'method="{method}",status="{status}"}} {n}'
+                )
+
+            lines.append("# HELP http_request_duration_seconds Request latency per endpoint.")
+            lines.append("# TYPE http_request_duration_seconds histogram")
+            for endpoint, hist in sorted(self.latency.items()):
+                _render_histogram(lines, "http_request_duration_seconds",
+                                  f'{svc},endpoint="{endpoint}"', hist)
+
+            lines.append("# HELP request_stage_duration_seconds Latency of stages inside a request.")
+            lines.append("# TYPE request_stage_duration_seconds histogram")
+            for (endpoint, stage_name), hist in sorted(self.stages.items()):
+                _render_histogram(lines, "request_stage_duration_seconds",
+                                  f'{svc},endpoint="{endpoint}",stage="{stage_name}"', hist)
+
+            seen = set()
+            for (name, labels), value in sorted(self.gauges.items()):
+                if name not in seen:
+                    seen.add(name)
+                    if name in self.gauge_help:
+                        lines.append(f"# HELP {name} {self.gauge_help[name]}")
+                    lines.append(f"# TYPE {name} gauge")
+
+                label_str = ",".join([svc] + [f'{k}="{v}"' for k, v in labels])
+                lines.append(f"{name}{{{label_str}}} {_format_float(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_float(value: float) -> str:
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value) if value != int(value) else f"{value:.1f}"
+
+
+def route_label(scope: Dict) -> str:
+    """Endpoint label of a request: its matched route template, or "unmatched"."""
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+def current_endpoint() -> str:
+    """Endpoint label of the request being handled (see route_label), or the endpoint_label() name."""
+    value = _current_endpoint.get()
+    return route_label(value) if isinstance(value, dict) else value
+
+
+def _render_histogram(lines: List[str], name: str, labels: str, hist: Histogram):
+    for le, n in hist.cumulative():
+        lines.append(f'{name}_bucket{{{labels},le="{le}"}} {n}')
+    lines.append(f"{name}_sum{{{labels}}} {hist.sum}")
+    lines.append(f"{name}_count{{{labels}}} {hist.count}")
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware that times every HTTP request.
+
+    The endpoint label is the matched route template (e.g. "/dense-embed"),
+    so unknown paths collapse into a single "unmatched" series.
+    """
+
+    def __init__(self, app, registry: MetricsRegistry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+        # Routing fills in scope["route"] further down; labels read it when they are recorded
+        token = _current_endpoint.set(scope)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.registry.observe_request(route_label(scope), scope.get("method", ""), status["code"], elapsed)
+            _current_endpoint.reset(token)
+
+
+# Registry of the app currently being served (one per process)
+_registry: Optional[MetricsRegistry] = None
+
+
+def get_registry() -> Optional[MetricsRegistry]:
+    """Return the registry installed by install_metrics, if any."""
+    return _registry
+
+
+def install_metrics(app: FastAPI, service: str) -> MetricsRegistry:
+    """
+    Add request timing middleware and a GET /metrics endpoint to an app.
+
+    Args:
+        app: FastAPI application
+        service: Value of the "service" label on every metric
+
+    Returns:
+        The registry backing /metrics
+    """
+    global _registry
+    registry = MetricsRegistry(service)
+    _registry = registry
+    app.add_middleware(MetricsMiddleware, registry=registry)
+
+    @app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+    def metrics():
+        return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+    return registry
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a stage of the current request.
+
+    Stage timings are labelled with the route template of the request being
+    served, like http_requests_total. Outside of an instrumented app this is
+    a no-op timer.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _registry is not None:
+            _registry.observe_stage(current_endpoint(), name, time.perf_counter() - start)
+
+
+@contextmanager
+def endpoint_label(name: str):
+    """
+    Label stage timings recorded outside of a request (warmup, background jobs).
+
+    Inside the block, stage() observations use `name` as their endpoint label.
+    """
+    token = _current_endpoint.set(name)
+    try:
+        yield
+    finally:
+        _current_endpoint.reset(token)
+
+
+def log_sampled(logger, msg: str, *args):
+    """
+    Log a DEBUG message for a random sample of calls.
+
+    Used for per-request payload logging (inputs, vectors) which is too
+    expensive to emit on every request. Rate is LOG_SAMPLE_RATE (default 1%).
+    """
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < LOG_SAMPLE_RATE:
+        logger.debug(msg, *args)
@@ -0,0 +1,78 @@
+"""
+Deterministic character n-gram hashing encoder (the "sparse" embedding channel).
+
+Shared by the /sparse-embed endpoint in get_embeddings.py and the offline
+tools, so offline rankings match what the service indexes. Each character
+n-gram (3..5) of the lower-cased text is hashed with md5 into one of `size`
+buckets; the count vector is L2-normalized.
+
+Usage:
+    from sparse_embedding import ngram_hash_embedding, ngram_hash_embeddings
+
+    vec = ngram_hash_embedding("hearty organic soups")        # (1000,)
+    mat = ngram_hash_embeddings(product_texts)                # (n, 1000) float32
+"""
+
+import hashlib
+import numpy as np
+from typing import Dict, List, Optional
+
+SPARSE_DIM = 1000
+MIN_N = 3
+MAX_N = 5
+
+
+def _bucket(ngram: str, size: int) -> int:
+    return int(hashlib.md5(ngram.encode()).hexdigest(), 16) % size
+
+
+def ngram_hash_embedding(text: str, size: int = SPARSE_DIM,
+                         _buckets: Optional[Dict[str, int]] = None) -> np.ndarray:
+    """
+    Encode one text.
+
+    Args:
+        text: Input text
+        size: Number of hash buckets
+        _buckets: Optional ngram -> bucket memo shared across calls
+
+    Returns:
+        float64 vector of shape (size,), L2-normalized (all zeros for short texts)
+    """
+    vec = np.zeros(size, dtype=float)
+    text = text.lower()
+    for n in range(MIN_N, MAX_N + 1):
+        if len(text) < n:
+            continue
+        for i in range(len(text) - n + 1):
+            ngram = text[i:i + n]
+            if _buckets is None:
+                idx = _bucket(ngram, size)
+            else:
+                idx = _buckets.get(ngram)
+                if idx is None:
+                    idx = _buckets[ngram] = _bucket(ngram, size)
+            vec[idx] += 1.0
+
+    norm = np.linalg.norm(vec)
+    if norm > 0:
+        vec = vec / norm
+    return vec
+
+
+def ngram_hash_embeddings(texts: List[str], size: int = SPARSE_DIM) -> np.ndarray:
+    """
+    Encode many texts, hashing each distinct n-gram only once.
+
+    Args:
+        texts: Input texts
+        size: Number of hash buckets
+
+    Returns:
+        float32 matrix of shape (len(texts), size)
+    """
+    buckets: Dict[str, int] = {}
+    out = np.empty((len(texts), size), dtype=np.float32)
+    for i, text in enumerate(texts):
+        out[i] = ngram_hash_embedding(text, size, buckets)
+    return out
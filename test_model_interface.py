@@ -258,6 +258,25 @@ def test_deterministic_encoding(model):
     print(f"   Same query encoded 3 times produces identical embeddings")
 
 
+def test_length_bucketed_encoding(model, products):
+    """Test 9: Length-bucketed encoding matches the fixed-batch path."""
+    print("\n" + "=" * 80)
+    print("TEST 9: Length-Bucketed Encoding")
+    print("=" * 80)
+
+    expected = model.encode_products(products, show_progress=False)
+    bucketed = model.encode_products(products, show_progress=False,
+                                     length_bucketing=True, max_tokens_per_batch=256)
+    stats = model.last_encode_stats
+
+    print(f"✅ Encoded {len(products)} products in {stats['num_batches']} bucketed batches")
+    print(f"   Padding efficiency: {stats['padding_efficiency']:.1%}")
+
+    assert bucketed.shape == expected.shape, f"Expected shape {expected.shape}, got {bucketed.shape}"
+    assert np.allclose(expected, bucketed, atol=1e-5), "Bucketed embeddings should match input order"
+    print("✅ Bucketed embeddings match the fixed-batch path")
+
+
 def run_all_tests(model_path):
     """Run all tests."""
     print("\n" + "=" * 80)
@@ -289,6 +308,9 @@ def run_all_tests(model_path):
         # Test 8: Deterministic
         test_deterministic_encoding(model)
 
+        # Test 9: Length-bucketed encoding
+        test_length_bucketed_encoding(model, products)
+
         # Summary
         print("\n" + "=" * 80)
         print("✅ ALL TESTS PASSED!")
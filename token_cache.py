@@ -0,0 +1,289 @@
+"""
+On-disk cache of tokenized texts shared by encoding, training and evaluation.
+
+Token ids are stored per tokenizer fingerprint as ragged arrays that are
+memory-mapped on load:
+
+    <cache_dir>/<fingerprint>/CURRENT              name of the live version directory
+    <cache_dir>/<fingerprint>/<version>/hashes.npy    uint64 text hash per entry (sorted)
+    <cache_dir>/<fingerprint>/<version>/offsets.npy   int64 start of each entry in ids.npy (len + 1)
+    <cache_dir>/<fingerprint>/<version>/ids.npy       int32 token ids of all entries, concatenated
+
+New entries are kept in memory and merged into the files by flush() (and
+automatically once the misses outgrow the cache, so a cold build costs O(N)
+I/O, not one rewrite per batch). A merge writes a complete new version
+directory and then swaps CURRENT with a single rename, so readers see either
+the old or the new arrays, never a mix. Writers serialize on a lock file and
+merge on top of whatever version is current when they get the lock.
+
+The fingerprint covers the tokenizer vocabulary/config, max_seq_length and
+lower-casing, so a different tokenizer never reads stale ids. Texts are looked
+up by a 64-bit hash, so each catalog version is tokenized once instead of once
+per encoding pass or epoch.
+
+Usage:
+    from token_cache import TokenCache
+
+    cache = TokenCache.for_model(sentence_transformer, "output/token-cache")
+    token_ids = cache.tokenize(texts, lambda t: model_tokenize(sentence_transformer, t))
+    cache.flush()                               # persist the misses
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import uuid
+import numpy as np
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock
+    fcntl = None
+
+DEFAULT_CACHE_DIR = "output/token-cache"
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = ".lock"
+# Pending misses are merged automatically once there are this many, or as
+# many as the cache already holds (geometric growth keeps merges O(N) overall)
+AUTO_FLUSH_MIN = 100000
+
+
+def text_hashes(texts: Sequence[str]) -> np.ndarray:
+    """64-bit blake2b hash of each text."""
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(t.encode("utf-8"), digest_size=8).digest(), "little")
+         for t in texts),
+        dtype=np.uint64, count=len(texts)
+    )
+
+
+def model_tokenize(model, texts: List[str]) -> List[List[int]]:
+    """
+    Tokenize texts without padding, the same way a SentenceTransformer does.
+
+    Args:
+        model: SentenceTransformer instance
+        texts: List of text strings
+
+    Returns:
+        List of token id lists (special tokens included, truncated to max_seq_length)
+    """
+    if getattr(model[0], "do_lower_case", False):
+        texts = [t.lower() for t in texts]
+    return model.tokenizer(
+        [t.strip() for t in texts],
+        add_special_tokens=True,
+        truncation=True,
+        max_length=model.max_seq_length,
+        return_attention_mask=False,
+        return_token_type_ids=False
+    )["input_ids"]
+
+
+def tokenizer_fingerprint(model) -> str:
+    """
+    Fingerprint the tokenization settings of a SentenceTransformer.
+
+    Args:
+        model: SentenceTransformer instance
+
+    Returns:
+        Hex digest identifying tokenizer vocab/config, max_seq_length and lower-casing
+    """
+    tokenizer = model.tokenizer
+    h = hashlib.sha256()
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        # Truncation/padding are call-time state the tokenizer picks up once used
+        config = json.loads(backend.to_str())
+        config.pop("truncation", None)
+        config.pop("padding", None)
+        h.update(json.dumps(config, sort_keys=True).encode("utf-8"))
+    else:
+        h.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode("utf-8"))
+    h.update(type(tokenizer).__name__.encode("utf-8"))
+    h.update(str(model.max_seq_length).encode("utf-8"))
+    h.update(str(getattr(model[0], "do_lower_case", False)).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+class TokenCache:
+    """Text-hash -> token ids cache for one tokenizer, stored as ragged memmapped arrays."""
+
+    def __init__(self, cache_dir: str, fingerprint: str, read_only: bool = False):
+        """
+        Args:
+            cache_dir: Root cache directory
+            fingerprint: Tokenizer fingerprint (see tokenizer_fingerprint)
+            read_only: Never write; misses are still tokenized and kept in memory
+                (see pop_pending), e.g. in worker processes whose parent merges them
+        """
+        self.path = Path(cache_dir) / fingerprint
+        self.fingerprint = fingerprint
+        self.read_only = read_only
+        self._pending: Dict[int, np.ndarray] = {}
+        self._load()
+
+    @classmethod
+    def for_model(cls, model, cache_dir: str = DEFAULT_CACHE_DIR, read_only: bool = False) -> "TokenCache":
+        """Open the cache for a SentenceTransformer's tokenizer."""
+        return cls(cache_dir, tokenizer_fingerprint(model), read_only)
+
+    def _current_dir(self) -> Path:
+        current = self.path / CURRENT_FILE
+        if current.exists():
+            return self.path / current.read_text().strip()
+        return self.path  # unversioned layout of older caches
+
+    def _load(self):
+        # A writer may delete the version we just read from CURRENT: re-read and retry
+        for attempt in range(3):
+            version = self._current_dir()
+            try:
+                if (version / "hashes.npy").exists():
+                    self.hashes = np.load(version / "hashes.npy", mmap_mode="r")
+                    self.offsets = np.load(version / "offsets.npy", mmap_mode="r")
+                    self.ids = np.load(version / "ids.npy", mmap_mode="r")
+                else:
+                    self.hashes = np.empty(0, dtype=np.uint64)
+                    self.offsets = np.zeros(1, dtype=np.int64)
+                    self.ids = np.empty(0, dtype=np.int32)
+                return
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+
+    def __len__(self) -> int:
+        return len(self.hashes) + len(self._pending)
+
+    def lookup(self, hashes: np.ndarray) -> np.ndarray:
+        """Return the on-disk entry index of each hash, or -1 if not there."""
+        if len(self.hashes) == 0:
+            return np.full(len(hashes), -1, dtype=np.int64)
+        pos = np.searchsorted(self.hashes, hashes)
+        pos_clipped = np.minimum(pos, len(self.hashes) - 1)
+        found = np.asarray(self.hashes)[pos_clipped] == hashes
+        return np.where(found, pos_clipped, -1)
+
+    def entry(self, i: int) -> np.ndarray:
+        """Token ids of on-disk entry i (a view into the memmap)."""
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def tokenize(
+        self,
+        texts: Sequence[str],
+        tokenize_fn: Callable[[List[str]], List[List[int]]]
+    ) -> List[np.ndarray]:
+        """
+        Return token ids for texts, tokenizing only the misses.
+
+        Misses are kept in memory until flush() (or the automatic merge).
+
+        Args:
+            texts: Texts to tokenize
+            tokenize_fn: Tokenizer for cache misses (list of texts -> list of id lists)
+
+        Returns:
+            List of int32 token id arrays, one per text
+        """
+        hashes = text_hashes(texts)
+        index = self.lookup(hashes)
+        result: List[np.ndarray] = [None] * len(texts)
+        to_tokenize: Dict[int, int] = {}  # hash -> first text position
+        for i in np.flatnonzero(index < 0).tolist():
+            h = int(hashes[i])
+            if h not in self._pending:
+                to_tokenize.setdefault(h, i)
+
+        if to_tokenize:
+            new_ids = tokenize_fn([texts[i] for i in to_tokenize.values()])
+            for h, ids in zip(to_tokenize, new_ids):
+                self._pending[h] = np.asarray(ids, dtype=np.int32)
+
+        for i, (h, j) in enumerate(zip(hashes.tolist(), index.tolist())):
+            result[i] = self.entry(j) if j >= 0 else self._pending[h]
+
+        if not self.read_only and len(self._pending) >= max(AUTO_FLUSH_MIN, len(self.hashes)):
+            self.flush()
+        return result
+
+    def _pending_arrays(self) -> Tuple[np.ndarray, List[np.ndarray]]:
+        return np.fromiter(self._pending, dtype=np.uint64, count=len(self._pending)), list(self._pending.values())
+
+    def pop_pending(self) -> Tuple[np.ndarray, List[np.ndarray]]:
+        """Remove and return (hashes, token ids) of the entries not yet merged into the files."""
+        pending = self._pending_arrays()
+        self._pending.clear()
+        return pending
+
+    def add(self, hashes: np.ndarray, token_ids: Sequence[Sequence[int]]):
+        """Queue entries tokenized elsewhere (e.g. a read-only worker's pop_pending) for the next flush."""
+        for h, ids in zip(np.asarray(hashes, dtype=np.uint64).tolist(), token_ids):
+            self._pending.setdefault(h, np.asarray(ids, dtype=np.int32))
+
+    @contextmanager
+    def _lock(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / LOCK_FILE, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def flush(self):
+        """Merge pending entries into a new version of the files and swap it in."""
+        if self.read_only or not self._pending:
+            return
+        with self._lock():
+            # Merge on top of the latest version (another writer may have flushed)
+            self._load()
+            hashes, token_ids = self._pending_arrays()
+            keep = self.lookup(hashes) < 0
+            self._write_merged(hashes[keep], [t for t, k in zip(token_ids, keep) if k])
+        self._pending.clear()
+
+    def _write_merged(self, hashes: np.ndarray, token_ids: List[np.ndarray]):
+        """Write current entries plus new ones as a new version; caller holds the lock."""
+        old_lengths = np.diff(np.asarray(self.offsets))
+        new_lengths = np.array([len(t) for t in token_ids], dtype=np.int64)
+
+        all_hashes = np.concatenate([np.asarray(self.hashes), hashes])
+        all_lengths = np.concatenate([old_lengths, new_lengths])
+        flat_new = (np.concatenate([np.asarray(t, dtype=np.int32) for t in token_ids])
+                    if token_ids else np.empty(0, dtype=np.int32))
+        all_ids = np.concatenate([np.asarray(self.ids), flat_new])
+        starts = np.concatenate([[0], np.cumsum(all_lengths)[:-1]]).astype(np.int64)
+
+        order = np.argsort(all_hashes, kind="stable")
+        sorted_lengths = all_lengths[order]
+        offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(sorted_lengths, out=offsets[1:])
+        # Position of every token of the sorted entries in the unsorted flat array
+        gather = np.repeat(starts[order] - offsets[:-1], sorted_lengths) + np.arange(offsets[-1])
+
+        version = f"v-{uuid.uuid4().hex[:12]}"
+        version_dir = self.path / version
+        version_dir.mkdir(parents=True)
+        np.save(version_dir / "ids.npy", all_ids[gather].astype(np.int32))
+        np.save(version_dir / "offsets.npy", offsets)
+        np.save(version_dir / "hashes.npy", all_hashes[order])
+
+        # The one switch readers observe
+        tmp = self.path / f"{CURRENT_FILE}.tmp"
+        tmp.write_text(version)
+        os.replace(tmp, self.path / CURRENT_FILE)
+
+        # Old versions stay readable for processes that already mapped them (POSIX unlink)
+        for old in self.path.iterdir():
+            if old.is_dir() and old.name != version:
+                shutil.rmtree(old, ignore_errors=True)
+        for name in ("hashes.npy", "offsets.npy", "ids.npy"):
+            (self.path / name).unlink(missing_ok=True)
+        self._load()
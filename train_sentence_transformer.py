@@ -4,85 +4,83 @@ Features:
 - Trains on query-product pairs with relevance scores (0-3)
 - Validates during training
 - Saves best model
+- Fast data pipeline (default): deduplicated, pre-tokenized texts,
+  length-bucketed batches, parallel loading and gradient accumulation
+- Fast validation: unique texts encoded once, optional subsample and early stopping
+
+Usage:
+    python train_sentence_transformer.py
+    python train_sentence_transformer.py --batch-size 16 --grad-accum 4 --workers 4
+    python train_sentence_transformer.py --eval-pairs 5000 --patience 3
+    python train_sentence_transformer.py --legacy-fit   # original model.fit pipeline
 """
-import json
+import argparse
 from sentence_transformers import InputExample, SentenceTransformer, losses
 from sentence_transformers.evaluation import EmbeddingSimilarityEvaluator
+from training_pipeline import PairData, PairSimilarityEvaluator, make_dataloader, train
 from torch.utils.data import DataLoader
 from sklearn.model_selection import train_test_split
+from catalog import Catalog
+from token_cache import DEFAULT_CACHE_DIR
+
+# ============================================================================
+# ARGUMENT PARSING
+# ============================================================================
+parser = argparse.ArgumentParser(description='Fine-tune a sentence transformer for product search')
+parser.add_argument('--epochs', type=int, default=3,
+                    help='Number of training epochs (default: 3)')
+parser.add_argument('--batch-size', type=int, default=16,
+                    help='Pairs per batch (default: 16)')
+parser.add_argument('--grad-accum', type=int, default=1,
+                    help='Batches per optimizer step; effective batch = batch-size * grad-accum (default: 1)')
+parser.add_argument('--workers', type=int, default=2,
+                    help='Data loader worker processes (default: 2)')
+parser.add_argument('--token-cache', default=DEFAULT_CACHE_DIR,
+                    help=f'Pre-tokenized corpus cache directory, "" to disable (default: {DEFAULT_CACHE_DIR})')
+parser.add_argument('--eval-pairs', type=int, default=0,
+                    help='Evaluate on a fixed random subsample of this many validation pairs (default: all)')
+parser.add_argument('--patience', type=int, default=None,
+                    help='Stop after this many evaluations without improvement (default: never)')
+parser.add_argument('--legacy-fit', action='store_true',
+                    help='Use the original InputExample + model.fit pipeline')
+args = parser.parse_args()
 
 # ============================================================================
 # 1. LOAD DATA
 # ============================================================================
-def load_json(path):
-    with open(path, 'r') as f:
-        return json.load(f)
-
 print("Loading data...")
-products = {p['product_id']: p for p in load_json("data/products.json")}
-queries_train = {q['query_id']: q['query'] for q in load_json("data/queries_synth_train.json")}
-labels_train = load_json("data/labels_synth_train.json")
-
-print(f"Loaded {len(products)} products")
-print(f"Loaded {len(queries_train)} queries")
-print(f"Loaded {len(labels_train)} labels")
-
-# ============================================================================
-# 2. FORMAT PRODUCTS
-# ============================================================================
-def format_product(product):
-    """Combine product fields into searchable text."""
-    text_parts = [
-        product.get("title", ""),
-        product.get("description", ""),
-        f"Brand: {product.get('brand', '')}.",
-        f"Category: {product.get('category_path', '')}.",
-        f"Ingredients: {product.get('ingredients', '')}.",
-        f"Warning: {product.get('safety_warning', '')}.",
-    ]
-    return " ".join([t for t in text_parts if t])
+catalog = Catalog.load()
+
+print(f"Loaded {catalog.num_products} products")
+print(f"Loaded {len(catalog.query_ids)} queries")
+print(f"Loaded {len(catalog.label_relevance)} labels")
 
 # ============================================================================
-# 3. CREATE TRAINING EXAMPLES
+# 2. CREATE TRAINING EXAMPLES
 # ============================================================================
+# Product texts come pre-formatted from the catalog (catalog.format_product)
 print("\nCreating training examples...")
-train_examples = []
-
-for label in labels_train:
-    query_id = label['query_id']
-    product_id = label['product_id']
-    relevance = label['relevance']
-    
-    if query_id not in queries_train or product_id not in products:
-        continue
-    
-    query_text = queries_train[query_id]
-    product_text = format_product(products[product_id])
-    normalized_relevance = relevance / 3.0  # scale 0-3 → 0-1
-    
-    train_examples.append(
-        InputExample(texts=[query_text, product_text], label=normalized_relevance)
-    )
+examples = catalog.labelled_examples()
 
-print(f"Created {len(train_examples)} training examples")
+print(f"Created {len(examples)} training examples")
 
 # ============================================================================
-# 4. ANALYZE DATA DISTRIBUTION
+# 3. ANALYZE DATA DISTRIBUTION
 # ============================================================================
 from collections import Counter
-relevance_counts = Counter([ex.label for ex in train_examples])
+relevance_counts = Counter([ex['relevance'] / 3.0 for ex in examples])  # scale 0-3 → 0-1
 print("\nRelevance distribution:")
 for score in sorted(relevance_counts.keys()):
     count = relevance_counts[score]
-    percentage = (count / len(train_examples)) * 100
+    percentage = (count / len(examples)) * 100
     print(f"  {score:.2f}: {count:,} ({percentage:.1f}%)")
 
 # ============================================================================
-# 5. SPLIT INTO TRAIN/VAL
+# 4. SPLIT INTO TRAIN/VAL
 # ============================================================================
 print("\nSplitting into train/validation sets...")
 train_examples, val_examples = train_test_split(
-    train_examples, 
+    examples,
     test_size=0.1,  # 10% for validation
     random_state=42
 )
@@ -94,61 +92,101 @@ print(f"Validation examples: {len(val_examples)}")
 print("\n" + "="*80)
 print("EXAMPLE TRAINING PAIR:")
 print("="*80)
-print(f"Query: {train_examples[0].texts[0]}")
-print(f"Product: {train_examples[0].texts[1][:200]}...")
-print(f"Relevance: {train_examples[0].label:.2f}")
+print(f"Query: {train_examples[0]['query']}")
+print(f"Product: {train_examples[0]['product'][:200]}...")
+print(f"Relevance: {train_examples[0]['relevance'] / 3.0:.2f}")
 print("="*80)
 
 # ============================================================================
-# 6. LOAD PRE-TRAINED MODEL
+# 5. LOAD PRE-TRAINED MODEL
 # ============================================================================
 print("\nLoading pre-trained model...")
 model = SentenceTransformer('all-MiniLM-L6-v2')
 print(f"Model embedding dimension: {model.get_sentence_embedding_dimension()}")
 
 # ============================================================================
-# 7. SETUP TRAINING
+# 6. SETUP TRAINING
 # ============================================================================
 print("\nSetting up training...")
-train_dataloader = DataLoader(train_examples, shuffle=True, batch_size=16)
 train_loss = losses.CosineSimilarityLoss(model)
 
 # Create evaluator
-evaluator = EmbeddingSimilarityEvaluator.from_input_examples(
-    val_examples, 
-    name='validation'
-)
+if args.legacy_fit:
+    val_input_examples = [
+        InputExample(texts=[ex['query'], ex['product']], label=ex['relevance'] / 3.0)
+        for ex in val_examples
+    ]
+    evaluator = EmbeddingSimilarityEvaluator.from_input_examples(
+        val_input_examples,
+        name='validation'
+    )
+else:
+    # Encodes each unique validation query/product once per evaluation
+    evaluator = PairSimilarityEvaluator.from_examples(
+        val_examples,
+        name='validation',
+        max_pairs=args.eval_pairs or None
+    )
+    print(f"Validation: {len(evaluator.pairs):,} pairs over {evaluator.pairs.num_unique:,} unique texts")
+
+if args.legacy_fit:
+    train_input_examples = [
+        InputExample(texts=[ex['query'], ex['product']], label=ex['relevance'] / 3.0)
+        for ex in train_examples
+    ]
+    train_dataloader = DataLoader(train_input_examples, shuffle=True, batch_size=args.batch_size)
+else:
+    pair_data = PairData.from_examples(model, train_examples,
+                                       token_cache_dir=args.token_cache or None)
+    print(f"Unique texts: {len(pair_data.token_ids):,} for {len(pair_data):,} pairs")
+    train_dataloader = make_dataloader(pair_data, batch_size=args.batch_size,
+                                       num_workers=args.workers)
 
 print(f"Batches per epoch: {len(train_dataloader)}")
 
 # ============================================================================
-# 8. TRAIN MODEL
+# 7. TRAIN MODEL
 # ============================================================================
 print("\n" + "="*80)
 print("STARTING TRAINING")
 print("="*80)
 
-num_epochs = 3
+num_epochs = args.epochs
 warmup_steps = 100
 output_path = 'output/heb-semantic-search'
 
-model.fit(
-    train_objectives=[(train_dataloader, train_loss)],
-    epochs=num_epochs,
-    warmup_steps=warmup_steps,
-    output_path=output_path,
-    evaluator=evaluator,
-    evaluation_steps=500,  # Evaluate every 500 steps
-    save_best_model=True,  # Save model with best validation score
-    show_progress_bar=True
-)
+if args.legacy_fit:
+    model.fit(
+        train_objectives=[(train_dataloader, train_loss)],
+        epochs=num_epochs,
+        warmup_steps=warmup_steps,
+        output_path=output_path,
+        evaluator=evaluator,
+        evaluation_steps=500,  # Evaluate every 500 steps
+        save_best_model=True,  # Save model with best validation score
+        show_progress_bar=True
+    )
+else:
+    train(
+        model,
+        train_dataloader,
+        train_loss,
+        epochs=num_epochs,
+        grad_accum_steps=args.grad_accum,
+        warmup_steps=warmup_steps,
+        evaluator=evaluator,
+        evaluation_steps=500,  # Evaluate every 500 optimizer steps
+        output_path=output_path,
+        save_best_model=True,  # Save model with best validation score
+        early_stopping_patience=args.patience
+    )
 
 print("\n" + "="*80)
 print(f"Training complete! Model saved to: {output_path}")
 print("="*80)
 
 # ============================================================================
-# 9. FINAL EVALUATION
+# 8. FINAL EVALUATION
 # ============================================================================
 print("\nRunning final evaluation on validation set...")
 final_score = evaluator(model)
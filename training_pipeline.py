@@ -0,0 +1,437 @@
+"""
+High-throughput training data pipeline for the sentence transformer.
+
+Replaces the one-InputExample-per-label + shuffled DataLoader(batch_size=16)
+setup of train_sentence_transformer.py:
+
+- Deduplicates query and product texts: every distinct text is tokenized once
+  (through the pre-tokenized corpus cache) and pairs only hold row indices
+- Length-bucketed batches: pairs are shuffled, then sorted by length inside
+  large pools, so each batch has similar lengths and little padding
+- Parallel loading: batches are padded in DataLoader worker processes
+- Gradient accumulation for larger effective batches on CPU
+- Reports examples/sec and padding ratio per epoch
+- PairSimilarityEvaluator: encodes each unique validation text once per
+  evaluation, scores pairs with vectorized cosines, optionally on a fixed
+  subsample, and drives early stopping
+
+Usage:
+    from training_pipeline import PairData, PairSimilarityEvaluator, make_dataloader, train
+
+    data = PairData.from_examples(model, train_examples)
+    loader = make_dataloader(data, batch_size=16, num_workers=2)
+    evaluator = PairSimilarityEvaluator.from_examples(val_examples, max_pairs=5000)
+    train(model, loader, losses.CosineSimilarityLoss(model), epochs=3, grad_accum_steps=4,
+          evaluator=evaluator, early_stopping_patience=3)
+"""
+
+import time
+import numpy as np
+import torch
+from typing import Dict, Iterator, List, Optional
+from scipy.stats import pearsonr, spearmanr
+from sentence_transformers.evaluation import SentenceEvaluator
+from torch.utils.data import DataLoader, Dataset, Sampler
+from transformers import get_linear_schedule_with_warmup
+from model_interface_v2 import GrocerySearchModel
+from pair_scoring import PairIndex
+from token_cache import DEFAULT_CACHE_DIR, TokenCache, model_tokenize
+
+
+class PairData:
+    """
+    Deduplicated (query, product, label) training pairs over tokenized text tables.
+
+    Attributes:
+        token_ids: Token ids of every distinct text (queries and products)
+        lengths: Token length of every distinct text
+        left, right: Text index of the query / product side of each pair
+        labels: float32 label of each pair
+    """
+
+    def __init__(self, token_ids: List[np.ndarray], left: np.ndarray,
+                 right: np.ndarray, labels: np.ndarray, pad_id: int = 0):
+        self.token_ids = token_ids
+        self.lengths = np.array([len(t) for t in token_ids], dtype=np.int64)
+        self.left = left
+        self.right = right
+        self.labels = labels
+        self.pad_id = pad_id
+
+    @classmethod
+    def from_examples(
+        cls,
+        model,
+        examples: List[Dict],
+        label_scale: float = 3.0,
+        token_cache_dir: Optional[str] = DEFAULT_CACHE_DIR
+    ) -> "PairData":
+        """
+        Build pair data from labelled examples (see Catalog.labelled_examples).
+
+        Args:
+            model: SentenceTransformer being trained (its tokenizer is used)
+            examples: Dicts with 'query', 'product' (formatted text) and 'relevance'
+            label_scale: Relevance is divided by this (0-3 -> 0-1)
+            token_cache_dir: Pre-tokenized corpus cache directory, or None to disable
+
+        Returns:
+            PairData
+        """
+        text_index: Dict[str, int] = {}
+        texts: List[str] = []
+
+        def intern(text: str) -> int:
+            i = text_index.get(text)
+            if i is None:
+                i = text_index[text] = len(texts)
+                texts.append(text)
+            return i
+
+        left = np.array([intern(ex['query']) for ex in examples], dtype=np.int64)
+        right = np.array([intern(ex['product']) for ex in examples], dtype=np.int64)
+        labels = np.array([ex['relevance'] / label_scale for ex in examples], dtype=np.float32)
+
+        tokenize = lambda batch: model_tokenize(model, batch)
+        if token_cache_dir:
+            cache = TokenCache.for_model(model, token_cache_dir)
+            token_ids = cache.tokenize(texts, tokenize)
+            cache.flush()
+        else:
+            token_ids = [np.asarray(t, dtype=np.int32) for t in tokenize(texts)]
+
+        pad_id = model.tokenizer.pad_token_id or 0
+        return cls(token_ids, left, right, labels, pad_id)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def pair_lengths(self) -> np.ndarray:
+        """Sort key per pair: the longer of its two sides."""
+        return np.maximum(self.lengths[self.left], self.lengths[self.right])
+
+
+class LengthBucketBatchSampler(Sampler):
+    """
+    Yields batches of pair indices with similar lengths, in random order.
+
+    Each epoch the pairs are shuffled and cut into pools of
+    `pool_batches * batch_size`; each pool is sorted by length and split into
+    batches, and the batch order is shuffled again. Pools keep batches random
+    across the epoch while still grouping similar lengths.
+    """
+
+    def __init__(self, lengths: np.ndarray, batch_size: int,
+                 pool_batches: int = 50, seed: int = 42):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.pool_size = batch_size * pool_batches
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        """Change the shuffling seed for the next epoch."""
+        self.epoch = epoch
+
+    def __len__(self) -> int:
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self) -> Iterator[List[int]]:
+        rng = np.random.default_rng(self.seed + self.epoch)
+        order = rng.permutation(len(self.lengths))
+        batches = []
+        for start in range(0, len(order), self.pool_size):
+            pool = order[start:start + self.pool_size]
+            pool = pool[np.argsort(self.lengths[pool], kind="stable")]
+            batches.extend(pool[i:i + self.batch_size] for i in range(0, len(pool), self.batch_size))
+        for b in rng.permutation(len(batches)):
+            yield batches[b].tolist()
+
+
+class _PairDataset(Dataset):
+    """Index-only dataset; padding happens in collate (inside loader workers)."""
+
+    def __init__(self, data: PairData):
+        self.data = data
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __getitem__(self, i: int) -> int:
+        return i
+
+
+class PairCollator:
+    """Pads the query and product sides of a batch of pair indices."""
+
+    def __init__(self, data: PairData):
+        self.data = data
+
+    def __call__(self, indices: List[int]):
+        d = self.data
+        idx = np.asarray(indices)
+        left = GrocerySearchModel.pad_token_ids([d.token_ids[i] for i in d.left[idx]], d.pad_id)
+        right = GrocerySearchModel.pad_token_ids([d.token_ids[i] for i in d.right[idx]], d.pad_id)
+        labels = torch.from_numpy(d.labels[idx])
+        return [left, right], labels
+
+
+def make_dataloader(data: PairData, batch_size: int = 16, num_workers: int = 2,
+                    pool_batches: int = 50, seed: int = 42) -> DataLoader:
+    """
+    Build a length-bucketed DataLoader over pair data.
+
+    Args:
+        data: PairData
+        batch_size: Pairs per (micro-)batch
+        num_workers: Loader worker processes (0 = load in the training process)
+        pool_batches: Batches per length-sorting pool
+        seed: Shuffling seed
+
+    Returns:
+        DataLoader yielding ([query_features, product_features], labels)
+    """
+    sampler = LengthBucketBatchSampler(data.pair_lengths(), batch_size, pool_batches, seed)
+    return DataLoader(
+        _PairDataset(data),
+        batch_sampler=sampler,
+        collate_fn=PairCollator(data),
+        num_workers=num_workers,
+        persistent_workers=num_workers > 0,
+        pin_memory=torch.cuda.is_available()
+    )
+
+
+class PairSimilarityEvaluator(SentenceEvaluator):
+    """
+    Drop-in replacement for EmbeddingSimilarityEvaluator on (query, product, label) pairs.
+
+    EmbeddingSimilarityEvaluator encodes both sides of every pair on each call,
+    so a query or product that appears in many pairs is encoded many times.
+    This evaluator deduplicates the texts once at construction (PairIndex),
+    encodes each unique text once per call and scores only the pairs.
+    Returns the same Pearson/Spearman cosine metrics.
+    """
+
+    def __init__(
+        self,
+        queries: List[str],
+        products: List[str],
+        scores: List[float],
+        name: str = "",
+        batch_size: int = 64,
+        max_pairs: Optional[int] = None,
+        seed: int = 42
+    ):
+        """
+        Args:
+            queries: Query text of each pair
+            products: Product text of each pair
+            scores: Gold similarity of each pair (0-1)
+            name: Metric prefix, e.g. "validation"
+            batch_size: Encoding batch size
+            max_pairs: Evaluate on a fixed random subsample of this many pairs (None = all)
+            seed: Subsampling seed
+        """
+        super().__init__()
+        pairs = np.arange(len(scores))
+        if max_pairs and max_pairs < len(pairs):
+            pairs = np.sort(np.random.default_rng(seed).choice(pairs, max_pairs, replace=False))
+
+        rows = pairs.tolist()
+        self.pairs = PairIndex([queries[i] for i in rows], [products[i] for i in rows])
+        self.scores = np.asarray(scores, dtype=np.float32)[pairs]
+        self.name = name
+        self.batch_size = batch_size
+        self.primary_metric = "spearman_cosine"
+        if name:
+            self.primary_metric = f"{name}_{self.primary_metric}"
+
+    @classmethod
+    def from_examples(cls, examples: List[Dict], label_scale: float = 3.0,
+                      **kwargs) -> "PairSimilarityEvaluator":
+        """
+        Build from labelled examples (see Catalog.labelled_examples).
+
+        Args:
+            examples: Dicts with 'query', 'product' (formatted text) and 'relevance'
+            label_scale: Relevance is divided by this (0-3 -> 0-1)
+            **kwargs: Passed to the constructor (name, batch_size, max_pairs, seed)
+        """
+        return cls(
+            [ex['query'] for ex in examples],
+            [ex['product'] for ex in examples],
+            [ex['relevance'] / label_scale for ex in examples],
+            **kwargs
+        )
+
+    def __call__(self, model, output_path: Optional[str] = None,
+                 epoch: int = -1, steps: int = -1) -> Dict[str, float]:
+        encode = lambda texts: model.encode(
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+        cosines = self.pairs.score(encode, encode)
+
+        metrics = {
+            "pearson_cosine": float(pearsonr(self.scores, cosines)[0]),
+            "spearman_cosine": float(spearmanr(self.scores, cosines)[0])
+        }
+        if self.name:
+            metrics = {f"{self.name}_{k}": v for k, v in metrics.items()}
+        return metrics
+
+
+def padding_ratio(features: List[Dict[str, torch.Tensor]]) -> tuple:
+    """Return (real tokens, padded tokens) for a batch of feature dicts."""
+    real = sum(int(f["attention_mask"].sum()) for f in features)
+    padded = sum(f["attention_mask"].numel() for f in features)
+    return real, padded
+
+
+def _score(evaluator, model) -> float:
+    result = evaluator(model)
+    if isinstance(result, dict):
+        return float(result[evaluator.primary_metric])
+    return float(result)
+
+
+def train(
+    model,
+    loader: DataLoader,
+    loss_model: torch.nn.Module,
+    epochs: int = 3,
+    grad_accum_steps: int = 1,
+    lr: float = 2e-5,
+    warmup_steps: int = 100,
+    max_grad_norm: float = 1.0,
+    evaluator=None,
+    evaluation_steps: int = 500,
+    output_path: Optional[str] = None,
+    save_best_model: bool = True,
+    early_stopping_patience: Optional[int] = None,
+    early_stopping_min_delta: float = 0.0
+) -> Dict:
+    """
+    Train with gradient accumulation, reporting throughput and padding.
+
+    Mirrors SentenceTransformer.fit (AdamW, linear warmup, grad clipping,
+    periodic evaluation, save best model) on top of the bucketed loader.
+
+    Args:
+        model: SentenceTransformer
+        loader: DataLoader from make_dataloader
+        loss_model: Loss module, e.g. losses.CosineSimilarityLoss(model)
+        epochs: Training epochs
+        grad_accum_steps: Micro-batches per optimizer step
+        lr: Learning rate (AdamW, weight decay 0.01)
+        warmup_steps: Linear warmup in optimizer steps
+        max_grad_norm: Gradient clipping norm
+        evaluator: Optional evaluator called as evaluator(model)
+        evaluation_steps: Evaluate every N optimizer steps (0 = only at epoch end)
+        output_path: Where to save the best (or final) model
+        save_best_model: Save on evaluator improvement instead of at the end
+        early_stopping_patience: Stop after this many evaluations without an
+            improvement of more than early_stopping_min_delta (None = never stop)
+        early_stopping_min_delta: Minimum score gain that counts as an improvement
+
+    Returns:
+        Dict with best_score, stopped_early and per-epoch stats
+    """
+    device = model.device
+    loss_model.to(device)
+    # Same optimizer setup as SentenceTransformer.fit: no weight decay on biases/LayerNorm
+    no_decay = ("bias", "LayerNorm.bias", "LayerNorm.weight")
+    params = list(loss_model.named_parameters())
+    optimizer = torch.optim.AdamW([
+        {"params": [p for n, p in params if not any(nd in n for nd in no_decay)], "weight_decay": 0.01},
+        {"params": [p for n, p in params if any(nd in n for nd in no_decay)], "weight_decay": 0.0},
+    ], lr=lr)
+    steps_per_epoch = (len(loader) + grad_accum_steps - 1) // grad_accum_steps
+    scheduler = get_linear_schedule_with_warmup(optimizer, warmup_steps, steps_per_epoch * epochs)
+
+    best_score = None
+    history = []
+    global_step = 0
+    evals_without_improvement = 0
+    stop = False
+
+    def maybe_evaluate(epoch: int):
+        nonlocal best_score, evals_without_improvement, stop
+        if evaluator is None:
+            return
+        eval_start = time.perf_counter()
+        score = _score(evaluator, model)
+        print(f"  Step {global_step}: validation score {score:.4f} "
+              f"({time.perf_counter() - eval_start:.1f}s)")
+        if best_score is None or score > best_score + early_stopping_min_delta:
+            evals_without_improvement = 0
+        else:
+            evals_without_improvement += 1
+        if best_score is None or score > best_score:
+            best_score = score
+            if output_path and save_best_model:
+                model.save(output_path)
+        if early_stopping_patience is not None and evals_without_improvement >= early_stopping_patience:
+            print(f"  No improvement in {evals_without_improvement} evaluations, stopping early")
+            stop = True
+        loss_model.train()
+
+    for epoch in range(epochs):
+        loader.batch_sampler.set_epoch(epoch)
+        loss_model.train()
+        start = time.perf_counter()
+        examples = real_tokens = padded_tokens = micro_batches = 0
+        running_loss = 0.0
+
+        for micro_step, (features, labels) in enumerate(loader, start=1):
+            real, padded = padding_ratio(features)
+            real_tokens += real
+            padded_tokens += padded
+            examples += len(labels)
+
+            # The last accumulation group of an epoch may hold fewer micro-batches
+            group_start = (micro_step - 1) // grad_accum_steps * grad_accum_steps
+            group_size = min(grad_accum_steps, len(loader) - group_start)
+
+            features = [{k: v.to(device) for k, v in f.items()} for f in features]
+            loss = loss_model(features, labels.to(device))
+            (loss / group_size).backward()
+            running_loss += loss.item()
+            micro_batches += 1
+
+            if micro_step % grad_accum_steps == 0 or micro_step == len(loader):
+                torch.nn.utils.clip_grad_norm_(loss_model.parameters(), max_grad_norm)
+                optimizer.step()
+                scheduler.step()
+                optimizer.zero_grad()
+                global_step += 1
+                if evaluation_steps and global_step % evaluation_steps == 0:
+                    maybe_evaluate(epoch)
+                    if stop:
+                        break
+
+        elapsed = time.perf_counter() - start
+        stats = {
+            "epoch": epoch + 1,
+            "examples_per_sec": examples / elapsed if elapsed > 0 else 0.0,
+            "padding_ratio": 1 - real_tokens / padded_tokens if padded_tokens else 0.0,
+            "mean_loss": running_loss / max(1, micro_batches),
+            "seconds": elapsed
+        }
+        history.append(stats)
+        print(f"Epoch {epoch + 1}/{epochs}: {stats['examples_per_sec']:.1f} examples/sec, "
+              f"padding {stats['padding_ratio']:.1%}, loss {stats['mean_loss']:.4f}, "
+              f"{elapsed:.0f}s")
+        if stop:
+            break
+        maybe_evaluate(epoch)
+        if stop:
+            break
+
+    if output_path and (evaluator is None or not save_best_model):
+        model.save(output_path)
+
+    return {"best_score": best_score, "stopped_early": stop, "history": history}
@@ -0,0 +1,147 @@
+"""
+Exact top-k vector search over product embeddings with chunked matrix multiplies.
+
+Queries are scored in blocks against blocks of the product matrix; each block
+product is reduced to its top k with argpartition and merged into a running
+top k, so peak memory is one (query block x product block) score matrix no
+matter how large the catalog or the query set is.
+
+Usage:
+    from vector_search import VectorIndex
+
+    index = VectorIndex.from_store("output/embeddings/dense")
+    rows, scores = index.search(query_embeddings, k=30)     # (n, 30) each
+    product_ids = [[index.ids[r] for r in row] for row in rows]
+"""
+
+import numpy as np
+from typing import Callable, List, Tuple
+from embedding_store import EmbeddingStore
+from pair_scoring import normalize_rows
+
+DEFAULT_QUERY_CHUNK = 1024
+DEFAULT_PRODUCT_CHUNK = 65536
+
+
+def _merge_top_k(scores: np.ndarray, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Keep the k best columns of each row of (scores, rows), unsorted."""
+    if scores.shape[1] <= k:
+        return scores, rows
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(scores, part, axis=1), np.take_along_axis(rows, part, axis=1)
+
+
+def top_k_blocks(
+    queries: np.ndarray,
+    num_rows: int,
+    k: int,
+    score_block: Callable[[np.ndarray, int, int], np.ndarray],
+    query_chunk: int = DEFAULT_QUERY_CHUNK,
+    product_chunk: int = DEFAULT_PRODUCT_CHUNK
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-k rows for every query under any block scoring function.
+
+    Args:
+        queries: (n, ...) query representations, sliced along the first axis
+        num_rows: Number of product rows
+        k: Results per query
+        score_block: score_block(query_block, start, end) -> (len(query_block), end - start)
+            scores of product rows start:end (higher is better)
+        query_chunk: Queries scored per block
+        product_chunk: Product rows scored per block
+
+    Returns:
+        (rows, scores), each (n, min(k, num_rows)), sorted by descending score
+    """
+    k = min(k, num_rows)
+    all_rows = np.empty((len(queries), k), dtype=np.int64)
+    all_scores = np.empty((len(queries), k), dtype=np.float32)
+
+    for q_start in range(0, len(queries), query_chunk):
+        q = queries[q_start:q_start + query_chunk]
+        best_scores = np.empty((len(q), 0), dtype=np.float32)
+        best_rows = np.empty((len(q), 0), dtype=np.int64)
+        for p_start in range(0, num_rows, product_chunk):
+            p_end = min(p_start + product_chunk, num_rows)
+            scores = np.asarray(score_block(q, p_start, p_end), dtype=np.float32)
+            rows = np.broadcast_to(np.arange(p_start, p_end), scores.shape)
+            scores, rows = _merge_top_k(scores, rows, k)
+            best_scores, best_rows = _merge_top_k(
+                np.concatenate([best_scores, scores], axis=1),
+                np.concatenate([best_rows, rows], axis=1), k
+            )
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        all_scores[q_start:q_start + len(q)] = np.take_along_axis(best_scores, order, axis=1)
+        all_rows[q_start:q_start + len(q)] = np.take_along_axis(best_rows, order, axis=1)
+
+    return all_rows, all_scores
+
+
+def top_k(
+    queries: np.ndarray,
+    matrix: np.ndarray,
+    k: int,
+    query_chunk: int = DEFAULT_QUERY_CHUNK,
+    product_chunk: int = DEFAULT_PRODUCT_CHUNK
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Exact top-k rows of `matrix` by dot product for every query.
+
+    Args:
+        queries: (n, dim) query vectors
+        matrix: (m, dim) product vectors (array or np.memmap)
+        k: Results per query
+        query_chunk: Queries scored per block
+        product_chunk: Product rows scored per block
+
+    Returns:
+        (rows, scores), each (n, min(k, m)), sorted by descending score
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+
+    def dot_block(q: np.ndarray, start: int, end: int) -> np.ndarray:
+        return q @ np.asarray(matrix[start:end], dtype=np.float32).T
+
+    return top_k_blocks(queries, len(matrix), k, dot_block, query_chunk, product_chunk)
+
+
+class VectorIndex:
+    """Normalized in-memory product matrix plus row -> product id, searched by cosine."""
+
+    def __init__(self, vectors: np.ndarray, ids: List[str], normalized: bool = False):
+        """
+        Args:
+            vectors: (m, dim) product embeddings
+            ids: Product id of each row
+            normalized: Whether vectors are already L2-normalized
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.vectors = vectors if normalized else normalize_rows(vectors)
+        self.ids = list(ids)
+
+    @classmethod
+    def from_store(cls, path: str) -> "VectorIndex":
+        """Load and normalize an EmbeddingStore."""
+        store = EmbeddingStore(path)
+        return cls(np.asarray(store.vectors), store.ids, normalized=bool(store.meta.get("normalized")))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(self, queries: np.ndarray, k: int = 30,
+               query_chunk: int = DEFAULT_QUERY_CHUNK,
+               product_chunk: int = DEFAULT_PRODUCT_CHUNK) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Cosine top-k for a batch of query embeddings.
+
+        Returns:
+            (rows, scores), each (n, k), best first
+        """
+        queries = normalize_rows(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        return top_k(queries, self.vectors, k, query_chunk, product_chunk)
+
+    def search_ids(self, queries: np.ndarray, k: int = 30) -> List[List[str]]:
+        """Cosine top-k product ids for a batch of query embeddings."""
+        rows, _ = self.search(queries, k)
+        return [[self.ids[r] for r in row] for row in rows.tolist()]